@@ -6,10 +6,44 @@ import shutil
 import zipfile
 import subprocess
 import re
-from urllib.parse import urlparse, parse_qs
+from urllib.parse import urlparse, parse_qs, unquote, quote
+from png_encoding import save_png
+import lazy_colors
+import kit_metadata
+import kit_index
+from download_neka_kit import load_crop_offsets, move_crop_offsets, crop_key, crop_path_key
 
 PORT = 8000
 
+# Bytes collected before a chunk goes to the socket
+STREAM_CHUNK_SIZE = 256 * 1024
+
+class ChunkedWriter:
+    """
+    Write-only file object over a response stream using chunked transfer encoding.
+    close() sends the final empty chunk; without it the client sees an incomplete body.
+    """
+
+    def __init__(self, wfile):
+        self.wfile = wfile
+        self.buffer = bytearray()
+
+    def write(self, data):
+        self.buffer += data
+        if len(self.buffer) >= STREAM_CHUNK_SIZE:
+            self.flush()
+        return len(data)
+
+    def flush(self):
+        if self.buffer:
+            self.wfile.write(b"%X\r\n" % len(self.buffer) + bytes(self.buffer) + b"\r\n")
+            self.buffer.clear()
+
+    def close(self):
+        self.flush()
+        self.wfile.write(b"0\r\n\r\n")
+        self.wfile.flush()
+
 class KitHandler(http.server.SimpleHTTPRequestHandler):
     def do_GET(self):
         parsed_path = urlparse(self.path)
@@ -31,8 +65,32 @@ class KitHandler(http.server.SimpleHTTPRequestHandler):
             else:
                 self.send_api_response(False, "Missing kit or folder params")
             return
+        elif parsed_path.path.startswith('/downloads/') and not os.path.exists(self.translate_path(self.path)):
+            if self.send_lazy_color(unquote(parsed_path.path)[len('/downloads/'):]):
+                return
         return super().do_GET()
 
+    def send_lazy_color(self, rel_path):
+        """
+        Serves items_structured/X-Y/COLOR/N.png of kits downloaded with --lazy,
+        colorizing it from the cached source blob on first request.
+        """
+        kit_folder, _, inner = rel_path.partition('/')
+        base_path = os.path.dirname(os.path.abspath(__file__))
+        try:
+            data = lazy_colors.render(os.path.join(base_path, "downloads", kit_folder), inner)
+        except Exception as e:
+            print(f"[Lazy] Error rendering {rel_path}: {e}")
+            return False
+        if data is None:
+            return False
+        self.send_response(200)
+        self.send_header('Content-Type', 'image/png')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+        return True
+
     def do_POST(self):
         content_length = int(self.headers['Content-Length'])
         post_data = self.rfile.read(content_length)
@@ -119,66 +177,31 @@ class KitHandler(http.server.SimpleHTTPRequestHandler):
                     with open(sep_layers_path, 'r', encoding='utf-8') as f:
                         separated_folders = json.load(f)
                 except: pass
+            # Parsed once per metadata.json version, not once per folder
+            try:
+                meta = kit_metadata.load(kit_path)
+            except Exception as e:
+                print(f"Error reading metadata of {kit_folder}: {e}")
+                meta = None
+            # Folder scans come from the kit index: only folders changed since the last call are listed again
             parts = []
-            for entry in os.listdir(structured_dir):
-                entry_path = os.path.join(structured_dir, entry)
-                if not os.path.isdir(entry_path): continue
-                
-                # No alias resolution needed
-                # real_name, is_aliased = self.resolve_real_folder_name(kit_path, entry)
-                
-                match = re.match(r"^(\d+)-(\d+)$", entry)
-                
-                # If not X-Y even after alias resolution, put it at end
-                if not match:
-                    x, y = 9999, 9999
-                else:
-                    x = int(match.group(1))
-                    y = int(match.group(2))
-                    
-                item_indices = []
-                thumb_pattern = re.compile(r"^thumb_(\d+)\.png$")
-                for f in os.listdir(entry_path):
-                    m = thumb_pattern.match(f)
-                    if m: item_indices.append(int(m.group(1)))
-                num_items = max(item_indices) if item_indices else 0
-                colors = []
-                for sub in os.listdir(entry_path):
-                    if os.path.isdir(os.path.join(entry_path, sub)):
-                        colors.append(sub)
-                
+            for part in kit_index.get_index(kit_path).parts():
+                entry = part['folder']
                 # Count layers per item from metadata
                 item_layer_counts = {}
                 try:
                     match_y = re.match(r"^\d+-(\d+)$", entry)
-                    if match_y:
-                        part_idx = int(match_y.group(1)) - 1
-                        meta_path = os.path.join(kit_path, "metadata.json")
-                        if os.path.exists(meta_path):
-                            with open(meta_path, 'r', encoding='utf-8') as f:
-                                meta = json.load(f)
-                                parts_data = meta.get('data', {}).get('parts', [])
-                                if 0 <= part_idx < len(parts_data):
-                                    items = parts_data[part_idx].get('items', [])
-                                    for item_idx, item_layers in enumerate(items):
-                                        if not isinstance(item_layers, list): item_layers = [item_layers]
-                                        layer_count = 0
-                                        for layer in item_layers:
-                                            if isinstance(layer, dict):
-                                                if layer.get('blob'): layer_count += 1
-                                                addon_textures = layer.get('addonTextures', [])
-                                                layer_count += len(addon_textures)
-                                        item_layer_counts[item_idx + 1] = layer_count
+                    if match_y and meta is not None:
+                        item_layer_counts = meta.part_layer_counts(int(match_y.group(1)) - 1)
                 except Exception as e:
                     print(f"Error reading layer counts for {entry}: {e}")
-                
-                parts.append({
-                    "x": x, "y": y, "folder": entry,
-                    "items_count": num_items, "colors": colors,
+
+                part.update({
                     "is_separated": entry in separated_folders,
                     "item_layer_counts": item_layer_counts,
-                    "has_colors": len(colors) > 0
+                    "has_colors": len(part['colors']) > 0
                 })
+                parts.append(part)
 
             # Check for duplicate X values
             x_counts = {}
@@ -284,6 +307,8 @@ class KitHandler(http.server.SimpleHTTPRequestHandler):
 
             # Rename physical directory
             shutil.move(old_path, new_path)
+            lazy_colors.rename_folders(kit_path, {old_name: new_name})
+            kit_index.invalidate(kit_path, old_name, new_name)
             
             # Rename in merged folder if exists
             old_merged = os.path.join(merged_base, old_name)
@@ -342,76 +367,73 @@ class KitHandler(http.server.SimpleHTTPRequestHandler):
                 return
             
             part_idx = int(match.group(1)) - 1
-            meta_path = os.path.join(kit_path, "metadata.json")
-            
-            if not os.path.exists(meta_path):
+            meta = kit_metadata.load(kit_path)
+            if meta is None:
                 self.send_api_response(False, "Metadata not found")
                 return
             
-            with open(meta_path, 'r', encoding='utf-8') as f:
-                meta = json.load(f)
-                parts_data = meta.get('data', {}).get('parts', [])
-                
-                if part_idx < 0 or part_idx >= len(parts_data):
-                    self.send_api_response(False, "Part index out of range")
-                    return
-                
-                items = parts_data[part_idx].get('items', [])
-                item_idx = item_number - 1
-                
-                if item_idx < 0 or item_idx >= len(items):
-                    self.send_api_response(False, "Item index out of range")
-                    return
+            parts_data = meta.parts
+            
+            if part_idx < 0 or part_idx >= len(parts_data):
+                self.send_api_response(False, "Part index out of range")
+                return
+            
+            items = parts_data[part_idx].get('items', [])
+            item_idx = item_number - 1
+            
+            if item_idx < 0 or item_idx >= len(items):
+                self.send_api_response(False, "Item index out of range")
+                return
+            
+            item_layers = items[item_idx]
+            if not isinstance(item_layers, list):
+                item_layers = [item_layers]
+            
+            # Extract layer details
+            layers_info = []
+            for layer_idx, layer in enumerate(item_layers):
+                if not isinstance(layer, dict):
+                    continue
                 
-                item_layers = items[item_idx]
-                if not isinstance(item_layers, list):
-                    item_layers = [item_layers]
+                # Main blob
+                if layer.get('blob'):
+                    crop = layer.get('crop', {})
+                    layers_info.append({
+                        'type': 'main',
+                        'index': layer_idx,
+                        'blob': layer.get('blob'),
+                        'x': crop.get('x', 0),
+                        'y': crop.get('y', 0),
+                        'w': crop.get('w', 0),
+                        'h': crop.get('h', 0)
+                    })
                 
-                # Extract layer details
-                layers_info = []
-                for layer_idx, layer in enumerate(item_layers):
-                    if not isinstance(layer, dict):
-                        continue
-                    
-                    # Main blob
-                    if layer.get('blob'):
-                        crop = layer.get('crop', {})
+                # Addon textures
+                addon_textures = layer.get('addonTextures', [])
+                for addon_idx, addon in enumerate(addon_textures):
+                    if isinstance(addon, dict) and addon.get('blob'):
+                        addon_crop = addon.get('crop', {})
                         layers_info.append({
-                            'type': 'main',
-                            'index': layer_idx,
-                            'blob': layer.get('blob'),
-                            'x': crop.get('x', 0),
-                            'y': crop.get('y', 0),
-                            'w': crop.get('w', 0),
-                            'h': crop.get('h', 0)
+                            'type': 'addon',
+                            'index': f"{layer_idx}-{addon_idx}",
+                            'blob': addon.get('blob'),
+                            'layer_id': addon.get('layer', ''),
+                            'x': addon_crop.get('x', 0),
+                            'y': addon_crop.get('y', 0),
+                            'w': addon_crop.get('w', 0),
+                            'h': addon_crop.get('h', 0)
                         })
-                    
-                    # Addon textures
-                    addon_textures = layer.get('addonTextures', [])
-                    for addon_idx, addon in enumerate(addon_textures):
-                        if isinstance(addon, dict) and addon.get('blob'):
-                            addon_crop = addon.get('crop', {})
-                            layers_info.append({
-                                'type': 'addon',
-                                'index': f"{layer_idx}-{addon_idx}",
-                                'blob': addon.get('blob'),
-                                'layer_id': addon.get('layer', ''),
-                                'x': addon_crop.get('x', 0),
-                                'y': addon_crop.get('y', 0),
-                                'w': addon_crop.get('w', 0),
-                                'h': addon_crop.get('h', 0)
-                            })
-                
-                self.send_response(200)
-                self.send_header('Content-type', 'application/json')
-                self.end_headers()
-                response = json.dumps({
-                    "success": True,
-                    "layers": layers_info,
-                    "total_count": len(layers_info)
-                })
-                self.wfile.write(response.encode('utf-8'))
-                
+            
+            self.send_response(200)
+            self.send_header('Content-type', 'application/json')
+            self.end_headers()
+            response = json.dumps({
+                "success": True,
+                "layers": layers_info,
+                "total_count": len(layers_info)
+            })
+            self.wfile.write(response.encode('utf-8'))
+            
         except Exception as e:
             self.send_api_response(False, f"Server Error: {str(e)}")
 
@@ -424,6 +446,8 @@ class KitHandler(http.server.SimpleHTTPRequestHandler):
         try:
             from delete_neka_part import delete_part
             success, message = delete_part(kit_folder, int(y_index))
+            # Parts after the deleted one are renumbered
+            kit_index.invalidate(os.path.join(os.path.dirname(os.path.abspath(__file__)), "downloads", kit_folder))
             self.send_api_response(success, message)
         except Exception as e:
             self.send_api_response(False, f"Server Error: {str(e)}")
@@ -477,6 +501,15 @@ class KitHandler(http.server.SimpleHTTPRequestHandler):
 
             # 1. Add files from the target directory (color folder or main folder)
             add_files_from(target_dir, "Color/Sub" if is_subcolor else "Main")
+            if is_subcolor:
+                for entry in lazy_colors.list_virtual(kit_path, folder_name, color):
+                    file_list.append({
+                        "name": entry,
+                        "url": f"/downloads/{kit_folder}/items_structured/{folder_name}/{color}/{entry}",
+                        "is_image": True,
+                        "location": "Color/Sub"
+                    })
+                file_list.sort(key=lambda f: f['name'])
 
             # 2. If inside a color subfolder, ALSO check the parent (Main) folder for specific files like nav.png or common thumbnails
             if is_subcolor:
@@ -543,6 +576,8 @@ class KitHandler(http.server.SimpleHTTPRequestHandler):
             # The frontend should probably send the logic location or we try to find it.
             
             source_path = os.path.join(target_dir, source_file)
+            if not os.path.exists(source_path) and color and color != 'default':
+                lazy_colors.materialize(kit_path, folder_name, color)
             
             # If not found in target_dir (subcolor), check parent
             if not os.path.exists(source_path) and color and color != 'default':
@@ -556,8 +591,9 @@ class KitHandler(http.server.SimpleHTTPRequestHandler):
             
             with Image.open(source_path) as img:
                 img.thumbnail((200, 200))
-                img.save(target_path)
+                save_png(img, target_path, data.get('png_profile'))
             
+            kit_index.invalidate(kit_path, folder_name)
             self.send_api_response(True, f"Created {target_file}")
 
         except Exception as e:
@@ -591,6 +627,8 @@ class KitHandler(http.server.SimpleHTTPRequestHandler):
             # For this simple tool, let's assume we delete from the resolved path.
             
             # Simple resolution:
+            if color and color != 'default':
+                lazy_colors.materialize(os.path.join(base_path, "downloads", kit_folder), folder_name, color)
             path_primary = os.path.join(target_dir, color if color and color != 'default' else "", filename)
             path_parent = os.path.join(target_dir, filename)
 
@@ -603,6 +641,8 @@ class KitHandler(http.server.SimpleHTTPRequestHandler):
                 return
 
             os.remove(target_path)
+            move_crop_offsets(target_dir, removed=[crop_path_key(target_dir, target_path)])
+            kit_index.invalidate(os.path.join(base_path, "downloads", kit_folder), folder_name)
             self.send_api_response(True, f"Deleted {filename}")
 
         except Exception as e:
@@ -624,6 +664,8 @@ class KitHandler(http.server.SimpleHTTPRequestHandler):
             target_dir = os.path.join(base_path, "downloads", kit_folder, "items_structured", folder_name)
             
             # Path Logic
+            if color and color != 'default':
+                lazy_colors.materialize(os.path.join(base_path, "downloads", kit_folder), folder_name, color)
             path_primary = os.path.join(target_dir, color if color and color != 'default' else "", old_name)
             path_parent = os.path.join(target_dir, old_name)
             
@@ -643,6 +685,8 @@ class KitHandler(http.server.SimpleHTTPRequestHandler):
                 return
                 
             os.rename(current_path, new_path)
+            move_crop_offsets(target_dir, moves=[(crop_path_key(target_dir, current_path), crop_path_key(target_dir, new_path))])
+            kit_index.invalidate(os.path.join(base_path, "downloads", kit_folder), folder_name)
             self.send_api_response(True, f"Renamed to {new_name}")
             
         except Exception as e:
@@ -657,6 +701,7 @@ class KitHandler(http.server.SimpleHTTPRequestHandler):
         dest_name = data.get('destination_name', '1')
         color = data.get('color', 'default')
         bulk_apply = data.get('bulk_apply', False)
+        png_profile = data.get('png_profile')
 
         if not kit_folder or not folder_name or not selected_files:
             self.send_api_response(False, "Missing parameters (need kit, folder, selected_files)")
@@ -672,28 +717,19 @@ class KitHandler(http.server.SimpleHTTPRequestHandler):
                 return
 
             print(f"[Merge] Stacking {selected_files} into {dest_name}.png in {folder_name}")
+            lazy_colors.materialize(kit_path, folder_name)
 
             # Load metadata for offsets
             offsets = {} 
             try:
-                match = re.search(r"-(\d+)$", folder_name)
-                if match:
-                    part_idx = int(match.group(1)) - 1
-                    meta_path = os.path.join(kit_path, "metadata.json")
-                    if os.path.exists(meta_path):
-                        with open(meta_path, 'r', encoding='utf-8') as f:
-                            meta = json.load(f)
-                            parts = meta.get('data', {}).get('parts', [])
-                            if 0 <= part_idx < len(parts):
-                                items = parts[part_idx].get('items', [])
-                                for idx, item_layers in enumerate(items):
-                                   if not isinstance(item_layers, list): item_layers = [item_layers]
-                                   if not item_layers: continue
-                                   first_layer = item_layers[0]
-                                   crop = first_layer.get('crop', {})
-                                   offsets[f"{idx + 1}.png"] = {"x": crop.get('x', 0), "y": crop.get('y', 0)}
+                part_idx = kit_metadata.part_index(folder_name)
+                meta = kit_metadata.load(kit_path)
+                if part_idx is not None and meta is not None:
+                    offsets = meta.part_crop_offsets(part_idx)
             except Exception as e:
                 print(f"[Merge] Metadata error: {e}")
+            # Trimmed kits (--crop): exact position of every file, keyed by its path in the part
+            sidecar = load_crop_offsets(structured_dir)
 
             def perform_merge(src, target_fn, files_to_stack, is_default_color=False):
                 if not os.path.exists(src): return False
@@ -714,11 +750,13 @@ class KitHandler(http.server.SimpleHTTPRequestHandler):
                         try:
                             with Image.open(p) as l_img:
                                 x, y = 0, 0
-                                if fn in offsets:
+                                key = crop_path_key(structured_dir, p)
+                                off = {"x": sidecar[key][0], "y": sidecar[key][1]} if key in sidecar else offsets.get(fn)
+                                if off:
                                     w, h = l_img.size
                                     if w < ow or h < oh:
-                                        x = offsets[fn]['x']
-                                        y = offsets[fn]['y']
+                                        x = off['x']
+                                        y = off['y']
                                 img.paste(l_img.convert("RGBA"), (x, y), l_img.convert("RGBA"))
                             valid_merge = True
                         except Exception as e:
@@ -727,7 +765,7 @@ class KitHandler(http.server.SimpleHTTPRequestHandler):
                 if valid_merge:
                     temp_fn = f"_tmp_merge_{target_fn}.png"
                     temp_path = os.path.join(src, temp_fn)
-                    img.save(temp_path)
+                    save_png(img, temp_path, png_profile)
                     
                     for fn in files_to_stack:
                         try:
@@ -754,12 +792,15 @@ class KitHandler(http.server.SimpleHTTPRequestHandler):
                     except Exception as e:
                         shutil.copy2(temp_path, final_path)
                         os.remove(temp_path)
+                    # Sources are gone and the result is full canvas: none of them has an offset any more
+                    move_crop_offsets(structured_dir, removed=[crop_path_key(structured_dir, os.path.join(src, fn))
+                                                               for fn in list(files_to_stack) + [f"{target_fn}.png"]])
 
                     if is_default_color:
                         try:
                             thumb = img.copy()
                             thumb.thumbnail((200, 200))
-                            thumb.save(os.path.join(src, f"thumb_{target_fn}.png"))
+                            save_png(thumb, os.path.join(src, f"thumb_{target_fn}.png"), png_profile)
                         except Exception as e:
                             print(f"[Merge] Error generating thumbnail: {e}")
                     return True
@@ -783,6 +824,7 @@ class KitHandler(http.server.SimpleHTTPRequestHandler):
                     if os.path.isdir(sub) and (not color or d != color):
                         if perform_merge(sub, dest_name, selected_files, is_default_color=False):
                             total_count += 1
+            kit_index.invalidate(kit_path, folder_name)
             self.send_api_response(True, f"Đã ghép xong {total_count} thư mục và lưu thay thế vào {dest_name}.png")
 
         except Exception as e:
@@ -804,6 +846,8 @@ class KitHandler(http.server.SimpleHTTPRequestHandler):
                 self.send_api_response(False, "Folder not found")
                 return
 
+            lazy_colors.materialize(os.path.join(base_path, "downloads", kit_folder), folder_name)
+
             # 1. Collect all images from subfolders
             images_to_move = []
             subfolders = []
@@ -828,6 +872,7 @@ class KitHandler(http.server.SimpleHTTPRequestHandler):
                      except: pass
                  
                  msg = "No images to flatten."
+                 kit_index.invalidate(os.path.join(base_path, "downloads", kit_folder), folder_name)
                  if cleaned > 0: msg += f" Removed {cleaned} empty folders."
                  self.send_api_response(True, msg)
                  return
@@ -845,6 +890,7 @@ class KitHandler(http.server.SimpleHTTPRequestHandler):
             
             next_idx = max(indices) + 1 if indices else 1
             moved_count = 0
+            offset_moves = []
 
             for old_path in images_to_move:
                 new_fn = f"{next_idx}.png"
@@ -857,8 +903,10 @@ class KitHandler(http.server.SimpleHTTPRequestHandler):
                     new_path = os.path.join(target_dir, new_fn)
                 
                 shutil.move(old_path, new_path)
+                offset_moves.append((crop_path_key(target_dir, old_path), new_fn))
                 moved_count += 1
                 next_idx += 1
+            move_crop_offsets(target_dir, moves=offset_moves)
 
             # 3. Remove now empty (or all) color subfolders
             for sub in subfolders:
@@ -866,13 +914,16 @@ class KitHandler(http.server.SimpleHTTPRequestHandler):
                     shutil.rmtree(sub)
                 except Exception as e:
                     print(f"Error removing subfolder {sub}: {e}")
+            move_crop_offsets(target_dir, removed=[os.path.basename(sub) for sub in subfolders])
 
+            kit_index.invalidate(os.path.join(base_path, "downloads", kit_folder), folder_name)
             self.send_api_response(True, f"Successfully moved {moved_count} images to root and removed empty folders.")
 
         except Exception as e:
             self.send_api_response(False, f"Flatten error: {str(e)}")
 
     def handle_list_part_images(self, data):
+        from PIL import Image
         kit_folder = data.get('kit')
         folder_name = data.get('folder')
         color = data.get('color')
@@ -886,47 +937,36 @@ class KitHandler(http.server.SimpleHTTPRequestHandler):
             kit_path = os.path.join(base_path, "downloads", kit_folder)
             target_dir = os.path.join(kit_path, "items_structured", folder_name)
 
+            virtual = []
             if color and color != 'default':
                 target_dir = os.path.join(target_dir, color)
+                # Listing only: toned files of lazy kits stay in the manifest
+                virtual = lazy_colors.list_virtual(kit_path, folder_name, color)
 
-            if not os.path.exists(target_dir):
+            if not os.path.exists(target_dir) and not virtual:
                 self.send_api_response(False, "Directory not found")
                 return
 
             # Load metadata to find offsets
             offsets = {} # filename -> {x, y}
             try:
-                # 1. Identify part index from folder name
-                # Resolve alias first
-                # 1. Identify part index from folder name
-                # No alias resolution
-                
-                match = re.search(r"-(\d+)$", folder_name)
-                if match:
-                    part_idx = int(match.group(1)) - 1
-                    meta_path = os.path.join(kit_path, "metadata.json")
-                    if os.path.exists(meta_path):
-                        with open(meta_path, 'r', encoding='utf-8') as f:
-                            meta = json.load(f)
-                            parts = meta.get('data', {}).get('parts', [])
-                            if 0 <= part_idx < len(parts):
-                                items = parts[part_idx].get('items', [])
-                                for idx, item_layers in enumerate(items):
-                                   # Ensure item_layers is a list
-                                   if not isinstance(item_layers, list): item_layers = [item_layers]
-                                   if not item_layers: continue
-                                   
-                                   # Get offset from first layer
-                                   first_layer = item_layers[0]
-                                   crop = first_layer.get('crop', {})
-                                   x = crop.get('x', 0)
-                                   y = crop.get('y', 0)
-                                   offsets[f"{idx + 1}.png"] = {"x": x, "y": y}
+                # Part index from folder name (no alias resolution), offsets from the item's first layer
+                part_idx = kit_metadata.part_index(folder_name)
+                meta = kit_metadata.load(kit_path)
+                if part_idx is not None and meta is not None:
+                    offsets = meta.part_crop_offsets(part_idx)
             except Exception as e:
                 print(f"Metadata read error: {e}")
+            # Trimmed kits (--crop) store the exact position of every file
+            for key, (x, y) in load_crop_offsets(os.path.join(kit_path, "items_structured", folder_name)).items():
+                fn = key.rpartition("/")[2]
+                if key == crop_key(color, fn):
+                    offsets[fn] = {"x": x, "y": y}
 
             files = []
-            for f in os.listdir(target_dir):
+            on_disk = os.listdir(target_dir) if os.path.exists(target_dir) else []
+            virtual_names = set(virtual)
+            for f in on_disk + virtual:
                 if f.endswith('.png') and f != 'nav.png' and not f.startswith('thumb_'):
                     match = re.search(r"(\d+)", f)
                     order = int(match.group(1)) if match else 999
@@ -934,15 +974,18 @@ class KitHandler(http.server.SimpleHTTPRequestHandler):
                     # Verify if file is full canvas (merged) or cropped component
                     filepath = os.path.join(target_dir, f)
                     try:
-                        with Image.open(filepath) as img:
-                            w, h = img.size
-                            # Standard Neka canvas is usually 1436x1902
-                            if w == 1436 and h == 1902:
-                                x, y = 0, 0
-                            else:
-                                # Fallback to metadata
-                                off = offsets.get(f, {"x": 0, "y": 0})
-                                x, y = off["x"], off["y"]
+                        if f in virtual_names:
+                            size = lazy_colors.virtual_size(kit_path, folder_name, f)
+                        else:
+                            with Image.open(filepath) as img:
+                                size = img.size
+                        # Standard Neka canvas is usually 1436x1902
+                        if size == (1436, 1902):
+                            x, y = 0, 0
+                        else:
+                            # Fallback to metadata
+                            off = offsets.get(f, {"x": 0, "y": 0})
+                            x, y = off["x"], off["y"]
                     except:
                         x, y = 0, 0
 
@@ -969,21 +1012,43 @@ class KitHandler(http.server.SimpleHTTPRequestHandler):
         if not kit_folder:
             self.send_api_response(False, "Missing kit parameter")
             return
+        base_path = os.path.dirname(os.path.abspath(__file__))
+        kit_path = os.path.join(base_path, "downloads", kit_folder)
+        if not os.path.isdir(kit_path):
+            self.send_api_response(False, f"Kit not found: {kit_folder}")
+            return
+        from zip_neka_kit import cached_archive, build_archive
+        archive_path = cached_archive(kit_path)
+        disposition = f"attachment; filename*=UTF-8''{quote(kit_folder)}.zip"
+        if os.path.exists(archive_path):
+            # Unchanged since the last export: served from disk
+            try:
+                with open(archive_path, 'rb') as f:
+                    self.send_response(200)
+                    self.send_header('Content-Type', 'application/zip')
+                    self.send_header('Content-Disposition', disposition)
+                    self.send_header('Content-Length', str(os.fstat(f.fileno()).st_size))
+                    self.end_headers()
+                    shutil.copyfileobj(f, self.wfile, STREAM_CHUNK_SIZE)
+                return
+            except FileNotFoundError:
+                pass   # Pruned by a newer export in the meantime: build it again
+        # The archive is built while it is sent: chunked HTTP/1.1, so a failure midway
+        # reaches the client as a truncated body instead of a complete-looking zip
+        self.protocol_version = "HTTP/1.1"
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/zip')
+        self.send_header('Content-Disposition', disposition)
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        self.close_connection = True
+        stream = ChunkedWriter(self.wfile)
         try:
-            from zip_neka_kit import zip_kit
-            zip_path = zip_kit(kit_folder)
-            if os.path.exists(zip_path):
-                self.send_response(200)
-                self.send_header('Content-Type', 'application/zip')
-                self.send_header('Content-Disposition', f'attachment; filename="{os.path.basename(zip_path)}"')
-                self.send_header('Content-Length', str(os.path.getsize(zip_path)))
-                self.end_headers()
-                with open(zip_path, 'rb') as f:
-                    self.wfile.write(f.read())
-            else:
-                self.send_api_response(False, "Failed to create ZIP file")
+            build_archive(kit_path, archive_path, stream)
+            stream.close()
         except Exception as e:
-            self.send_api_response(False, f"Server Error: {str(e)}")
+            print(f"Zip stream of {kit_folder} aborted: {e}")
 
     def handle_rename_color_folder(self, data):
         kit_folder = data.get('kit')
@@ -1015,8 +1080,11 @@ class KitHandler(http.server.SimpleHTTPRequestHandler):
                 return
             
             # Simple rename
+            lazy_colors.materialize(kit_path, part_folder, old_color)
             os.rename(old_path, new_path)
+            move_crop_offsets(struct_base, moves=[(old_color, new_color)])
             
+            kit_index.invalidate(kit_path, part_folder)
             self.send_api_response(True, f"Renamed color to {new_color}")
 
         except Exception as e:
@@ -1053,6 +1121,8 @@ class KitHandler(http.server.SimpleHTTPRequestHandler):
                 return
 
             file_path = os.path.join(target_dir, filename)
+            if target_dir != struct_base:
+                lazy_colors.materialize(kit_path, folder_name, color)
 
             # Decode base64
             if ',' in file_content:
@@ -1062,7 +1132,10 @@ class KitHandler(http.server.SimpleHTTPRequestHandler):
             
             with open(file_path, "wb") as f:
                 f.write(file_bytes)
+            # Replaced by an image of unknown placement
+            move_crop_offsets(struct_base, removed=[crop_path_key(struct_base, file_path)])
             
+            kit_index.invalidate(kit_path, folder_name)
             self.send_api_response(True, f"Uploaded {filename}")
 
         except Exception as e:
@@ -1077,6 +1150,7 @@ class KitHandler(http.server.SimpleHTTPRequestHandler):
 class ThreadedHTTPServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
     daemon_threads = True
 
-print(f"Server starting at http://localhost:{PORT}")
-with ThreadedHTTPServer(("", PORT), KitHandler) as httpd:
-    httpd.serve_forever()
+if __name__ == "__main__":
+    print(f"Server starting at http://localhost:{PORT}")
+    with ThreadedHTTPServer(("", PORT), KitHandler) as httpd:
+        httpd.serve_forever()
@@ -0,0 +1,172 @@
+import sys
+import time
+import random
+import tracemalloc
+
+from download_neka_kit import decompress, decode_b62_full, B62_ALPHABET
+
+# ============= REFERENCE (previous recursive implementation) =============
+
+def decode_b62_full_recursive(s):
+    base_map = {c: i for i, c in enumerate(B62_ALPHABET)}
+    val = 0
+    for c in s:
+        if c in base_map:
+            val = val * 62 + base_map[c]
+    return val
+
+def decompress_recursive(val, vocab, cache):
+    if val in cache:
+        return cache[val]
+    cache[val] = None
+    if val >= len(vocab):
+        return None
+    raw = vocab[val]
+    if not isinstance(raw, str):
+        cache[val] = raw
+        return raw
+    res = raw
+    if raw.startswith("n|"):
+        try:
+            res = raw[2:]
+            if '.' not in res:
+                is_neg = False
+                if res.startswith('-'):
+                    is_neg = True
+                    res = res[1:]
+                num = decode_b62_full_recursive(res)
+                res = -num if is_neg else num
+            else:
+                res = float(res)
+        except:
+            pass
+    elif raw.startswith("s|"):
+        res = raw[2:]
+    elif raw.startswith("a|"):
+        parts = raw.split("|")
+        res = []
+        cache[val] = res
+        for x in parts[1:]:
+            res.append(decompress_recursive(decode_b62_full_recursive(x), vocab, cache))
+    elif raw.startswith("o|"):
+        parts = raw.split("|")
+        keys = decompress_recursive(decode_b62_full_recursive(parts[1]), vocab, cache)
+        values = [decompress_recursive(decode_b62_full_recursive(x), vocab, cache) for x in parts[2:]]
+        res = {}
+        cache[val] = res
+        if isinstance(keys, list) and len(keys) == len(values):
+            for k, v in zip(keys, values):
+                if not isinstance(k, str):
+                    k = str(k)
+                res[k] = v
+        else:
+            res = {"__raw_error__": raw}
+    cache[val] = res
+    return res
+
+# ============= SYNTHETIC VOCAB =============
+
+def encode_b62(n):
+    if n == 0:
+        return "0"
+    out = ""
+    while n:
+        n, r = divmod(n, 62)
+        out = B62_ALPHABET[r] + out
+    return out
+
+class VocabEncoder:
+    """
+    Minimal kitOnSale-style encoder: every distinct value becomes one vocab entry.
+    """
+
+    def __init__(self):
+        self.vocab = []
+        self.index = {}
+
+    def add(self, entry):
+        idx = self.index.get(entry)
+        if idx is None:
+            idx = len(self.vocab)
+            self.vocab.append(entry)
+            self.index[entry] = idx
+        return encode_b62(idx)
+
+    def encode(self, value):
+        if isinstance(value, bool) or value is None:
+            return self.add(f"s|{value}")
+        if isinstance(value, int):
+            return self.add(f"n|{'-' if value < 0 else ''}{encode_b62(abs(value))}")
+        if isinstance(value, float):
+            return self.add(f"n|{value}")
+        if isinstance(value, str):
+            return self.add(f"s|{value}")
+        if isinstance(value, list):
+            return self.add("a|" + "|".join(self.encode(v) for v in value))
+        keys = self.encode(list(value.keys()))
+        return self.add("o|" + keys + "|" + "|".join(self.encode(v) for v in value.values()))
+
+def make_kit(num_parts, items_per_part, seed=1):
+    rng = random.Random(seed)
+    def blob():
+        return "".join(rng.choice(B62_ALPHABET) for _ in range(24))
+    parts = []
+    for p in range(num_parts):
+        items = []
+        for i in range(items_per_part):
+            layer = {"blob": blob(), "crop": {"x": rng.randint(0, 1400), "y": rng.randint(0, 1900), "w": 300, "h": 400}}
+            if rng.random() < 0.3:
+                layer["addonTextures"] = [{"layer": f"al{p}", "blob": blob(), "cover": blob()}]
+            items.append([layer])
+        parts.append({"id": blob(), "name": f"part {p}", "zIndex": p, "cover": blob(), "toning": f"t{p % 20}", "items": items})
+    tonings = [{"id": f"t{t}", "filters": [{"gradients": [{"offset": 0, "color": "#%06x" % rng.randrange(1 << 24)},
+                                                         {"offset": round(rng.random(), 3), "color": "#ffffff"}]}
+                                           for _ in range(8)]} for t in range(20)]
+    return {"id": 1, "name": "bench", "data": {"parts": parts, "tonings": tonings, "layerHeights": []}}
+
+def make_deep_vocab(depth):
+    """
+    Vocab for [[[..."leaf"..., 1], 1], 1] nested depth times; returns (vocab, root index).
+    """
+    vocab = ["s|leaf", "n|1"]
+    for i in range(depth):
+        prev = 0 if i == 0 else len(vocab) - 1
+        vocab.append(f"a|{encode_b62(prev)}|1")
+    return vocab, len(vocab) - 1
+
+def measure(fn, vocab, root):
+    tracemalloc.start()
+    t = time.perf_counter()
+    result = fn(root, vocab, {})
+    elapsed = time.perf_counter() - t
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return result, elapsed, peak
+
+if __name__ == "__main__":
+    num_parts = int(sys.argv[1]) if len(sys.argv) > 1 else 300
+    items_per_part = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+
+    enc = VocabEncoder()
+    root = decode_b62_full(enc.encode(make_kit(num_parts, items_per_part)))
+    print(f"Synthetic vocab: {len(enc.vocab)} entries ({num_parts} parts x {items_per_part} items)")
+
+    ref, t_ref, m_ref = measure(decompress_recursive, enc.vocab, root)
+    new, t_new, m_new = measure(decompress, enc.vocab, root)
+    # Timing without tracemalloc overhead
+    t = time.perf_counter(); decompress_recursive(root, enc.vocab, {}); t_ref = time.perf_counter() - t
+    t = time.perf_counter(); decompress(root, enc.vocab, {}); t_new = time.perf_counter() - t
+
+    print(f"{'':<12} {'time (s)':>10} {'peak (MB)':>10}")
+    print(f"{'recursive':<12} {t_ref:>10.3f} {m_ref / 1e6:>10.1f}")
+    print(f"{'iterative':<12} {t_new:>10.3f} {m_new / 1e6:>10.1f}")
+    print(f"Speedup: {t_ref / t_new:.2f}x, identical output: {ref == new}")
+
+    vocab, root = make_deep_vocab(20000)
+    try:
+        decompress_recursive(root, vocab, {})
+        print("Deep (20000 levels): recursive OK")
+    except RecursionError:
+        print("Deep (20000 levels): recursive raised RecursionError")
+    decompress(root, vocab, {})
+    print("Deep (20000 levels): iterative OK")
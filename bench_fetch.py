@@ -0,0 +1,126 @@
+import os
+import sys
+import time
+import random
+import tempfile
+import threading
+import http.server
+import socketserver
+from concurrent.futures import ThreadPoolExecutor
+
+import download_neka_kit
+from download_neka_kit import download_with_retry, configure_http_session
+from fetch_control import FETCH_CONTROL
+from run_stats import STATS
+
+# ============= STUB BLOB HOST =============
+
+class StubHandler(http.server.BaseHTTPRequestHandler):
+    """
+    Serves fake blobs like img2.neka.cc under load: every request waits `latency`
+    seconds (growing with the number of requests in flight) and requests above
+    `capacity` in flight, or a random `error_rate` share, get 429 + Retry-After.
+    server.scripts[name] lists (status, headers) answered to the next GETs of /<name>
+    first (tests/ uses it for exact retry sequences).
+    """
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        server = self.server
+        name = self.path.lstrip("/")
+        with server.lock:
+            server.in_flight += 1
+            load = server.in_flight
+            server.peak = max(server.peak, load)
+            server.requests.append((name, time.monotonic()))
+            script = server.scripts.get(name)
+            scripted = script.pop(0) if script else None
+        try:
+            if scripted:
+                status, headers = scripted
+            elif load > server.capacity or server.rng.random() < server.error_rate:
+                status, headers = 429, {"Retry-After": str(server.retry_after)}
+            else:
+                if server.latency:
+                    time.sleep(server.latency * (1 + load / server.capacity))
+                status, headers = 200, {}
+            if status == 429:
+                with server.lock:
+                    server.throttled += 1
+            body = server.payload if status == 200 else b""
+            self.send_response(status)
+            for key, value in headers.items():
+                self.send_header(key, value)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        finally:
+            with server.lock:
+                server.in_flight -= 1
+
+    def log_message(self, *args):
+        pass
+
+class StubServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    daemon_threads = True
+
+    def get_request(self):
+        # One accepted socket = one TCP connection opened by the client
+        request = super().get_request()
+        with self.lock:
+            self.connections += 1
+        return request
+
+def start_stub(latency=0.05, capacity=12, error_rate=0.0, retry_after=0.2, payload_size=64 * 1024):
+    server = StubServer(("127.0.0.1", 0), StubHandler)
+    server.latency = latency
+    server.capacity = capacity
+    server.error_rate = error_rate
+    server.retry_after = retry_after
+    server.payload = os.urandom(payload_size)
+    server.rng = random.Random(1)
+    server.lock = threading.Lock()
+    server.in_flight = server.peak = server.throttled = server.connections = 0
+    server.scripts = {}
+    server.requests = []
+    server.url = f"http://127.0.0.1:{server.server_address[1]}"
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+# ============= BENCHMARK =============
+
+def run(label, server, blobs, workers, max_workers=None, rate=None, adaptive=True):
+    server.peak = server.throttled = 0
+    FETCH_CONTROL.configure(workers, max_workers, rate, adaptive)
+    threads = FETCH_CONTROL.pool_size(workers)
+    configure_http_session(threads)
+    download_neka_kit.BLOB_BASE_URL = server.url
+    ok = 0
+    with tempfile.TemporaryDirectory() as tmp:
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=threads) as executor:
+            results = executor.map(lambda b: download_with_retry(f"{download_neka_kit.BLOB_BASE_URL}/{b}",
+                                                                 os.path.join(tmp, f"{b}.png"), retries=6), blobs)
+            ok = sum(1 for r in results if r)
+        elapsed = time.perf_counter() - start
+    print(f"{label:<22} {elapsed:>8.2f} {len(blobs) / elapsed:>9.1f} {ok:>6} {server.throttled:>7} "
+          f"{server.peak:>6} {FETCH_CONTROL.current_limit():>6}")
+
+if __name__ == "__main__":
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 400
+    capacity = int(sys.argv[2]) if len(sys.argv) > 2 else 12
+    latency = float(sys.argv[3]) if len(sys.argv) > 3 else 0.05
+
+    # Keep the per-request retry lines out of the table
+    download_neka_kit.print = lambda *a, **k: None
+    server = start_stub(latency=latency, capacity=capacity)
+    blobs = [f"blob{i}" for i in range(count)]
+    print(f"Stub host: {count} blobs, {latency * 1000:.0f} ms latency, 429 above {capacity} in flight")
+    print(f"{'mode':<22} {'time (s)':>8} {'blobs/s':>9} {'ok':>6} {'429s':>7} {'peak':>6} {'limit':>6}")
+    run("fixed 8", server, blobs, 8, adaptive=False)
+    run("fixed 32", server, blobs, 32, adaptive=False)
+    run("adaptive 8..32", server, blobs, 8, 32)
+    run("adaptive + 100 req/s", server, blobs, 8, 32, rate=100)
+    server.error_rate = 0.05
+    run("adaptive, 5% random 429", server, blobs, 8, 32)
+    STATS.print_summary()
@@ -0,0 +1,305 @@
+import os
+import sys
+import time
+import socket
+import sqlite3
+import threading
+from urllib.request import pathname2url
+
+INDEX_NAME = "_index.sqlite3"
+DEFAULT_CACHE_DIR = os.path.join("downloads", "cache_blobs")
+
+# <blob>.png.lock files older than this belong to a process that died mid-download
+LOCK_STALE_SECONDS = 600
+LOCK_POLL_SECONDS = 0.1
+
+SIZE_UNITS = {"K": 1024, "M": 1024 ** 2, "G": 1024 ** 3, "T": 1024 ** 4}
+
+def parse_size(text):
+    """
+    Parses "500M", "20G", "1.5T" or a plain byte count.
+    """
+    text = str(text).strip().upper().rstrip("B")
+    if text and text[-1] in SIZE_UNITS:
+        return int(float(text[:-1]) * SIZE_UNITS[text[-1]])
+    return int(text)
+
+def format_size(num):
+    for unit in ["B", "KB", "MB", "GB"]:
+        if num < 1024:
+            return f"{num:.2f} {unit}"
+        num /= 1024
+    return f"{num:.2f} TB"
+
+class BlobFileLock:
+    """
+    Lock on one blob shared by every process, and every host mounting the same
+    cache folder: <blob>.png.lock is created with O_EXCL and removed on release.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def __enter__(self):
+        while True:
+            try:
+                fd = os.open(self.path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            except FileExistsError:
+                try:
+                    age = time.time() - os.path.getmtime(self.path)
+                except OSError:
+                    continue  # released meanwhile
+                if age > LOCK_STALE_SECONDS:
+                    print(f"Breaking stale lock {self.path}")
+                    try: os.remove(self.path)
+                    except OSError: pass
+                    continue
+                time.sleep(LOCK_POLL_SECONDS)
+                continue
+            with os.fdopen(fd, "w") as f:
+                f.write(f"{socket.gethostname()} {os.getpid()}")
+            return self
+
+    def __exit__(self, *exc):
+        try: os.remove(self.path)
+        except OSError: pass
+        return False
+
+class BlobCache:
+    """
+    Managed store for downloads/cache_blobs/<blob>.png.
+    An SQLite index records size, last access time and source kit of every blob, so
+    membership checks never stat the filesystem and eviction can be done LRU under a byte quota.
+    """
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR):
+        self.cache_dir = cache_dir
+        # Shards and parallel runs may create it at the same moment
+        os.makedirs(cache_dir, exist_ok=True)
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(os.path.join(cache_dir, INDEX_NAME), timeout=30, check_same_thread=False)
+        self.db.execute("CREATE TABLE IF NOT EXISTS blobs (blob TEXT PRIMARY KEY, size INTEGER, last_access REAL, kit TEXT)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS blobs_lru ON blobs (last_access)")
+        self.db.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        self.db.commit()
+        if self.get_meta("indexed") is None:
+            self.rebuild_index()
+
+    def path(self, blob):
+        return os.path.join(self.cache_dir, f"{blob}.png")
+
+    def lock_blob(self, blob):
+        return BlobFileLock(self.path(blob) + ".lock")
+
+    # ----- meta -----
+
+    def get_meta(self, key, default=None):
+        with self.lock:
+            row = self.db.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else default
+
+    def set_meta(self, key, value):
+        with self.lock:
+            self.db.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, str(value)))
+            self.db.commit()
+
+    def get_quota(self):
+        value = self.get_meta("quota")
+        return int(value) if value else None
+
+    def set_quota(self, quota_bytes):
+        self.set_meta("quota", int(quota_bytes) if quota_bytes else "")
+
+    # ----- index -----
+
+    def rebuild_index(self):
+        """
+        One-time scan importing files that were cached before the index existed (and dropping rows for missing files).
+        """
+        print(f"Indexing {self.cache_dir}...")
+        rows = []
+        for entry in os.scandir(self.cache_dir):
+            if entry.is_file() and entry.name.endswith(".png"):
+                st = entry.stat()
+                rows.append((entry.name[:-4], st.st_size, st.st_mtime, None))
+        with self.lock:
+            self.db.execute("DELETE FROM blobs")
+            self.db.executemany("INSERT OR REPLACE INTO blobs (blob, size, last_access, kit) VALUES (?, ?, ?, ?)", rows)
+            self.db.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('indexed', ?)", (str(time.time()),))
+            self.db.commit()
+        print(f"Indexed {len(rows)} cached blobs.")
+
+    def contains(self, blob):
+        with self.lock:
+            return self.db.execute("SELECT 1 FROM blobs WHERE blob = ?", (blob,)).fetchone() is not None
+
+    def known_blobs(self):
+        with self.lock:
+            return {row[0] for row in self.db.execute("SELECT blob FROM blobs")}
+
+    def sizes(self):
+        with self.lock:
+            return {row[0]: row[1] for row in self.db.execute("SELECT blob, size FROM blobs")}
+
+    def add(self, blob, kit=None):
+        """
+        Records a blob that was just written to path(blob).
+        """
+        size = os.path.getsize(self.path(blob))
+        with self.lock:
+            self.db.execute("INSERT OR REPLACE INTO blobs (blob, size, last_access, kit) VALUES (?, ?, ?, ?)",
+                            (blob, size, time.time(), kit))
+            self.db.commit()
+
+    def touch(self, blobs, kit=None):
+        """
+        Marks blobs as recently used (one transaction for the whole batch).
+        """
+        now = time.time()
+        with self.lock:
+            if kit:
+                self.db.executemany("UPDATE blobs SET last_access = ?, kit = ? WHERE blob = ?", [(now, kit, b) for b in blobs])
+            else:
+                self.db.executemany("UPDATE blobs SET last_access = ? WHERE blob = ?", [(now, b) for b in blobs])
+            self.db.commit()
+
+    def forget(self, blob):
+        with self.lock:
+            self.db.execute("DELETE FROM blobs WHERE blob = ?", (blob,))
+            self.db.commit()
+
+    # ----- eviction -----
+
+    def total_size(self):
+        with self.lock:
+            return self.db.execute("SELECT COALESCE(SUM(size), 0) FROM blobs").fetchone()[0]
+
+    def prune(self, quota_bytes=None, protect=None):
+        """
+        Evicts least recently used blobs until the cache fits in quota_bytes (default: stored quota).
+        Returns (evicted count, freed bytes).
+        """
+        quota = quota_bytes if quota_bytes is not None else self.get_quota()
+        if quota is None:
+            return 0, 0
+        protect = protect or set()
+        excess = self.total_size() - quota
+        if excess <= 0:
+            return 0, 0
+
+        evicted, freed = 0, 0
+        with self.lock:
+            rows = self.db.execute("SELECT blob, size FROM blobs ORDER BY last_access ASC").fetchall()
+        victims = []
+        for blob, size in rows:
+            if freed >= excess: break
+            if blob in protect: continue
+            try:
+                os.remove(self.path(blob))
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                print(f"  Could not evict {blob}: {e}")
+                continue
+            victims.append((blob,))
+            evicted += 1
+            freed += size or 0
+        with self.lock:
+            self.db.executemany("DELETE FROM blobs WHERE blob = ?", victims)
+            self.db.commit()
+        return evicted, freed
+
+    def stats(self):
+        with self.lock:
+            count, total, oldest, newest = self.db.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0), MIN(last_access), MAX(last_access) FROM blobs").fetchone()
+            per_kit = self.db.execute(
+                "SELECT COALESCE(kit, '?'), COUNT(*), SUM(size) FROM blobs GROUP BY kit ORDER BY SUM(size) DESC").fetchall()
+        return {
+            "count": count,
+            "total_bytes": total,
+            "quota_bytes": self.get_quota(),
+            "oldest_access": oldest,
+            "newest_access": newest,
+            "per_kit": [{"kit": k, "count": c, "bytes": b} for k, c, b in per_kit]
+        }
+
+    def close(self):
+        with self.lock:
+            self.db.close()
+
+# Shared instance per cache directory, used by the downloader threads
+_caches = {}
+_caches_lock = threading.Lock()
+
+def get_blob_cache(cache_dir=DEFAULT_CACHE_DIR):
+    key = os.path.abspath(cache_dir)
+    with _caches_lock:
+        cache = _caches.get(key)
+        if cache is None:
+            cache = BlobCache(cache_dir)
+            _caches[key] = cache
+        return cache
+
+def read_sizes(cache_dir=DEFAULT_CACHE_DIR):
+    """
+    {blob: size} of a cache folder without creating or updating anything in it (--plan):
+    from the index opened read-only, or from a scan when the folder was never indexed.
+    """
+    if not os.path.isdir(cache_dir):
+        return {}
+    db_path = os.path.join(cache_dir, INDEX_NAME)
+    if os.path.exists(db_path):
+        try:
+            db = sqlite3.connect(f"file:{pathname2url(os.path.abspath(db_path))}?mode=ro", uri=True, timeout=30)
+            try:
+                if db.execute("SELECT 1 FROM meta WHERE key = 'indexed'").fetchone():
+                    return {row[0]: row[1] for row in db.execute("SELECT blob, size FROM blobs")}
+            finally:
+                db.close()
+        except sqlite3.Error as e:
+            print(f"Could not read {db_path}: {e}")
+    return {entry.name[:-4]: entry.stat().st_size for entry in os.scandir(cache_dir)
+            if entry.is_file() and entry.name.endswith(".png")}
+
+def print_stats(cache):
+    st = cache.stats()
+    quota = st['quota_bytes']
+    print(f"Cache: {cache.cache_dir}")
+    print(f"Blobs: {st['count']}")
+    print(f"Size: {format_size(st['total_bytes'])}" + (f" / quota {format_size(quota)}" if quota else " (no quota)"))
+    if st['oldest_access']:
+        print(f"Last access: oldest {time.strftime('%Y-%m-%d %H:%M', time.localtime(st['oldest_access']))}, "
+              f"newest {time.strftime('%Y-%m-%d %H:%M', time.localtime(st['newest_access']))}")
+    for row in st['per_kit'][:20]:
+        print(f"  {row['kit']}: {row['count']} blobs, {format_size(row['bytes'] or 0)}")
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2 or sys.argv[1] not in ("stats", "prune", "reindex"):
+        print("Usage: python blob_cache.py stats")
+        print("       python blob_cache.py prune [--quota 20G]")
+        print("       python blob_cache.py reindex")
+        print("Options: --dir PATH (default downloads/cache_blobs)")
+        sys.exit(1)
+
+    cache_dir = DEFAULT_CACHE_DIR
+    if "--dir" in sys.argv:
+        cache_dir = sys.argv[sys.argv.index("--dir") + 1]
+    cache = BlobCache(cache_dir)
+
+    command = sys.argv[1]
+    if command == "stats":
+        print_stats(cache)
+    elif command == "reindex":
+        cache.rebuild_index()
+    elif command == "prune":
+        quota = None
+        if "--quota" in sys.argv:
+            quota = parse_size(sys.argv[sys.argv.index("--quota") + 1])
+            cache.set_quota(quota)
+        if quota is None and cache.get_quota() is None:
+            print("No quota set. Use: python blob_cache.py prune --quota 20G")
+            sys.exit(1)
+        evicted, freed = cache.prune(quota)
+        print(f"Evicted {evicted} blobs, freed {format_size(freed)}.")
+        print_stats(cache)
@@ -124,6 +124,28 @@ def delete_part(kit_folder, part_y):
                 except Exception as e:
                     print(f"ERROR: Failed to update separated_layers.json: {e}")
 
+            # 4. Synchronize lazy_colors.json (kits downloaded with --lazy)
+            try:
+                from lazy_colors import load_manifest, rename_folders
+                kit_path = os.path.join(base_path, "downloads", kit_folder)
+                manifest, _ = load_manifest(kit_path)
+                if manifest:
+                    folder_map = {}
+                    for folder_name in manifest.get('folders', {}):
+                        match = re.match(r"^(\d+)-(\d+)$", folder_name)
+                        if not match: continue
+                        x = int(match.group(1))
+                        y = int(match.group(2))
+                        if y == part_y:
+                            folder_map[folder_name] = None
+                        elif x > target_x or y > part_y:
+                            new_x = x - 1 if x > target_x else x
+                            new_y = y - 1 if y > part_y else y
+                            folder_map[folder_name] = f"{new_x}-{new_y}"
+                    rename_folders(kit_path, folder_map)
+            except Exception as e:
+                print(f"ERROR: Failed to update lazy_colors.json: {e}")
+
         return True, f"Successfully deleted folders for part index {part_y} and updated both X and Y indices."
 
     except Exception as e:
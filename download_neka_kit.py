@@ -1,12 +1,24 @@
 import os
+import io
 import json
 import time
 import sys
+import re
+import random
 import requests
+import requests.adapters
 import shutil
+import zipfile
+import zlib
+import subprocess
 from PIL import Image
 import numpy as np
 
+from blob_cache import get_blob_cache, read_sizes, parse_size, format_size
+from png_encoding import save_png, PNG_PROFILES
+from run_stats import STATS, merge_timings
+from fetch_control import FETCH_CONTROL, ADAPTIVE_MAX_WORKERS
+
 # Try to import selenium
 try:
     from selenium import webdriver
@@ -17,19 +29,24 @@ try:
 except ImportError:
     webdriver = None
 
+import threading
 import concurrent.futures
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
+
+DEFAULT_WORKERS = 8
 
 # ============= GRADIENT MAPPING FUNCTIONS =============
 
+B62_ALPHABET = "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz"
+B62_TABLE = {c: i for i, c in enumerate(B62_ALPHABET)}
+
 def decode_b62(s):
-    ALPHABET = "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz"
-    base_map = {c: i for i, c in enumerate(ALPHABET)}
     val = 0
     s_clean = s.split('.')[1] if '.' in s else s
     for c in s_clean:
-        if c in base_map:
-            val = val * 62 + base_map[c]
+        d = B62_TABLE.get(c)
+        if d is not None:
+            val = val * 62 + d
     denom = 62 ** len(s_clean)
     return val / denom
 
@@ -37,7 +54,10 @@ def hex_to_rgb(hex_code):
     hex_code = hex_code.lstrip('#')
     return tuple(int(hex_code[i:i+2], 16) for i in (0, 2, 4))
 
-def create_gradient_lut(gradients):
+def normalize_gradient_stops(gradients):
+    """
+    Parses gradient stops into a sorted tuple of (offset, (r, g, b)).
+    """
     parsed = []
     for g in gradients:
         off = g['offset']
@@ -59,133 +79,355 @@ def create_gradient_lut(gradients):
         for i in range(num):
             parsed[i] = (i / (num - 1), parsed[i][1])
 
-    if not parsed: return [(0,0,0)] * 256
+    return tuple(parsed)
 
-    lut = []
-    for i in range(256):
-        pos = i / 255.0
-        start = parsed[0]
-        end = parsed[-1]
-        
-        for j in range(len(parsed) - 1):
-            if parsed[j][0] <= pos <= parsed[j+1][0]:
-                start = parsed[j]
-                end = parsed[j+1]
-                break
-        
-        t_range = end[0] - start[0]
-        if t_range == 0:
-            ratio = 0
-        else:
-            ratio = (pos - start[0]) / t_range
-            
-        c1 = start[1]
-        c2 = end[1]
-        
-        r = int(c1[0] + (c2[0] - c1[0]) * ratio)
-        g = int(c1[1] + (c2[1] - c1[1]) * ratio)
-        b = int(c1[2] + (c2[2] - c1[2]) * ratio)
-        
-        # Clamp values to 0-255 range
-        r = max(0, min(255, r))
-        g = max(0, min(255, g))
-        b = max(0, min(255, b))
-        
-        lut.append((r, g, b))
-        
+# Tonings are shared by many render layers: each distinct set of stops is built once per run
+_lut_cache = {}
+_lut_cache_lock = threading.Lock()
+
+def create_gradient_lut(gradients):
+    """
+    Returns a read-only (256, 3) uint8 array mapping gray level -> RGB.
+    """
+    stops = normalize_gradient_stops(gradients)
+    with _lut_cache_lock:
+        lut = _lut_cache.get(stops)
+    if lut is None:
+        lut = build_gradient_lut(stops)
+        with _lut_cache_lock:
+            _lut_cache[stops] = lut
+    return lut
+
+def build_gradient_lut(stops):
+    if not stops:
+        lut = np.zeros((256, 3), dtype=np.uint8)
+        lut.flags.writeable = False
+        return lut
+
+    offsets = np.array([p[0] for p in stops], dtype=np.float64)
+    colors = np.array([p[1] for p in stops], dtype=np.int64)
+    pos = np.arange(256, dtype=np.float64) / 255.0
+
+    # First segment j with offsets[j] <= pos <= offsets[j+1]; outside all segments we
+    # interpolate (and extrapolate) between the first and last stop.
+    start_idx = np.zeros(256, dtype=np.int64)
+    end_idx = np.full(256, len(stops) - 1, dtype=np.int64)
+    if len(stops) > 1:
+        inside = (offsets[:-1, None] <= pos[None, :]) & (pos[None, :] <= offsets[1:, None])
+        found = inside.any(axis=0)
+        seg = inside.argmax(axis=0)
+        start_idx = np.where(found, seg, 0)
+        end_idx = np.where(found, seg + 1, len(stops) - 1)
+
+    t_start = offsets[start_idx]
+    t_range = offsets[end_idx] - t_start
+    ratio = np.zeros(256, dtype=np.float64)
+    np.divide(pos - t_start, t_range, out=ratio, where=t_range != 0)
+
+    c1 = colors[start_idx]
+    c2 = colors[end_idx]
+    # Same expression as the scalar version so int() truncation and clamping match bit for bit
+    values = c1 + (c2 - c1) * ratio[:, None]
+    lut = np.clip(np.trunc(values), 0, 255).astype(np.uint8)
+    lut.flags.writeable = False
     return lut
 
-def apply_gradient(image_path, lut, output_path):
+def load_gray_planes(image_path):
+    """
+    Returns (gray uint8 array, alpha band) of a source blob.
+    """
+    img = Image.open(image_path).convert("RGBA")
+    return np.array(img.convert("L")), img.getchannel("A")
+
+def colorize_planes(gray_data, alpha, lut):
+    rgb_data = np.asarray(lut, dtype=np.uint8)[gray_data]
+    res_img = Image.fromarray(rgb_data, mode="RGB")
+    res_img.putalpha(alpha)
+    return res_img
+
+def apply_gradient(image_path, lut, output_path, png_profile=None):
+    apply_gradient_batch(image_path, [(lut, output_path)], png_profile)
+
+def apply_gradient_batch(image_path, jobs, png_profile=None, timings=None, bbox=None):
+    """
+    Colorizes one image with many LUTs: the PNG is decoded once and the gray and
+    alpha planes are reused for every (lut, output_path[, thumb_path]) in jobs.
+    A job with a thumb_path also writes that color's thumbnail from the image in memory;
+    output_path may then be None (thumbnail only).
+    timings, when given, accumulates {stage: [seconds, count]} for decode/LUT/encode/write.
+    bbox (left, top, right, bottom) trims every output to that box before colorizing.
+    Returns a list of (path, size) written.
+    """
+    timings = {} if timings is None else timings
     try:
-        img = Image.open(image_path).convert("RGBA")
-        r, g, b, a = img.split()
-        gray = img.convert("L")
-        gray_data = np.array(gray)
-        lut_arr = np.array(lut, dtype=np.uint8)
-        rgb_data = lut_arr[gray_data]
-        res_img = Image.fromarray(rgb_data, mode="RGB")
-        res_img.putalpha(a)
-        res_img.save(output_path)
+        t = time.perf_counter()
+        gray_data, a = load_gray_planes(image_path)
+        if bbox:
+            gray_data = gray_data[bbox[1]:bbox[3], bbox[0]:bbox[2]]
+            a = a.crop(bbox)
+        merge_timings(timings, {"png_decode": [time.perf_counter() - t, 1]})
     except Exception as e:
         print(f"Error coloring {image_path}: {e}")
-        shutil.copy2(image_path, output_path)
+        return [(job[1], copy_atomic(image_path, job[1])) for job in jobs if job[1]]
+
+    written = []
+    for job in jobs:
+        lut, output_path = job[0], job[1]
+        thumb_path = job[2] if len(job) > 2 else None
+        try:
+            t0 = time.perf_counter()
+            res_img = colorize_planes(gray_data, a, lut)
+            merge_timings(timings, {"lut_apply": [time.perf_counter() - t0, 1]})
+            if output_path:
+                t1 = time.perf_counter()
+                buf = io.BytesIO()
+                save_png(res_img, buf, png_profile)
+                t2 = time.perf_counter()
+                written.append((output_path, write_bytes_atomic(buf.getvalue(), output_path)))
+                merge_timings(timings, {"png_encode": [t2 - t1, 1], "write": [time.perf_counter() - t2, 1]})
+        except Exception as e:
+            print(f"Error coloring {image_path}: {e}")
+            if output_path:
+                written.append((output_path, copy_atomic(image_path, output_path)))
+            continue
+        if thumb_path:
+            try:
+                written.append((thumb_path, save_thumbnail(res_img, thumb_path, png_profile, timings)))
+            except Exception as e:
+                print(f"Error creating thumbnail {thumb_path}: {e}")
+    return written
+
+# Same size as /api/create_thumb, which the character creator used to call per item
+THUMB_SIZE = (200, 200)
+
+def save_thumbnail(img, thumb_path, png_profile=None, timings=None):
+    """
+    Writes thumb_N.png from an image already in memory. Returns the file size.
+    """
+    t = time.perf_counter()
+    thumb = img.copy()
+    thumb.thumbnail(THUMB_SIZE)
+    buf = io.BytesIO()
+    save_png(thumb, buf, png_profile)
+    size = write_bytes_atomic(buf.getvalue(), thumb_path)
+    if timings is not None:
+        merge_timings(timings, {"thumbnail": [time.perf_counter() - t, 1]})
+    return size
+
+# ============= ATOMIC WRITES =============
+# Outputs are written to a temp file next to the target and renamed into place, so a
+# killed run never leaves a half-written PNG that looks finished.
+
+def temp_path_for(path):
+    return f"{path}.{os.getpid()}.{threading.get_ident()}.part"
+
+def finish_atomic(tmp_path, path):
+    size = os.path.getsize(tmp_path)
+    os.replace(tmp_path, path)
+    return size
+
+def discard_temp(tmp_path):
+    try: os.remove(tmp_path)
+    except OSError: pass
+
+def copy_atomic(src, path):
+    tmp_path = temp_path_for(path)
+    try:
+        shutil.copy2(src, tmp_path)
+        return finish_atomic(tmp_path, path)
+    except Exception:
+        discard_temp(tmp_path)
+        raise
+
+def write_bytes_atomic(data, path):
+    tmp_path = temp_path_for(path)
+    try:
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        return finish_atomic(tmp_path, path)
+    except Exception:
+        discard_temp(tmp_path)
+        raise
 
 # ============= DECOMPRESSION FUNCTIONS =============
 
 def decode_b62_full(s):
-    ALPHABET = "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz"
-    base_map = {c: i for i, c in enumerate(ALPHABET)}
     val = 0
     for c in s:
-        if c in base_map:
-            val = val * 62 + base_map[c]
+        d = B62_TABLE.get(c)
+        if d is not None:
+            val = val * 62 + d
     return val
 
-def decompress(val, vocab, cache):
-    if val in cache:
-        return cache[val]
-    
-    cache[val] = None 
-    
-    if val >= len(vocab):
-        return None
-        
-    raw = vocab[val]
-    
-    if not isinstance(raw, str):
-        cache[val] = raw
-        return raw
-        
-    res = raw
-    if raw.startswith("n|"):
-        try:
-             res = raw[2:]
-             if '.' not in res:
-                is_neg = False
-                if res.startswith('-'):
-                    is_neg = True
-                    res = res[1:]
-                num = decode_b62_full(res)
-                res = -num if is_neg else num
-             else:
-                res = float(res)
-        except:
-             pass
-    elif raw.startswith("s|"):
-        res = raw[2:]
-    elif raw.startswith("a|"):
-        parts = raw.split("|")
-        res = []
-        cache[val] = res
-        for x in parts[1:]:
-            res.append(decompress(decode_b62_full(x), vocab, cache))
-    elif raw.startswith("o|"):
-        parts = raw.split("|")
-        keys_idx = decode_b62_full(parts[1])
-        keys = decompress(keys_idx, vocab, cache)
-        
-        values = []
-        for x in parts[2:]:
-            values.append(decompress(decode_b62_full(x), vocab, cache))
-            
+def decode_vocab_number(body):
+    """
+    Payload of an "n|" entry: base62 integer (optionally negative) or a plain float.
+    """
+    try:
+        if '.' not in body:
+            if body.startswith('-'):
+                return -decode_b62_full(body[1:])
+            return decode_b62_full(body)
+        return float(body)
+    except:
+        return body
+
+def finish_vocab_frame(frame, cache):
+    v, kind, children, pos, results, raw = frame
+    if kind == 'a':
+        res = results
+    else:
+        keys = results[0]
+        values = results[1:]
         res = {}
-        cache[val] = res
-        
         if isinstance(keys, list) and len(keys) == len(values):
-            for k, v in zip(keys, values):
+            for k, item in zip(keys, values):
                 if not isinstance(k, str):
                     k = str(k)
-                res[k] = v
+                res[k] = item
         else:
             res = {"__raw_error__": raw}
-    else:
-        res = raw
-        
-    cache[val] = res
+    cache[v] = res
     return res
 
+def decompress(val, vocab, cache):
+    """
+    Rebuilds the value at vocab[val]. Uses an explicit stack instead of recursion so deep
+    structures cannot hit RecursionError; visiting order and cache states (including
+    self references) are the same as the original recursive walk.
+    """
+    # Stack frames: [val, kind, children, next child position, results, raw]
+    stack = []
+    vocab_len = len(vocab)
+    pending = val
+
+    while True:
+        v = pending
+        value = None
+        if v in cache:
+            value = cache[v]
+        else:
+            cache[v] = None
+            if v < vocab_len:
+                raw = vocab[v]
+                if not isinstance(raw, str):
+                    value = raw
+                elif raw.startswith("n|"):
+                    value = decode_vocab_number(raw[2:])
+                elif raw.startswith("s|"):
+                    value = raw[2:]
+                elif raw.startswith("a|"):
+                    res = []
+                    cache[v] = res
+                    stack.append([v, 'a', [decode_b62_full(x) for x in raw.split("|")[1:]], 1, res, raw])
+                    pending = stack[-1][2][0]
+                    continue
+                elif raw.startswith("o|"):
+                    parts = raw.split("|")
+                    children = [decode_b62_full(x) for x in parts[1:]]
+                    stack.append([v, 'o', children, 1, [], raw])
+                    pending = children[0]
+                    continue
+                else:
+                    value = raw
+                cache[v] = value
+
+        # Hand the finished value to its parent, closing every frame that is now complete
+        while True:
+            if not stack:
+                return value
+            frame = stack[-1]
+            frame[4].append(value)
+            if frame[3] < len(frame[2]):
+                pending = frame[2][frame[3]]
+                frame[3] += 1
+                break
+            stack.pop()
+            value = finish_vocab_frame(frame, cache)
+
 # ============= DOWNLOAD METADATA =============
 
+BROWSER_USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36"
+
+NEXT_DATA_RE = re.compile(r'<script[^>]*id=["\']__NEXT_DATA__["\'][^>]*>(.*?)</script>', re.DOTALL | re.IGNORECASE)
+
+def extract_next_data(html):
+    """
+    Returns the parsed __NEXT_DATA__ JSON embedded in a Next.js page, or None.
+    """
+    match = NEXT_DATA_RE.search(html)
+    if not match:
+        return None
+    try:
+        return json.loads(match.group(1))
+    except ValueError as e:
+        print(f"Invalid __NEXT_DATA__ JSON: {e}")
+        return None
+
+def save_kit_from_next_data(next_data, output_file):
+    """
+    Decompresses props.pageProps.kitOnSale and writes it to output_file.
+    Returns output_file on success, None otherwise.
+    """
+    print("Obtained __NEXT_DATA__, attempting decompression...")
+    try:
+        props = next_data.get('props', {}).get('pageProps', {})
+        kit_raw = props.get('kitOnSale')
+        
+        if isinstance(kit_raw, list) and len(kit_raw) >= 2:
+            vocab = kit_raw[0]
+            root_str = kit_raw[1]
+            
+            if isinstance(root_str, str):
+                print(f"Decompressing kit with root: {root_str}")
+                cache = {}
+                root_idx = decode_b62_full(root_str)
+                with STATS.timed("decompress"):
+                    final_data = decompress(root_idx, vocab, cache)
+                
+                if final_data:
+                    with open(output_file, 'w', encoding='utf-8') as f:
+                        json.dump(final_data, f, ensure_ascii=False, indent=2)
+                    print(f"Successfully extracted and decompressed data to {output_file}")
+                    return output_file
+        print("No kitOnSale data found in __NEXT_DATA__.")
+    except Exception as e:
+        print(f"Decompression failed: {e}")
+        import traceback
+        traceback.print_exc()
+    return None
+
+def get_clean_data_via_http(url, output_file, timeout=30):
+    """
+    Fast path: the composer page is server rendered, so __NEXT_DATA__ is already in the HTML.
+    """
+    print(f"Fetching page {url}...")
+    try:
+        with STATS.timed("metadata_fetch"):
+            resp = get_http_session().get(url, timeout=timeout, headers={"User-Agent": BROWSER_USER_AGENT})
+    except Exception as e:
+        print(f"HTTP error: {e}")
+        return None
+    if resp.status_code != 200:
+        print(f"HTTP error: {resp.status_code}")
+        return None
+    next_data = extract_next_data(resp.text)
+    if not next_data:
+        print("No __NEXT_DATA__ in page HTML.")
+        return None
+    return save_kit_from_next_data(next_data, output_file)
+
+def get_clean_data(url, output_file, use_browser=False):
+    """
+    Tries the plain HTTP fetch first and only launches Chrome when that fails (or use_browser is set).
+    """
+    if not use_browser:
+        result = get_clean_data_via_http(url, output_file)
+        if result:
+            return result
+        print("HTTP fetch failed, falling back to browser...")
+    return get_clean_data_via_browser(url, output_file)
+
 def get_clean_data_via_browser(url, output_file):
     if not webdriver:
         print("Error: Selenium is not installed.")
@@ -195,45 +437,23 @@ def get_clean_data_via_browser(url, output_file):
     
     chrome_options = Options()
     chrome_options.add_argument("--disable-blink-features=AutomationControlled")
-    chrome_options.add_argument("user-agent=Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36")
+    chrome_options.add_argument(f"user-agent={BROWSER_USER_AGENT}")
 
     driver = webdriver.Chrome(options=chrome_options)
     
     try:
-        driver.get(url)
-        print("Waiting for page / data...")
-        time.sleep(5) 
-        
-        script = "return window.__NEXT_DATA__;"
-        next_data = driver.execute_script(script)
+        with STATS.timed("metadata_fetch"):
+            driver.get(url)
+            print("Waiting for page / data...")
+            time.sleep(5) 
+            
+            script = "return window.__NEXT_DATA__;"
+            next_data = driver.execute_script(script)
         
         driver.quit()
         
         if next_data:
-            print("Obtained __NEXT_DATA__, attempting decompression...")
-            try:
-                props = next_data.get('props', {}).get('pageProps', {})
-                kit_raw = props.get('kitOnSale')
-                
-                if isinstance(kit_raw, list) and len(kit_raw) >= 2:
-                    vocab = kit_raw[0]
-                    root_str = kit_raw[1]
-                    
-                    if isinstance(root_str, str):
-                        print(f"Decompressing kit with root: {root_str}")
-                        cache = {}
-                        root_idx = decode_b62_full(root_str)
-                        final_data = decompress(root_idx, vocab, cache)
-                        
-                        if final_data:
-                            with open(output_file, 'w', encoding='utf-8') as f:
-                                json.dump(final_data, f, ensure_ascii=False, indent=2)
-                            print(f"Successfully extracted and decompressed data to {output_file}")
-                            return output_file
-            except Exception as e:
-                print(f"Decompression failed: {e}")
-                import traceback
-                traceback.print_exc()
+            return save_kit_from_next_data(next_data, output_file)
 
         return None
         
@@ -245,49 +465,497 @@ def get_clean_data_via_browser(url, output_file):
 
 # ============= HELPER FUNCTIONS FOR THREADING =============
 
+BLOB_BASE_URL = "https://img2.neka.cc"
+
+# Shared HTTP session: one connection pool reused by every worker thread (keep-alive, no TLS handshake per blob)
+_http_session = None
+_http_session_lock = threading.Lock()
+
+RETRY_STATUS_CODES = {408, 429, 500, 502, 503, 504}
+BACKOFF_BASE = 0.5
+BACKOFF_MAX = 30.0
+
+def configure_http_session(pool_size=DEFAULT_WORKERS):
+    """
+    (Re)creates the shared session with a connection pool sized to the worker count.
+    """
+    global _http_session
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=max(1, pool_size), pool_block=True)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    with _http_session_lock:
+        old = _http_session
+        _http_session = session
+    if old is not None:
+        old.close()
+    return session
+
+def get_http_session():
+    with _http_session_lock:
+        session = _http_session
+    if session is None:
+        session = configure_http_session()
+    return session
+
+def parse_retry_after(value):
+    """
+    Retry-After is either a number of seconds or an HTTP date. Returns seconds or None.
+    """
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        from email.utils import parsedate_to_datetime
+        from datetime import datetime, timezone
+        when = parsedate_to_datetime(value)
+        return max(0.0, (when - datetime.now(timezone.utc)).total_seconds())
+    except Exception:
+        return None
+
+def compute_backoff(attempt, retry_after=None):
+    """
+    Exponential backoff with full jitter; a server supplied Retry-After wins when present.
+    """
+    if retry_after is not None:
+        return min(retry_after, BACKOFF_MAX)
+    return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * (2 ** attempt)))
+
 def download_with_retry(url, dest_path, timeout=30, retries=3):
+    session = get_http_session()
     for i in range(retries):
+        retry_after = None
+        if i > 0:
+            STATS.incr('retries')
         try:
-            resp = requests.get(url, timeout=timeout)
+            STATS.incr('requests')
+            # The controller decides how many requests are in flight and how fast they start
+            with FETCH_CONTROL.slot() as slot:
+                with STATS.timed("network_fetch"):
+                    resp = session.get(url, timeout=timeout)
+                if resp.status_code in RETRY_STATUS_CODES:
+                    retry_after = parse_retry_after(resp.headers.get('Retry-After'))
+                slot.report(resp.status_code, resp.elapsed.total_seconds(), retry_after)
             if resp.status_code == 200:
-                with open(dest_path, 'wb') as f:
-                    f.write(resp.content)
+                STATS.incr('bytes_received', len(resp.content))
+                write_bytes_atomic(resp.content, dest_path)
                 return True
-            else:
-                print(f"  [Retry {i+1}/{retries}] Failed {url}: {resp.status_code}")
+            print(f"  [Retry {i+1}/{retries}] Failed {url}: {resp.status_code}")
+            if resp.status_code not in RETRY_STATUS_CODES:
+                return False
         except Exception as e:
             print(f"  [Retry {i+1}/{retries}] Error downloading {url}: {e}")
-        time.sleep(2)
+        if i < retries - 1:
+            time.sleep(compute_backoff(i, retry_after))
     return False
 
+# One lock per blob so two tasks sharing a texture never download the same cache file at once
+_blob_locks = {}
+_blob_locks_guard = threading.Lock()
+
+def get_blob_lock(blob):
+    with _blob_locks_guard:
+        lock = _blob_locks.get(blob)
+        if lock is None:
+            lock = threading.Lock()
+            _blob_locks[blob] = lock
+        return lock
+
+# ============= BLOB SOURCES =============
+
+class HttpSource:
+    """
+    The blob host (img2.neka.cc, or base_url). Requests go through FETCH_CONTROL.
+    """
+
+    def __init__(self, base_url=None):
+        self.base_url = base_url
+
+    def __str__(self):
+        return f"http {self.base_url or BLOB_BASE_URL}"
+
+    def fetch(self, blob, dest_path):
+        return download_with_retry(f"{self.base_url or BLOB_BASE_URL}/{blob}", dest_path)
+
+    def size(self, blob, timeout=15):
+        resp = get_http_session().head(f"{self.base_url or BLOB_BASE_URL}/{blob}", timeout=timeout, allow_redirects=True)
+        if resp.status_code == 200 and resp.headers.get('Content-Length'):
+            return int(resp.headers['Content-Length'])
+        return None
+
+    def read(self, blob, timeout=30):
+        resp = get_http_session().get(f"{self.base_url or BLOB_BASE_URL}/{blob}", timeout=timeout)
+        return resp.content if resp.status_code == 200 else None
+
+class MirrorSource:
+    """
+    A local folder of blobs named <blob>.png or <blob> (e.g. a copy on another disk).
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def __str__(self):
+        return f"mirror {self.path}"
+
+    def find(self, blob):
+        for name in (f"{blob}.png", blob):
+            src = os.path.join(self.path, name)
+            if os.path.isfile(src):
+                return src
+        return None
+
+    def fetch(self, blob, dest_path):
+        src = self.find(blob)
+        if src is None:
+            return False
+        copy_atomic(src, dest_path)
+        return True
+
+    def size(self, blob):
+        src = self.find(blob)
+        return os.path.getsize(src) if src else None
+
+    def read(self, blob):
+        src = self.find(blob)
+        if src is None:
+            return None
+        with open(src, 'rb') as f:
+            return f.read()
+
+class CacheSource:
+    """
+    Another cache_blobs folder (looked up through its index, so it is never scanned twice).
+    """
+
+    def __init__(self, cache_dir):
+        self.cache = get_blob_cache(cache_dir)
+
+    def __str__(self):
+        return f"cache {self.cache.cache_dir}"
+
+    def find(self, blob):
+        src = self.cache.path(blob)
+        return src if self.cache.contains(blob) and os.path.isfile(src) else None
+
+    def fetch(self, blob, dest_path):
+        src = self.find(blob)
+        if src is None:
+            return False
+        copy_atomic(src, dest_path)
+        return True
+
+    def size(self, blob):
+        src = self.find(blob)
+        return os.path.getsize(src) if src else None
+
+    def read(self, blob):
+        src = self.find(blob)
+        if src is None:
+            return None
+        with open(src, 'rb') as f:
+            return f.read()
+
+class ZipSource:
+    """
+    A zip archive of blobs (any folder layout inside, <blob>.png or <blob>).
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.zip = zipfile.ZipFile(path)
+        self.names = {}
+        for name in self.zip.namelist():
+            base = name.rsplit("/", 1)[-1]
+            if base:
+                self.names[base[:-4] if base.endswith(".png") else base] = name
+        self.lock = threading.Lock()
+
+    def __str__(self):
+        return f"zip {self.path} ({len(self.names)} blobs)"
+
+    def fetch(self, blob, dest_path):
+        name = self.names.get(blob)
+        if name is None:
+            return False
+        with self.lock:
+            data = self.zip.read(name)
+        write_bytes_atomic(data, dest_path)
+        return True
+
+    def size(self, blob):
+        name = self.names.get(blob)
+        return self.zip.getinfo(name).file_size if name else None
+
+    def read(self, blob):
+        name = self.names.get(blob)
+        if name is None:
+            return None
+        with self.lock:
+            return self.zip.read(name)
+
+def parse_blob_source(spec):
+    """
+    "http", "http(s)://host", "mirror:DIR", "cache:DIR" or "zip:FILE" -> source.
+    """
+    if spec == "http":
+        return HttpSource()
+    if spec.startswith("http://") or spec.startswith("https://"):
+        return HttpSource(spec.rstrip("/"))
+    kind, _, path = spec.partition(":")
+    sources = {"mirror": MirrorSource, "cache": CacheSource, "zip": ZipSource}
+    if kind not in sources or not path:
+        raise ValueError(f"Unknown blob source '{spec}' (use http, mirror:DIR, cache:DIR or zip:FILE)")
+    if not os.path.exists(path):
+        raise ValueError(f"Blob source not found: {path}")
+    return sources[kind](path)
+
+# Tried in order for every blob missing from the local cache (--source, --rebuild)
+BLOB_SOURCES = [HttpSource()]
+
+def set_blob_sources(sources):
+    global BLOB_SOURCES
+    BLOB_SOURCES = list(sources)
+    print("Blob sources: " + (", ".join(str(s) for s in BLOB_SOURCES) or "local cache only"))
+
+def fetch_blob(blob, cache_dir, kit=None):
+    """
+    Makes sure <cache_dir>/<blob>.png exists, taking it from the first BLOB_SOURCES
+    entry that has it. An index entry whose file was deleted behind the cache's back
+    is forgotten and the blob fetched again.
+    Returns the cache path, or None if no source had the blob.
+    """
+    cache = get_blob_cache(cache_dir)
+    cache_path = cache.path(blob)
+    with get_blob_lock(blob):
+        if cache.contains(blob):
+            if os.path.exists(cache_path):
+                return cache_path
+            cache.forget(blob)
+        # Other processes and hosts sharing the cache (shards, parallel runs) use the lock file
+        with cache.lock_blob(blob):
+            if not os.path.exists(cache_path):
+                for source in BLOB_SOURCES:
+                    try:
+                        if source.fetch(blob, cache_path):
+                            break
+                    except Exception as e:
+                        print(f"  {source}: error reading {blob}: {e}")
+                else:
+                    return None
+            cache.add(blob, kit)
+    return cache_path
+
 def process_blob_task(task):
     blob = task['blob']
     current_lut = task['lut']
     filepath = task['filepath']
-    cache_dir = task['cache_dir']
     
     if os.path.exists(filepath):
         return False
 
-    url = f"https://img2.neka.cc/{blob}"
-    cache_path = os.path.join(cache_dir, f"{blob}.png")
-    
-    # Check cache first
-    if not os.path.exists(cache_path):
-        success = download_with_retry(url, cache_path)
-        if not success:
-            return False
+    # The planner already fetched the blob when it sets cache_path; otherwise check cache first
+    cache_path = task.get('cache_path') or fetch_blob(blob, task['cache_dir'])
+    if not cache_path:
+        return False
             
     try:
-        if current_lut:
+        if current_lut is not None:
             apply_gradient(cache_path, current_lut, filepath)
         else:
-            shutil.copy2(cache_path, filepath)
+            copy_atomic(cache_path, filepath)
         return True
     except Exception as e:
         print(f"  Error processing blob {blob}: {e}")
         return False
 
+def get_alpha_geometry(image_path):
+    """
+    Returns {'size': (w, h), 'bbox': alpha bounding box} of a source blob.
+    A fully transparent image keeps its whole canvas as bbox.
+    """
+    with Image.open(image_path) as img:
+        size = img.size
+        bbox = img.convert("RGBA").getchannel("A").getbbox()
+    return {'size': size, 'bbox': bbox or (0, 0) + size}
+
+def process_blob_group(group):
+    """
+    Writes every output of one cached blob (runs in a worker process).
+    group['jobs'] is a list of (lut or None, filepath, kind) with kind "file", "nav" or "thumb".
+    Thumbnails are made from the decoded image of their color, so the blob is decoded once.
+    With group['crop'] item outputs and thumbnails are trimmed to the blob's alpha bounding box.
+    Returns (list of (filepath, size) written, {stage: [seconds, count]}, geometry or None).
+    """
+    cache_path = group['cache_path']
+    written = []
+    timings = {}
+    colorize_jobs = []
+    plain_thumbs = []
+    toned_thumbs = []
+    geometry = None
+    bbox = None
+    if group.get('crop'):
+        try:
+            geometry = get_alpha_geometry(cache_path)
+            if geometry['bbox'] != (0, 0) + geometry['size']:
+                bbox = geometry['bbox']
+        except Exception as e:
+            print(f"  Error reading blob {group['blob']}: {e}")
+    for lut, filepath, kind in group['jobs']:
+        if kind == "thumb":
+            (plain_thumbs if lut is None else toned_thumbs).append((lut, filepath))
+            continue
+        try:
+            if lut is None and bbox and kind == "file":
+                t = time.perf_counter()
+                with Image.open(cache_path) as img:
+                    buf = io.BytesIO()
+                    save_png(img.crop(bbox), buf, group.get('png_profile'))
+                written.append((filepath, write_bytes_atomic(buf.getvalue(), filepath)))
+                merge_timings(timings, {"write": [time.perf_counter() - t, 1]})
+            elif lut is None:
+                t = time.perf_counter()
+                written.append((filepath, copy_atomic(cache_path, filepath)))
+                merge_timings(timings, {"write": [time.perf_counter() - t, 1]})
+            else:
+                colorize_jobs.append([lut, filepath, None])
+        except Exception as e:
+            print(f"  Error processing blob {group['blob']}: {e}")
+    # Attach each toned thumbnail to the colorize job of the same LUT (or add a thumbnail-only job)
+    for lut, thumb_path in toned_thumbs:
+        job = next((j for j in colorize_jobs if j[2] is None and np.array_equal(j[0], lut)), None)
+        if job is None:
+            colorize_jobs.append([lut, None, thumb_path])
+        else:
+            job[2] = thumb_path
+    if colorize_jobs:
+        try:
+            written.extend(apply_gradient_batch(cache_path, colorize_jobs, group.get('png_profile'), timings, bbox))
+        except Exception as e:
+            print(f"  Error processing blob {group['blob']}: {e}")
+    if plain_thumbs:
+        try:
+            with Image.open(cache_path) as img:
+                img.load()
+                if bbox:
+                    img = img.crop(bbox)
+                for _, thumb_path in plain_thumbs:
+                    written.append((thumb_path, save_thumbnail(img, thumb_path, group.get('png_profile'), timings)))
+        except Exception as e:
+            print(f"  Error creating thumbnails for blob {group['blob']}: {e}")
+    return written, timings, geometry
+
+# ============= DOWNLOAD JOURNAL =============
+
+JOURNAL_NAME = "download_journal.jsonl"
+
+class DownloadJournal:
+    """
+    Append-only per-kit record of finished outputs: one JSON line per
+    (blob, color, target) with the byte size written. A restart skips work found
+    here instead of stat'ing every target path.
+    """
+
+    def __init__(self, base_dir, name=JOURNAL_NAME, read_only=False):
+        self.base_dir = base_dir
+        self.path = os.path.join(base_dir, name)
+        self.exists = os.path.exists(self.path)
+        self.lock = threading.Lock()
+        self.entries, lines = self.read_entries(self.path)
+        if read_only:
+            # Lookups only (--plan): never compacted nor opened for writing
+            self.file = None
+            return
+        if lines > 2 * len(self.entries) + 1000:
+            self.compact()
+        self.file = open(self.path, 'a', encoding='utf-8')
+
+    @staticmethod
+    def read_entries(path):
+        """
+        Returns ({target: entry}, line count) of a journal file ({} when missing).
+        """
+        entries = {}
+        lines = 0
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        e = json.loads(line)
+                    except ValueError:
+                        continue  # torn last line from a killed run
+                    entries[e['t']] = e
+                    lines += 1
+        return entries, lines
+
+    def target_key(self, filepath):
+        return os.path.relpath(filepath, self.base_dir).replace("\\", "/")
+
+    def is_done(self, filepath, blob, color):
+        e = self.entries.get(self.target_key(filepath))
+        return e is not None and e.get('b') == blob and e.get('c') == color
+
+    def record(self, filepath, blob, color, size):
+        e = {'t': self.target_key(filepath), 'b': blob, 'c': color, 's': size}
+        with self.lock:
+            self.entries[e['t']] = e
+            self.file.write(json.dumps(e, ensure_ascii=False) + "\n")
+
+    def forget(self, filepath):
+        with self.lock:
+            self.entries.pop(self.target_key(filepath), None)
+
+    def forget_dir(self, dirpath):
+        prefix = self.target_key(dirpath) + "/"
+        with self.lock:
+            for key in [k for k in self.entries if k.startswith(prefix)]:
+                del self.entries[key]
+
+    def move_many(self, pairs):
+        """
+        Re-keys entries after files or folders were renamed on disk. All (old, new) pairs
+        are applied at once, so chains and swaps (A->B, B->C) stay correct.
+        """
+        renames = [(self.target_key(o), self.target_key(n)) for o, n in pairs]
+        with self.lock:
+            moved = {}
+            for old_key, new_key in renames:
+                for key in list(self.entries):
+                    if key == old_key or key.startswith(old_key + "/"):
+                        e = self.entries.pop(key)
+                        e['t'] = new_key + key[len(old_key):]
+                        moved[e['t']] = e
+            self.entries.update(moved)
+
+    def flush(self):
+        with self.lock:
+            self.file.flush()
+
+    def compact(self):
+        """
+        Rewrites the journal from the in-memory entries (needed after forget/move).
+        """
+        reopen = getattr(self, 'file', None) is not None and not self.file.closed
+        if reopen:
+            self.file.close()
+        tmp_path = temp_path_for(self.path)
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            for e in self.entries.values():
+                f.write(json.dumps(e, ensure_ascii=False) + "\n")
+        os.replace(tmp_path, self.path)
+        self.exists = True
+        if reopen:
+            self.file = open(self.path, 'a', encoding='utf-8')
+
+    def close(self):
+        with self.lock:
+            if self.file:
+                self.file.close()
+
 # ============= REORGANIZE KIT =============
 
 def get_color_code_from_filter(filter_data):
@@ -303,18 +971,68 @@ def get_color_code_from_filter(filter_data):
         
     return main_color.replace('#', '').upper()
 
-def reorganize_kit(metadata_path, selected_y=None):
-    print(f"DEBUG: reorganize_kit called with {metadata_path}, selected_y={selected_y}")
-    base_dir = os.path.dirname(metadata_path)
+def collect_kit_blobs(parts, selected_y=None):
+    """
+    Walks parts / items / addonTextures once and counts every blob reference
+    (part cover, main blob, addon blob and addon cover).
+    Returns (dict blob -> reference count in first-seen order, total references).
+    """
+    refs = {}
+    total = 0
+
+    def add(blob):
+        nonlocal total
+        if not blob or not isinstance(blob, str): return
+        refs[blob] = refs.get(blob, 0) + 1
+        total += 1
+
+    for idx, part in enumerate(parts):
+        if not isinstance(part, dict): continue
+        if selected_y is not None and idx + 1 not in selected_y: continue
+        add(part.get('cover'))
+        for item_layers in part.get('items', []):
+            if not isinstance(item_layers, list): item_layers = [item_layers]
+            for l_data in item_layers:
+                if not isinstance(l_data, dict): continue
+                add(l_data.get('blob'))
+                for at in l_data.get('addonTextures', []):
+                    if not isinstance(at, dict): continue
+                    add(at.get('blob'))
+                    add(at.get('cover'))
+    return refs, total
+
+def find_layer_texture(layer, item_layers):
+    """
+    Returns the entry (item layer or addon texture) a render layer takes its blob and crop from, or None.
+    """
+    if not isinstance(item_layers, list): item_layers = [item_layers]
     
-    with open(metadata_path, 'r', encoding='utf-8') as f:
-        kit = json.load(f)
+    for l_data in item_layers:
+        if not isinstance(l_data, dict): continue
         
-    data = kit.get('data', {})
-    parts = data.get('parts', [])
-    tonings = data.get('tonings', [])
-    layer_heights = data.get('layerHeights', [])
-    lh_map = {lh.get('id'): idx + 1 for idx, lh in enumerate(layer_heights)}
+        if layer['type'] == 'main':
+            # Main blob is at root of item_layer object
+            if l_data.get('blob'):
+                return l_data
+        else:
+            # Addon: 'layer' key in addonTexture matches 'id' in addonLayers
+            for at in l_data.get('addonTextures', []):
+                if not isinstance(at, dict): continue
+                if at.get('layer') == layer['addon_id']:
+                    return at
+    return None
+
+def find_layer_blob(layer, item_layers):
+    """
+    Returns the blob used by a render layer (main or addon) inside one item, or None.
+    """
+    texture = find_layer_texture(layer, item_layers)
+    return texture.get('blob') if texture else None
+
+def build_toning_map(tonings):
+    """
+    toning id -> list of {"code": folder code, "gradients": [...]} (duplicate codes get _2, _3...).
+    """
     toning_map = {}
     for t in tonings:
         # Safety check: kit 14368 has strings in tonings array
@@ -346,7 +1064,15 @@ def reorganize_kit(metadata_path, selected_y=None):
             
         toning_map[t_id] = processed_colors
         
-    print(f"Loaded {len(toning_map)} tonings.")
+    return toning_map
+
+def plan_render_layers(data):
+    """
+    Flattens parts + addon layers into the sorted render layer list; layer['seq_x'] is the X of its X-Y folder.
+    """
+    parts = data.get('parts', [])
+    layer_heights = data.get('layerHeights', [])
+    lh_map = {lh.get('id'): idx + 1 for idx, lh in enumerate(layer_heights)}
     
     # --- New Logic: Calculate strictly sequential sorting for ALL layers (Main + Addons) ---
     
@@ -413,10 +1139,39 @@ def reorganize_kit(metadata_path, selected_y=None):
     for seq_idx, layer in enumerate(all_render_layers):
         layer['seq_x'] = seq_idx + 1
         
-    print(f"Identified {len(all_render_layers)} total render layers (Main + Addons)")
-        
-    total_files = 0
+    return all_render_layers
+
+def get_layer_colors(layer, toning_map):
+    # Determine Toning ID and Colors
+    t_id = layer['toning_id']
+    toning_ids = set()
+    if t_id: toning_ids.add(t_id)
+    
+    # Also, we might need fallback colors if specific items override it, 
+    # but for splitting folders, we should stick to the layer's primary toning.
     
+    # Collect colors
+    all_colors_dict = {} 
+    for tid in toning_ids:
+        colors_for_tid = toning_map.get(tid, [])
+        for c in colors_for_tid:
+            code = c["code"]
+            if code not in all_colors_dict:
+                all_colors_dict[code] = c
+    
+    colors = list(all_colors_dict.values())
+    if not colors:
+        colors = [{"code": "default", "gradients": []}]
+    return colors
+
+def plan_kit_tasks(base_dir, all_render_layers, toning_map, cache_dir, selected_y=None, lazy=False):
+    """
+    Walks layers x colors x items and plans every output file of a kit without touching disk.
+    file_counter numbering is decided here, so it does not depend on execution order.
+    Returns (tasks, output folders).
+    """
+    tasks = []
+    dirs = []
     for layer in all_render_layers:
         part = layer['part']
         part_idx = layer['part_idx']
@@ -428,225 +1183,1374 @@ def reorganize_kit(metadata_path, selected_y=None):
         x_value = layer['seq_x']
         folder_name = f"{x_value}-{nav_position}"
         
-        # Determine Toning ID and Colors
-        t_id = layer['toning_id']
-        toning_ids = set()
-        if t_id: toning_ids.add(t_id)
-        
-        # Also, we might need fallback colors if specific items override it, 
-        # but for splitting folders, we should stick to the layer's primary toning.
-        
-        # Collect colors
-        all_colors_dict = {} 
-        for tid in toning_ids:
-            colors_for_tid = toning_map.get(tid, [])
-            for c in colors_for_tid:
-                code = c["code"]
-                if code not in all_colors_dict:
-                    all_colors_dict[code] = c
-        
-        colors = list(all_colors_dict.values())
-        if not colors:
-            colors = [{"code": "default", "gradients": []}]
+        colors = get_layer_colors(layer, toning_map)
             
-        print(f"> Processing Layer: {folder_name} ({layer['type']}) | Colors: {len(colors)}")
+        print(f"> Planning Layer: {folder_name} ({layer['type']}) | Colors: {len(colors)}")
         
         # Nav Icon (For All Layers: Main and Addon)
+        # We use the same cover for all split layers of the same part
         part_cover = part.get('cover')
         if part_cover:
             base_part_dir = os.path.join(base_dir, "items_structured", folder_name)
-            if not os.path.exists(base_part_dir): os.makedirs(base_part_dir)
-            
-            nav_path = os.path.join(base_part_dir, "nav.png")
-            # We use the same cover for all split layers of the same part
-            
-            cache_dir = os.path.join(os.path.dirname(base_dir), "cache_blobs")
-            if not os.path.exists(cache_dir): os.makedirs(cache_dir)
-            cache_path = os.path.join(cache_dir, f"{part_cover}.png")
-            
-            if not os.path.exists(nav_path):
-                try:
-                    if not os.path.exists(cache_path):
-                         requests.get(f"https://img2.neka.cc/{part_cover}", timeout=10)
-                         with open(cache_path, 'wb') as f: 
-                            f.write(requests.get(f"https://img2.neka.cc/{part_cover}").content)
-                    
-                    if os.path.exists(cache_path):
-                        shutil.copy2(cache_path, nav_path)
-                        # print(f"  ✓ Saved nav icon") # Reduce verbosity
-                except: pass
+            dirs.append(base_part_dir)
+            tasks.append({
+                'blob': part_cover,
+                'lut': None,
+                'filepath': os.path.join(base_part_dir, "nav.png"),
+                'cache_dir': cache_dir,
+                'color': 'nav',
+                'is_nav': True
+            })
 
         # Iterate Items to find relevant blob
         items = part.get('items', [])
         
-        # Loop Colors
-        for color_data in colors:
+        # Loop Colors (the first color also gets thumb_N.png in the layer folder)
+        for color_idx, color_data in enumerate(colors):
             color_code = color_data["code"]
             gradients = color_data["gradients"]
             lut = create_gradient_lut(gradients) if gradients else None
+            stops = normalize_gradient_stops(gradients) if lazy and lut is not None else None
             
             if color_code == "default":
                 target_dir = os.path.join(base_dir, "items_structured", folder_name)
             else:
                 target_dir = os.path.join(base_dir, "items_structured", folder_name, color_code)
                 
-            if not os.path.exists(target_dir): os.makedirs(target_dir)
+            dirs.append(target_dir)
             
             file_counter = 1
             for item_idx, item_layers in enumerate(items):
-                if not isinstance(item_layers, list): item_layers = [item_layers]
-                
-                # Find the blob for this Layer (Main or Addon)
-                blob_to_process = None
+                texture = find_layer_texture(layer, item_layers)
+                blob_to_process = texture.get('blob') if texture else None
                 
-                for l_data in item_layers:
-                    if not isinstance(l_data, dict): continue
-                    
-                    if layer['type'] == 'main':
-                        # Valid if it has a blob AND it is the main definition (not nested deeper?)
-                        # The structure is usually simple. Main blob is at root of item_layer object.
-                        if l_data.get('blob'):
-                             blob_to_process = l_data.get('blob')
-                             # Use crop logic? Main layer crop is 'crop'.
-                             # We ignore crop/position for now as we just want the asset? 
-                             # User said "images and colors".
-                             break
-                    else:
-                        # Addon
-                        target_addon_id = layer['addon_id']
-                        addons = l_data.get('addonTextures', [])
-                        found = False
-                        for at in addons:
-                            if not isinstance(at, dict): continue
-                            # check if this at uses the target addon layer
-                            # ID match? 'layer' key in addonTexture matches 'id' in addonLayers
-                            if at.get('layer') == target_addon_id:
-                                blob_to_process = at.get('blob')
-                                found = True
-                                break
-                        if found: break
-                
-                # Download logic
                 if blob_to_process:
                     filename = f"{file_counter}.png"
-                    filepath = os.path.join(target_dir, filename)
-                    
-                    if not os.path.exists(filepath):
-                        # Download routine
-                        url = f"https://img2.neka.cc/{blob_to_process}"
-                        cache_dir = os.path.join(os.path.dirname(base_dir), "cache_blobs")
-                        if not os.path.exists(cache_dir): os.makedirs(cache_dir)
-                        cache_path = os.path.join(cache_dir, f"{blob_to_process}.png")
-                        
-                        try:
-                            if not os.path.exists(cache_path):
-                                resp = requests.get(url, timeout=10)
-                                if resp.status_code == 200:
-                                    with open(cache_path, 'wb') as f: f.write(resp.content)
-                            
-                            if os.path.exists(cache_path):
-                                if lut: apply_gradient(cache_path, lut, filepath)
-                                else: shutil.copy2(cache_path, filepath)
-                                total_files += 1
-                        except: pass
-                
-                # Always increment counter to keep sync between different layers of same item??
-                # YES. If Item 1 has Main but no Addon, Addon folder should probably skip or have empty placeholder?
-                # User wants "X-Y". If Item 1 is missing Addon, file "1.png" in Addon folder shouldn't exist?
-                # BUT if we skip, "2.png" in Addon folder might correspond to "2.png" in Main folder.
-                # If we skip, then "1.png" in Addon folder would correspond to Item 2. VALIDITY CHECK FAIL.
-                # SOLUTION: We must increment `file_counter` regardless.
-                # But creating empty files is messy.
-                # Standard practice: Skip creating file, but increment counter.
-                # Frontend must handle missing file 1.png and finding 2.png.
-                # However, if we just check `if blob_to_process` we skip downloading.
-                # We need to ensure we don't desync IDs.
-                # The filename is based on `file_counter`.
+                    crop = texture.get('crop') if isinstance(texture.get('crop'), dict) else {}
+                    tasks.append({
+                        'blob': blob_to_process,
+                        'lut': lut,
+                        'filepath': os.path.join(target_dir, filename),
+                        'cache_dir': cache_dir,
+                        'color': color_code,
+                        'folder': folder_name,
+                        'filename': filename,
+                        'origin': (crop.get('x', 0), crop.get('y', 0))
+                    })
+                    if stops is not None:
+                        tasks[-1].update({'lazy': True, 'stops': stops})
+                    if color_idx == 0:
+                        tasks.append({
+                            'blob': blob_to_process,
+                            'lut': lut,
+                            'filepath': os.path.join(base_dir, "items_structured", folder_name, f"thumb_{file_counter}.png"),
+                            'cache_dir': cache_dir,
+                            'color': 'thumb',
+                            'is_thumb': True,
+                            'folder': folder_name,
+                            'filename': filename,
+                            'origin': tasks[-1]['origin']
+                        })
                 
+                # Always increment counter to keep sync between different layers of same item.
+                # If Item 1 has Main but no Addon, we skip creating the Addon file but still
+                # increment, so "2.png" in the Addon folder keeps matching "2.png" in Main.
+                # Frontend must handle a missing 1.png and find 2.png.
                 file_counter += 1
+    return tasks, dirs
 
-    print(f"Done! Created {total_files} colored files in 'items_structured'.")
+def reorganize_kit(metadata_path, selected_y=None, workers=DEFAULT_WORKERS, cache_quota=None, processes=None, png_profile=None,
+                   fetch_executor=None, colorize_executor=None, lazy=None, crop=None, shard=None):
+    """
+    Downloads and colorizes a kit into items_structured/X-Y/COLOR/N.png.
+    fetch_executor / colorize_executor let a batch run share one thread pool and one
+    process pool between kits; when omitted the kit creates (and closes) its own.
+    With lazy=True toned colors are not written: their blob and gradient stops go to
+    lazy_colors.json and app_server renders them on first request. lazy=None keeps
+    the mode the kit was downloaded with.
+    With crop=True item files are trimmed to their alpha bounding box and their canvas
+    position goes to items_structured/X-Y/offsets.json (crop=None: keep the kit's mode).
+    With shard=(i, n) only the outputs of blobs in shard i of n are fetched and written;
+    results go to shards/ for assemble_shards instead of the kit journal and sidecars.
+    """
+    print(f"DEBUG: reorganize_kit called with {metadata_path}, selected_y={selected_y}, workers={workers}")
+    base_dir = os.path.dirname(metadata_path)
+    
+    with open(metadata_path, 'r', encoding='utf-8') as f:
+        kit = json.load(f)
+        
+    data = kit.get('data', {})
+    parts = data.get('parts', [])
+    toning_map = build_toning_map(data.get('tonings', []))
+    print(f"Loaded {len(toning_map)} tonings.")
+    if lazy is None:
+        lazy = os.path.exists(os.path.join(base_dir, LAZY_MANIFEST_NAME))
+    if crop is None:
+        crop = has_crop_offsets(base_dir)
+    
+    all_render_layers = plan_render_layers(data)
+    print(f"Identified {len(all_render_layers)} total render layers (Main + Addons)")
+        
+    total_files = 0
+    thumbs_written = 0
+    cache_dir = os.path.join(os.path.dirname(base_dir), "cache_blobs")
+    os.makedirs(cache_dir, exist_ok=True)
+    
+    # Phase 1: plan every output file, then create the folders (empty color folders included).
+    tasks, dirs = plan_kit_tasks(base_dir, all_render_layers, toning_map, cache_dir, selected_y, lazy)
+    for target_dir in dirs:
+        os.makedirs(target_dir, exist_ok=True)
+
+    lazy_tasks = [t for t in tasks if t.get('lazy')]
+    if shard:
+        # The coordinator writes lazy_colors.json; a shard only fetches and renders its own blobs
+        tasks = [t for t in tasks if not t.get('lazy') and in_shard(t['blob'], shard)]
+        lazy_tasks = [t for t in lazy_tasks if in_shard(t['blob'], shard)]
+        print(f"Shard {shard[0]}/{shard[1]}: {len(tasks)} files")
+    elif lazy:
+        write_lazy_manifest(base_dir, cache_dir, lazy_tasks, png_profile, partial=selected_y is not None, crop=crop)
+        tasks = [t for t in tasks if not t.get('lazy')]
+        print(f"Lazy colors: {len(lazy_tasks)} toned files left to app_server")
+    else:
+        drop_lazy_manifest(base_dir)
+
+    # Skip finished work using the journal alone. Kits downloaded before the journal
+    # existed are checked on disk once and their existing files journaled.
+    if shard:
+        os.makedirs(os.path.join(base_dir, SHARD_DIR), exist_ok=True)
+        journal = DownloadJournal(base_dir, shard_file(shard, "journal", "jsonl"))
+        # Skip what the kit journal already has, record into the shard's own file
+        kit_entries, _ = DownloadJournal.read_entries(os.path.join(base_dir, JOURNAL_NAME))
+        journal.entries = {**kit_entries, **journal.entries}
+        journal.exists = journal.exists or bool(kit_entries)
+    else:
+        journal = DownloadJournal(base_dir)
+    pending = []
+    legacy_found = 0
+    for task in tasks:
+        if journal.is_done(task['filepath'], task['blob'], task['color']):
+            continue
+        if not journal.exists and os.path.exists(task['filepath']):
+            journal.record(task['filepath'], task['blob'], task['color'], os.path.getsize(task['filepath']))
+            legacy_found += 1
+            continue
+        pending.append(task)
+    journal.flush()
+    print(f"Journal: {len(tasks) - len(pending)} of {len(tasks)} files already done"
+          + (f" ({legacy_found} found on disk)" if legacy_found else ""))
+
+    # Phase 2: fetch every unique blob exactly once.
+    blob_refs, total_refs = collect_kit_blobs(parts, selected_y)
+    if shard:
+        blob_refs = {b: n for b, n in blob_refs.items() if in_shard(b, shard)}
+        total_refs = sum(blob_refs.values())
+    kit_name = os.path.basename(base_dir)
+    blob_cache = get_blob_cache(cache_dir)
+    if cache_quota is not None:
+        blob_cache.set_quota(cache_quota)
+    cached = blob_cache.known_blobs()
+    # Only blobs an unfinished output (or a lazy color) uses; unused covers and the
+    # blobs of journaled files are neither fetched nor counted as failures
+    needed = list(dict.fromkeys([t['blob'] for t in pending] + [t['blob'] for t in lazy_tasks]))
+    for blob in needed:
+        if blob in cached and not os.path.exists(blob_cache.path(blob)):
+            # Indexed but deleted from disk since: fetch it again
+            blob_cache.forget(blob)
+            cached.discard(blob)
+    to_fetch = [b for b in needed if b not in cached]
+    print(f"Blobs: {total_refs} references, {len(blob_refs)} unique, {len(needed)} needed "
+          f"({len(needed) - len(to_fetch)} cached, {len(to_fetch)} to fetch) for {len(tasks)} planned files")
+    STATS.incr('cache_hits', len(needed) - len(to_fetch))
+    STATS.incr('cache_misses', len(to_fetch))
+
+    shared = fetch_executor is not None
+    if not shared:
+        fetch_threads = FETCH_CONTROL.pool_size(workers)
+        configure_http_session(fetch_threads)
+        fetch_executor = ThreadPoolExecutor(max_workers=fetch_threads)
+    available = {b: blob_cache.path(b) for b in needed if b in cached}
+    blob_cache.touch(available, kit_name)
+    failed_blobs = 0
+
+    phase_start = time.time()
+    try:
+        futures = {fetch_executor.submit(fetch_blob, blob, cache_dir, kit_name): blob for blob in to_fetch}
+        done_count = 0
+        for future in as_completed(futures):
+            done_count += 1
+            STATS.queue_depth('fetch', len(to_fetch) - done_count)
+            STATS.progress('fetch', done_count, len(to_fetch))
+            try:
+                cache_path = future.result()
+            except Exception as e:
+                print(f"  Fetch error: {e}")
+                cache_path = None
+            if cache_path:
+                available[futures[future]] = cache_path
+            else:
+                failed_blobs += 1
+            if done_count % 500 == 0 and not STATS.live:
+                print(f"  Fetched: {done_count}/{len(to_fetch)}")
+    finally:
+        if not shared:
+            fetch_executor.shutdown()
+        STATS.add_phase('fetch', time.time() - phase_start)
+        STATS.end_progress()
+
+    STATS.incr('failed_fetches', failed_blobs)
+    if failed_blobs:
+        print(f"  Warning: {failed_blobs} blobs could not be downloaded, their files are skipped.")
+
+    # Phase 3: fan colorization out from the local copies, one job per blob so each PNG is decoded once.
+    groups = {}
+    by_path = {}
+    for task in pending:
+        cache_path = available.get(task['blob'])
+        if not cache_path:
+            continue
+        by_path[task['filepath']] = task
+        group = groups.get(task['blob'])
+        if group is None:
+            group = groups[task['blob']] = {'blob': task['blob'], 'cache_path': cache_path, 'jobs': [],
+                                            'png_profile': png_profile, 'crop': crop}
+        kind = "nav" if task.get('is_nav') else "thumb" if task.get('is_thumb') else "file"
+        group['jobs'].append((task['lut'], task['filepath'], kind))
+    lazy_by_blob = {}
+    for task in lazy_tasks:
+        lazy_by_blob.setdefault(task['blob'], []).append(task)
+
+    own_colorize = colorize_executor is None
+    if own_colorize:
+        processes = processes or os.cpu_count() or 1
+        colorize_executor = ProcessPoolExecutor(max_workers=processes)
+        print(f"Colorizing {sum(len(g['jobs']) for g in groups.values())} files from {len(groups)} blobs with {processes} processes...")
+    else:
+        print(f"Colorizing {sum(len(g['jobs']) for g in groups.values())} files from {len(groups)} blobs (shared pool)...")
+
+    offsets = {}
+    phase_start = time.time()
+    try:
+        futures = {colorize_executor.submit(process_blob_group, group): blob for blob, group in groups.items()}
+        done_count = 0
+        for future in as_completed(futures):
+            done_count += 1
+            STATS.queue_depth('colorize', len(futures) - done_count)
+            STATS.progress('colorize', done_count, len(futures))
+            try:
+                written, timings, geometry = future.result()
+                STATS.merge(timings)
+                for filepath, size in written:
+                    task = by_path[filepath]
+                    journal.record(filepath, task['blob'], task['color'], size)
+                    if task.get('is_thumb'):
+                        thumbs_written += 1
+                    elif not task.get('is_nav'):
+                        total_files += 1
+                    if geometry and not task.get('is_nav') and not task.get('is_thumb'):
+                        offsets.setdefault(task['folder'], {})[crop_key(task['color'], task['filename'])] = crop_offset(task, geometry)
+                if geometry:
+                    # Lazy colors of the blob are rendered later, trimmed by the same box
+                    for task in lazy_by_blob.get(futures[future], []):
+                        offsets.setdefault(task['folder'], {})[crop_key(task['color'], task['filename'])] = crop_offset(task, geometry)
+                journal.flush()
+            except Exception as e:
+                print(f"  Task error: {e}")
+            if done_count % 500 == 0 and not STATS.live:
+                print(f"  Progress: {done_count}/{len(groups)} blobs")
+    finally:
+        if own_colorize:
+            colorize_executor.shutdown()
+        journal.close()
+        STATS.add_phase('colorize', time.time() - phase_start)
+        STATS.end_progress()
+        if not shard:
+            for folder, items in offsets.items():
+                update_crop_offsets(base_dir, folder, items)
+    STATS.incr('files_written', total_files)
+
+    if shard:
+        # Done marker read by assemble_shards (other shards may still be using the cache: no prune)
+        result = {'files': total_files, 'thumbs': thumbs_written, 'failed_blobs': failed_blobs, 'offsets': offsets}
+        write_bytes_atomic(json.dumps(result).encode('utf-8'), os.path.join(base_dir, shard_file(shard, "done", "json")))
+    # In a batch other kits may still need cached blobs; the batch prunes once at the end
+    elif not shared:
+        prune_blob_cache(blob_cache)
+
+    print(f"Done! Created {total_files} colored files in 'items_structured'"
+          + (f" and {thumbs_written} thumbnails." if thumbs_written else "."))
+    return total_files
+
+# ============= CROPPED STORAGE =============
+
+CANVAS_SIZE = (1436, 1902)
+OFFSETS_NAME = "offsets.json"
+# Version 2 keys items by their path in the X-Y folder ("N.png", "COLOR/N.png");
+# version 1 had one "N.png" entry shared by the root and every color folder
+OFFSETS_VERSION = 2
+
+def has_crop_offsets(base_dir):
+    structured_dir = os.path.join(base_dir, "items_structured")
+    if not os.path.isdir(structured_dir):
+        return False
+    return any(os.path.exists(os.path.join(structured_dir, d, OFFSETS_NAME)) for d in os.listdir(structured_dir))
+
+def crop_offset(task, geometry):
+    """
+    Canvas position of a trimmed item: its layer crop origin (blobs smaller than the
+    canvas are stored pieces placed at crop x/y) plus the alpha bounding box corner.
+    """
+    x, y = (0, 0) if tuple(geometry['size']) == CANVAS_SIZE else task['origin']
+    return [x + geometry['bbox'][0], y + geometry['bbox'][1]]
+
+def crop_key(color, filename):
+    """
+    offsets.json key of an item file: its path relative to the X-Y folder.
+    """
+    return filename if not color or color == "default" else f"{color}/{filename}"
+
+def crop_path_key(folder_dir, path):
+    return os.path.relpath(path, folder_dir).replace("\\", "/")
+
+def load_crop_offsets(folder_dir):
+    """
+    Returns {"N.png" or "COLOR/N.png": [x, y]} from a part's offsets.json ({} when missing).
+    """
+    try:
+        with open(os.path.join(folder_dir, OFFSETS_NAME), 'r', encoding='utf-8') as f:
+            sidecar = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    items = sidecar.get('items', {})
+    if sidecar.get('version', 1) < OFFSETS_VERSION:
+        items = expand_legacy_offsets(folder_dir, items)
+    return items
+
+def expand_legacy_offsets(folder_dir, items):
+    """
+    A version 1 entry applies to the item in the root and in every color folder: copies it
+    to each color found on disk or in lazy_colors.json.
+    """
+    colors = set()
+    if os.path.isdir(folder_dir):
+        colors.update(e.name for e in os.scandir(folder_dir) if e.is_dir())
+    manifest_path = os.path.join(os.path.dirname(os.path.dirname(folder_dir)), LAZY_MANIFEST_NAME)
+    try:
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            colors.update(json.load(f)['folders'][os.path.basename(folder_dir)]['colors'])
+    except (OSError, ValueError, KeyError):
+        pass
+    expanded = dict(items)
+    for color in colors:
+        for name, xy in items.items():
+            expanded[crop_key(color, name)] = xy
+    return expanded
+
+def crop_sort_key(key):
+    color, _, name = key.rpartition("/")
+    return (color, natural_key(name))
+
+def save_crop_offsets(folder_dir, items):
+    path = os.path.join(folder_dir, OFFSETS_NAME)
+    if not items:
+        if os.path.exists(path): os.remove(path)
+        return
+    sidecar = {'version': OFFSETS_VERSION, 'canvas': list(CANVAS_SIZE),
+               'items': dict(sorted(items.items(), key=lambda kv: crop_sort_key(kv[0])))}
+    write_bytes_atomic(json.dumps(sidecar).encode('utf-8'), path)
+
+def move_crop_offsets(folder_dir, moves=(), removed=()):
+    """
+    Keeps offsets.json in step with files edited in an X-Y folder: re-keys (old, new)
+    pairs and drops the other entries of removed keys. A key also matches everything
+    under it, so "COLOR" covers a whole color folder. Moves are applied at once (swaps
+    stay correct) and win over removals. Kits without offsets.json are left alone.
+    """
+    items = load_crop_offsets(folder_dir)
+    if not items:
+        return
+    def under(key, path):
+        return key == path or key.startswith(path + "/")
+    kept = {}
+    moved = {}
+    for key, xy in items.items():
+        for old, new in moves:
+            if under(key, old):
+                moved[new + key[len(old):]] = xy
+                break
+        else:
+            if not any(under(key, path) for path in removed):
+                kept[key] = xy
+    kept.update(moved)
+    save_crop_offsets(folder_dir, kept)
+
+def update_crop_offsets(base_dir, folder, items):
+    folder_dir = os.path.join(base_dir, "items_structured", folder)
+    merged = load_crop_offsets(folder_dir)
+    merged.update(items)
+    save_crop_offsets(folder_dir, merged)
+
+def natural_key(name):
+    match = re.match(r"(\d+)", name)
+    return (int(match.group(1)) if match else float('inf'), name)
+
+# ============= DRY-RUN PLANNER =============
+
+PLAN_HEAD_SAMPLE = 64   # blobs sized (HEAD or local size) when the kit has more to fetch than this
+PLAN_GET_SAMPLE = 4     # blobs read (into memory) to time a fetch and one colorize pass
+
+def probe_blob_size(blob):
+    """
+    Size of a blob in the first BLOB_SOURCES entry that has it (HEAD Content-Length
+    for http sources), or None.
+    """
+    for source in BLOB_SOURCES:
+        try:
+            size = source.size(blob)
+        except (requests.RequestException, OSError, ValueError, zipfile.BadZipFile):
+            continue
+        if size is not None:
+            return size
+    return None
+
+def time_blob_get(blob):
+    """
+    Reads a blob into memory from the first BLOB_SOURCES entry that has it, like
+    fetch_blob would. Returns (seconds, content) or None.
+    """
+    for source in BLOB_SOURCES:
+        start = time.perf_counter()
+        try:
+            content = source.read(blob)
+        except (requests.RequestException, OSError, zipfile.BadZipFile):
+            continue
+        if content is not None:
+            return time.perf_counter() - start, content
+    return None
+
+def time_colorize(source, png_profile=None, rounds=3):
+    """
+    Seconds to decode, colorize and encode one output from a PNG path or file object.
+    """
+    lut = build_gradient_lut(((0.0, (0, 0, 0)), (1.0, (255, 255, 255))))
+    start = time.perf_counter()
+    for _ in range(rounds):
+        if hasattr(source, 'seek'): source.seek(0)
+        gray_data, alpha = load_gray_planes(source)
+        save_png(colorize_planes(gray_data, alpha, lut), io.BytesIO(), png_profile)
+    return (time.perf_counter() - start) / rounds
+
+def format_duration(seconds):
+    if seconds < 90:
+        return f"{seconds:.0f}s"
+    if seconds < 5400:
+        return f"{seconds / 60:.0f}min"
+    return f"{seconds / 3600:.1f}h"
+
+def plan_kit(metadata_path, selected_y=None, workers=DEFAULT_WORKERS, processes=None, png_profile=None, lazy=None,
+             base_dir=None):
+    """
+    Dry run of reorganize_kit: plans every output, checks the blob cache and journal,
+    sizes the blobs still to fetch from BLOB_SOURCES (sampled on big kits) and projects the
+    wall-clock time from a few timed fetches and one local colorize pass. Only reads the kit folder
+    (base_dir, by default the folder of metadata_path) and the cache, which need not exist.
+    Returns the report as a dict.
+    """
+    base_dir = base_dir or os.path.dirname(metadata_path)
+    with open(metadata_path, 'r', encoding='utf-8') as f:
+        kit = json.load(f)
+    data = kit.get('data', {})
+    parts = data.get('parts', [])
+    toning_map = build_toning_map(data.get('tonings', []))
+    if lazy is None:
+        lazy = os.path.exists(os.path.join(base_dir, LAZY_MANIFEST_NAME))
+    processes = processes or os.cpu_count() or 1
+
+    all_render_layers = plan_render_layers(data)
+    cache_dir = os.path.join(os.path.dirname(base_dir), "cache_blobs")
+    tasks, dirs = plan_kit_tasks(base_dir, all_render_layers, toning_map, cache_dir, selected_y, lazy)
+    render_layers = [l for l in all_render_layers if selected_y is None or l['part_idx'] + 1 in selected_y]
+    lazy_tasks = [t for t in tasks if t.get('lazy')]
+    tasks = [t for t in tasks if not t.get('lazy')]
+
+    if os.path.exists(os.path.join(base_dir, JOURNAL_NAME)):
+        journal = DownloadJournal(base_dir, read_only=True)
+        pending = [t for t in tasks if not journal.is_done(t['filepath'], t['blob'], t['color'])]
+    else:
+        pending = [t for t in tasks if not os.path.exists(t['filepath'])]
+
+    blob_refs, total_refs = collect_kit_blobs(parts, selected_y)
+    cached_sizes = read_sizes(cache_dir)
+    needed = list(dict.fromkeys([t['blob'] for t in pending] + [t['blob'] for t in lazy_tasks]))
+    # Same check as reorganize_kit: an indexed blob whose file is gone is fetched again
+    to_fetch = [b for b in needed if b not in cached_sizes or not os.path.exists(os.path.join(cache_dir, f"{b}.png"))]
+
+    print(f"\nPlan: sizing {len(to_fetch)} blobs to fetch...")
+    sample = to_fetch if len(to_fetch) <= PLAN_HEAD_SAMPLE else random.sample(to_fetch, PLAN_HEAD_SAMPLE)
+    configure_http_session(workers)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        head_sizes = [size for size in executor.map(probe_blob_size, sample) if size is not None]
+    unsized = len(sample) - len(head_sizes)
+    known = head_sizes or [s for s in cached_sizes.values() if s]
+    avg_blob = sum(known) / len(known) if known else 0
+    if not to_fetch:
+        fetch_bytes = 0
+    elif not known:
+        # Nothing to extrapolate from: unknown rather than 0 B
+        fetch_bytes = None
+    elif len(sample) == len(to_fetch) and not unsized:
+        fetch_bytes = sum(head_sizes)
+    else:
+        fetch_bytes = avg_blob * len(to_fetch)
+
+    get_times = []
+    colorize_source = None
+    for blob in to_fetch[:PLAN_GET_SAMPLE]:
+        result = time_blob_get(blob)
+        if result:
+            get_times.append(result[0])
+            colorize_source = colorize_source or io.BytesIO(result[1])
+    if colorize_source is None:
+        cached_paths = [os.path.join(cache_dir, f"{b}.png") for b in needed if b not in to_fetch]
+        colorize_source = cached_paths[0] if cached_paths else None
+    colorize_time = time_colorize(colorize_source, png_profile) if colorize_source else 0.0
+
+    thumbs = sum(1 for t in pending if t.get('is_thumb'))
+    colored = sum(1 for t in pending if t['lut'] is not None and not t.get('is_thumb'))
+    copies = len(pending) - colored - thumbs
+    per_get = sum(get_times) / len(get_times) if get_times else 0.0
+    fetch_seconds = -(-len(to_fetch) // max(1, workers)) * per_get if get_times or not to_fetch else None
+    colorize_seconds = colored * colorize_time / processes
+
+    report = {
+        'kit': kit.get('name'), 'id': kit.get('id'),
+        'render_layers': len(render_layers),
+        'folders': len(set(dirs)),
+        'blob_refs': total_refs, 'unique_blobs': len(blob_refs),
+        'needed_blobs': len(needed), 'cached_blobs': len(needed) - len(to_fetch), 'blobs_to_fetch': len(to_fetch),
+        'planned_files': len(tasks), 'already_done': len(tasks) - len(pending),
+        'files_to_write': len(pending), 'colored_files': colored, 'copied_files': copies, 'thumbnails': thumbs, 'lazy_files': len(lazy_tasks),
+        'fetch_bytes': None if fetch_bytes is None else int(fetch_bytes), 'output_bytes': int(avg_blob * (len(pending) - thumbs)),
+        'sampled_sizes': len(head_sizes), 'unsized_blobs': unsized, 'timed_gets': len(get_times),
+        'seconds_per_get': per_get, 'seconds_per_colorize': colorize_time,
+        'fetch_seconds': fetch_seconds, 'colorize_seconds': colorize_seconds,
+        'workers': workers, 'processes': processes
+    }
+
+    print(f"Plan for {kit.get('name')} (ID: {kit.get('id')})" + (f", Y = {sorted(selected_y)}" if selected_y else ""))
+    print(f"  Render layers:  {len(render_layers)} ({len(set(dirs))} output folders)")
+    print(f"  Blobs:          {total_refs} references, {len(blob_refs)} unique, {len(needed)} needed, "
+          f"{report['cached_blobs']} cached, {len(to_fetch)} to fetch")
+    print(f"  Files:          {len(tasks)} planned, {report['already_done']} already done, {len(pending)} to write "
+          f"({colored} colored, {copies} copied, {thumbs} thumbnails)" + (f", {len(lazy_tasks)} left to lazy colors" if lazy_tasks else ""))
+    sources = ", ".join(str(s) for s in BLOB_SOURCES) or "local cache only"
+    if fetch_bytes is None:
+        print(f"  Download:       unknown (none of {len(sample)} sampled blobs could be sized from {sources})")
+    else:
+        if not head_sizes and to_fetch:
+            size_note = "from cached blob sizes"
+        elif len(sample) == len(to_fetch) and not unsized:
+            size_note = "exact"
+        else:
+            size_note = f"from {len(head_sizes)} sampled sizes"
+        print(f"  Download:       ~{format_size(fetch_bytes)} ({size_note})")
+    if unsized:
+        print(f"  Warning: {unsized} of {len(sample)} sampled blobs could not be sized from {sources}")
+    print(f"  Output:         ~{format_size(report['output_bytes'])} written to items_structured")
+    if fetch_seconds is None:
+        print(f"  Fetch time:     unknown (none of {min(len(to_fetch), PLAN_GET_SAMPLE)} blobs could be fetched from {sources})")
+    else:
+        print(f"  Fetch time:     ~{format_duration(fetch_seconds)} with {workers} workers "
+              f"({per_get * 1000:.0f} ms per blob over {len(get_times)} timed fetches)")
+    print(f"  Colorize time:  ~{format_duration(colorize_seconds)} with {processes} processes "
+          f"({colorize_time * 1000:.0f} ms per file, PNG profile {png_profile or 'default'})")
+    # Fetching and colorizing are separate phases, so the estimate is their sum
+    if fetch_seconds is None:
+        print(f"  Estimated total: more than ~{format_duration(colorize_seconds)} (fetch time unknown)")
+    else:
+        print(f"  Estimated total: ~{format_duration(fetch_seconds + colorize_seconds)}")
+    return report
+
+# ============= LAZY COLORS =============
+# lazy_colors.json: {"cache_dir": <relative to the kit>, "png_profile": ...,
+#   "folders": {"X-Y": {"colors": {COLOR: [[offset, [r, g, b]], ...]}, "items": {"N.png": blob}}}}
+# Only toned colors are listed; default color and nav icons are always real files.
+
+LAZY_MANIFEST_NAME = "lazy_colors.json"
+
+def write_lazy_manifest(base_dir, cache_dir, lazy_tasks, png_profile=None, partial=False, crop=False):
+    """
+    Records the blob and gradient stops of every toned output instead of rendering it.
+    With partial=True (--y subsets) folders not planned in this run keep their previous entries.
+    crop=True makes app_server trim renders like the files on disk.
+    """
+    manifest_path = os.path.join(base_dir, LAZY_MANIFEST_NAME)
+    manifest = {}
+    if os.path.exists(manifest_path):
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+    folders = manifest.get('folders', {}) if partial else {}
+    planned = {t['folder'] for t in lazy_tasks}
+    for folder in planned:
+        folders[folder] = {'colors': {}, 'items': {}}
+    for task in lazy_tasks:
+        entry = folders[task['folder']]
+        entry['colors'][task['color']] = [[off, list(rgb)] for off, rgb in task['stops']]
+        entry['items'][task['filename']] = task['blob']
+    manifest.update({
+        'cache_dir': os.path.relpath(cache_dir, base_dir).replace("\\", "/"),
+        'png_profile': png_profile,
+        'crop': bool(crop),
+        'folders': folders
+    })
+    write_bytes_atomic(json.dumps(manifest, ensure_ascii=False).encode('utf-8'), manifest_path)
+
+def drop_lazy_manifest(base_dir):
+    manifest_path = os.path.join(base_dir, LAZY_MANIFEST_NAME)
+    if os.path.exists(manifest_path):
+        os.remove(manifest_path)
+        print("Lazy colors: rendering all colors, removed lazy_colors.json")
+
+def prune_blob_cache(blob_cache):
+    evicted, freed = blob_cache.prune()
+    if evicted:
+        print(f"Cache quota: evicted {evicted} least recently used blobs ({freed / (1024 * 1024):.1f} MB).")
+
+# ============= SYNC =============
+
+def layer_key(layer):
+    """
+    Stable identity of a render layer across metadata versions (part id + addon layer id).
+    """
+    part = layer['part']
+    part_key = part.get('id') or f"#{layer['part_idx']}:{part.get('name', 'unnamed')}"
+    return (str(part_key), layer.get('addon_id') if layer['type'] == 'addon' else None)
+
+def layer_folder(layer):
+    return f"{layer['seq_x']}-{layer['part_idx'] + 1}"
+
+def index_layers(kit):
+    data = kit.get('data', {})
+    toning_map = build_toning_map(data.get('tonings', []))
+    layers = {}
+    for layer in plan_render_layers(data):
+        items = layer['part'].get('items', [])
+        layers[layer_key(layer)] = {
+            'folder': layer_folder(layer),
+            'blobs': [find_layer_blob(layer, item_layers) for item_layers in items],
+            'colors': {c['code']: normalize_gradient_stops(c['gradients']) for c in get_layer_colors(layer, toning_map)},
+            'cover': layer['part'].get('cover')
+        }
+    return layers
+
+def plan_item_moves(old_blobs, new_blobs):
+    """
+    Maps old item numbers to new ones for items whose blob only changed position.
+    Returns (moves {old_n: new_n}, stale [old_n whose file is no longer used], changed [new_n to re-render]).
+    """
+    moves = {}
+    changed = []
+    claimed = set()
+    for j, blob in enumerate(new_blobs, 1):
+        if blob and j <= len(old_blobs) and old_blobs[j - 1] == blob:
+            claimed.add(j)
+    for j, blob in enumerate(new_blobs, 1):
+        if not blob or j in claimed and old_blobs[j - 1] == blob:
+            continue
+        source = None
+        for i, old_blob in enumerate(old_blobs, 1):
+            if old_blob == blob and i not in claimed:
+                source = i
+                break
+        if source is not None:
+            claimed.add(source)
+            moves[source] = j
+        else:
+            changed.append(j)
+    targets = set(moves.values()) | set(changed)
+    stale = [i for i, b in enumerate(old_blobs, 1)
+             if b and i not in claimed and i not in targets]
+    return moves, stale, changed
+
+def rename_many(pairs):
+    """
+    Renames (old, new) paths in two steps through temp names so swaps and chains never collide.
+    """
+    staged = []
+    for old, new in pairs:
+        if os.path.exists(old):
+            tmp = old + ".__sync_tmp"
+            os.replace(old, tmp)
+            staged.append((tmp, new))
+    for tmp, new in staged:
+        if os.path.isdir(new):
+            shutil.rmtree(new)
+        os.replace(tmp, new)
+
+def sync_kit(base_dir, new_metadata_path, **reorganize_args):
+    """
+    Applies an upstream kit update in place: diffs the fresh metadata against the stored
+    metadata.json, moves/renumbers X-Y folders and item files only where needed, drops
+    removed layers and colors, and lets the journal-driven reorganize_kit fetch and
+    recolor just the new or changed outputs.
+    """
+    metadata_path = os.path.join(base_dir, "metadata.json")
+    with open(metadata_path, 'r', encoding='utf-8') as f:
+        old_kit = json.load(f)
+    with open(new_metadata_path, 'r', encoding='utf-8') as f:
+        new_kit = json.load(f)
+
+    old_data = old_kit.get('data', {})
+    new_data = new_kit.get('data', {})
+    section_changes = [key for key in ('parts', 'tonings', 'layerHeights') if old_data.get(key) != new_data.get(key)]
+    if not section_changes:
+        print("Sync: metadata unchanged.")
+        shutil.move(new_metadata_path, metadata_path)
+        return reorganize_kit(metadata_path, **reorganize_args)
+    print(f"Sync: changed sections: {', '.join(section_changes)}")
+
+    old_layers = index_layers(old_kit)
+    new_layers = index_layers(new_kit)
+    structured_dir = os.path.join(base_dir, "items_structured")
+    journal = DownloadJournal(base_dir)
+
+    # 1. Layers removed upstream
+    removed = [k for k in old_layers if k not in new_layers]
+    for key in removed:
+        folder_path = os.path.join(structured_dir, old_layers[key]['folder'])
+        if os.path.isdir(folder_path):
+            shutil.rmtree(folder_path)
+        journal.forget_dir(folder_path)
+
+    # 2. Folders whose X-Y changed (parts inserted, removed or re-ordered)
+    folder_moves = []
+    for key, new in new_layers.items():
+        old = old_layers.get(key)
+        if old and old['folder'] != new['folder']:
+            folder_moves.append((os.path.join(structured_dir, old['folder']), os.path.join(structured_dir, new['folder'])))
+    rename_many(folder_moves)
+    journal.move_many(folder_moves)
+    folder_renames = {os.path.basename(o): os.path.basename(n) for o, n in folder_moves}
+
+    # 3. Items and colors inside each kept layer
+    moved_items, rerender = 0, 0
+    for key, new in new_layers.items():
+        old = old_layers.get(key)
+        if not old: continue
+        folder_path = os.path.join(structured_dir, new['folder'])
+        if not os.path.isdir(folder_path): continue
+
+        color_dirs = {}
+        for code in new['colors']:
+            color_dirs[code] = folder_path if code == "default" else os.path.join(folder_path, code)
+        dropped_colors = []
+        recolored = []
+        for code, stops in old['colors'].items():
+            if code not in new['colors'] and code != "default":
+                shutil.rmtree(os.path.join(folder_path, code), ignore_errors=True)
+                journal.forget_dir(os.path.join(folder_path, code))
+                dropped_colors.append(code)
+            elif code in new['colors'] and new['colors'][code] != stops:
+                recolored.append(code)
+        if dropped_colors:
+            move_crop_offsets(folder_path, removed=dropped_colors)
+
+        # Renumber first: the journal entries below are keyed by the new item numbers
+        if old['blobs'] != new['blobs']:
+            moves, stale, changed = plan_item_moves(old['blobs'], new['blobs'])
+            for d in color_dirs.values():
+                if not os.path.isdir(d): continue
+                pairs = [(os.path.join(d, f"{i}.png"), os.path.join(d, f"{j}.png")) for i, j in moves.items()]
+                rename_many(pairs)
+                journal.move_many(pairs)
+                for n in stale:
+                    p = os.path.join(d, f"{n}.png")
+                    if os.path.exists(p): os.remove(p)
+                    journal.forget(p)
+            # Thumbnails follow their items; thumbs of replaced items are dropped
+            thumb_pairs = [(os.path.join(folder_path, f"thumb_{i}.png"), os.path.join(folder_path, f"thumb_{j}.png")) for i, j in moves.items()]
+            rename_many(thumb_pairs)
+            journal.move_many(thumb_pairs)
+            for n in stale + changed:
+                p = os.path.join(folder_path, f"thumb_{n}.png")
+                if os.path.exists(p): os.remove(p)
+                journal.forget(p)
+            # Cropped kits: offsets follow their items too (changed items get new ones on re-render)
+            move_crop_offsets(folder_path,
+                              moves=[(crop_key(code, f"{i}.png"), crop_key(code, f"{j}.png")) for code in color_dirs for i, j in moves.items()],
+                              removed=[crop_key(code, f"{n}.png") for code in color_dirs for n in stale + changed])
+            moved_items += len(moves)
+            rerender += len(changed)
+
+        # Same folder, different gradient: recolor everything in it
+        for code in recolored:
+            for n in range(1, len(new['blobs']) + 1):
+                journal.forget(os.path.join(color_dirs[code], f"{n}.png"))
+            rerender += len(new['blobs'])
+        # Thumbnails are made from the first color: re-render them when it changes
+        first_old = next(iter(old['colors'].items()), None)
+        first_new = next(iter(new['colors'].items()), None)
+        if first_old != first_new:
+            for n in range(1, len(new['blobs']) + 1):
+                journal.forget(os.path.join(folder_path, f"thumb_{n}.png"))
+
+    # 4. Keep separated_layers.json pointing at the renamed folders
+    sep_path = os.path.join(base_dir, "separated_layers.json")
+    if folder_renames and os.path.exists(sep_path):
+        try:
+            with open(sep_path, 'r', encoding='utf-8') as f:
+                sep_list = json.load(f)
+            sep_list = [folder_renames.get(name, name) for name in sep_list]
+            with open(sep_path, 'w', encoding='utf-8') as f:
+                json.dump(sep_list, f, ensure_ascii=False, indent=2)
+        except Exception as e:
+            print(f"ERROR: Failed to update separated_layers.json: {e}")
+
+    journal.compact()
+    journal.close()
+    print(f"Sync: {len(removed)} layers removed, {len(folder_moves)} folders renamed, "
+          f"{moved_items} items renumbered, ~{rerender} outputs to re-render")
+
+    shutil.move(new_metadata_path, metadata_path)
+    return reorganize_kit(metadata_path, **reorganize_args)
+
+# ============= SHARDED DOWNLOADS =============
+
+# Shard journals and done markers, inside the kit folder shared by every host
+SHARD_DIR = "shards"
+SHARD_POLL_SECONDS = 2.0
+
+def shard_of(blob, count):
+    """
+    Stable 1-based shard of a blob (the same on every host and Python version).
+    """
+    return zlib.crc32(blob.encode('utf-8')) % count + 1
+
+def in_shard(blob, shard):
+    return shard_of(blob, shard[1]) == shard[0]
+
+def parse_shard(text):
+    """
+    "2/4" -> (2, 4).
+    """
+    index, _, count = str(text).partition("/")
+    index, count = int(index), int(count)
+    if not 1 <= index <= count:
+        raise ValueError(f"Invalid shard {text} (use i/N with 1 <= i <= N)")
+    return index, count
+
+def shard_file(shard, kind, ext):
+    return os.path.join(SHARD_DIR, f"{kind}-{shard[0]}-of-{shard[1]}.{ext}")
+
+def assemble_shards(base_dir, count, timeout=None, **reorganize_args):
+    """
+    Coordinator: waits for the done markers of all shards, merges their journals and crop
+    offsets into the kit, then runs one normal reorganize_kit pass. That pass writes
+    lazy_colors.json, retries blobs a shard failed on and skips everything already done.
+    """
+    shard_dir = os.path.join(base_dir, SHARD_DIR)
+    shards = [(i, count) for i in range(1, count + 1)]
+    start = time.time()
+    reported = -1
+    while True:
+        done = [s for s in shards if os.path.exists(os.path.join(base_dir, shard_file(s, "done", "json")))]
+        if len(done) == count:
+            break
+        if len(done) != reported:
+            print(f"Assemble: {len(done)}/{count} shards done, waiting...")
+            reported = len(done)
+        if timeout is not None and time.time() - start > timeout:
+            print(f"Assemble: timed out, missing shards: {', '.join(str(s[0]) for s in shards if s not in done)}")
+            return None
+        time.sleep(SHARD_POLL_SECONDS)
+
+    journal = DownloadJournal(base_dir)
+    files, failed = 0, 0
+    for s in shards:
+        entries, _ = DownloadJournal.read_entries(os.path.join(base_dir, shard_file(s, "journal", "jsonl")))
+        journal.entries.update(entries)
+        with open(os.path.join(base_dir, shard_file(s, "done", "json")), 'r', encoding='utf-8') as f:
+            result = json.load(f)
+        files += result['files']
+        failed += result['failed_blobs']
+        for folder, items in result['offsets'].items():
+            update_crop_offsets(base_dir, folder, items)
+    journal.compact()
+    journal.close()
+    shutil.rmtree(shard_dir, ignore_errors=True)
+    print(f"Assemble: {count} shards wrote {files} files ({failed} blobs failed), finishing the kit...")
+    return reorganize_kit(os.path.join(base_dir, "metadata.json"), **reorganize_args)
+
+def run_local_shards(base_dir, count, flags, processes=None):
+    """
+    Starts `count` shard processes of this script on this machine (each with its own
+    fetch pool and colorize pool) and waits for them. Their output is prefixed [shard i/N].
+    Returns True when every shard exited cleanly.
+    """
+    processes = processes or max(1, (os.cpu_count() or 1) // count)
+
+    def relay(proc, prefix):
+        for line in proc.stdout:
+            print(prefix + line.rstrip())
+
+    children = []
+    for i in range(1, count + 1):
+        cmd = [sys.executable, "-u", os.path.abspath(__file__), os.path.basename(base_dir),
+               "--shard", f"{i}/{count}", "--processes", str(processes)] + flags
+        proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, encoding='utf-8', errors='replace')
+        reader = threading.Thread(target=relay, args=(proc, f"[shard {i}/{count}] "), daemon=True)
+        reader.start()
+        children.append((proc, reader))
+    ok = True
+    for proc, reader in children:
+        ok = proc.wait() == 0 and ok
+        reader.join()
+    return ok
+
+def passthrough_flags(value_flags, switches):
+    """
+    The given flags of this command line, to hand on to shard processes.
+    """
+    flags = []
+    for name in value_flags:
+        value = get_flag_value(name)
+        if value is not None:
+            flags += [name, value]
+    return flags + [name for name in switches if name in sys.argv]
+
+# ============= OFFLINE REBUILD =============
+
+def find_kit_dir(arg):
+    """
+    Local folder of a downloaded kit from a folder name under downloads/, an ID or a composer URL.
+    """
+    if os.path.isdir(os.path.join("downloads", arg)):
+        return os.path.join("downloads", arg)
+    return os.path.join("downloads", f"neka_{arg.rstrip('/').split('/')[-1]}")
+
+def rebuild_kit(base_dir, sources=(), **reorganize_args):
+    """
+    Regenerates items_structured from metadata.json and cached blobs only (plus the given
+    offline sources), re-coloring with the current tonings. The previous folder and journal
+    are kept as *.old until every blob was found; otherwise they are restored.
+    """
+    metadata_path = os.path.join(base_dir, "metadata.json")
+    if not os.path.exists(metadata_path):
+        print(f"Error: {metadata_path} not found.")
+        return None
+    set_blob_sources(sources)
+    if reorganize_args.get('crop') is None:
+        reorganize_args['crop'] = has_crop_offsets(base_dir)
+
+    moved = []
+    for name in ("items_structured", JOURNAL_NAME):
+        path = os.path.join(base_dir, name)
+        backup = path + ".old"
+        if os.path.isdir(backup): shutil.rmtree(backup)
+        elif os.path.exists(backup): os.remove(backup)
+        if os.path.exists(path):
+            os.rename(path, backup)
+            moved.append((path, backup))
+
+    def restore():
+        for path, backup in moved:
+            if os.path.isdir(path): shutil.rmtree(path)
+            elif os.path.exists(path): os.remove(path)
+            os.rename(backup, path)
+
+    failed_before = STATS.count('failed_fetches')
+    try:
+        total = reorganize_kit(metadata_path, **reorganize_args)
+    except Exception:
+        restore()
+        raise
+    missing = STATS.count('failed_fetches') - failed_before
+    if missing:
+        restore()
+        print(f"Rebuild: {missing} blobs are not in the cache or any source, kept the previous items_structured "
+              f"(add --source mirror:DIR / zip:FILE / http).")
+        return None
+    for path, backup in moved:
+        if os.path.isdir(backup): shutil.rmtree(backup)
+        else: os.remove(backup)
+    print(f"Rebuild: regenerated {total} files in {base_dir}/items_structured")
+    return total
 
 # ============= MAIN =============
 
-if __name__ == "__main__":
-    if len(sys.argv) < 2:
-        print("Usage: python download_neka_kit.py <URL or ID>")
-        print("Example: python download_neka_kit.py https://www.neka.cc/composer/12705")
-        print("Example: python download_neka_kit.py 12705")
-        sys.exit(1)
-    
-    arg = sys.argv[1]
-    
+def resolve_kit_url(arg):
     # Check if argument is URL or just ID
     if arg.startswith("http"):
-        url = arg
-    else:
-        url = f"https://www.neka.cc/composer/{arg}"
+        return arg
+    return f"https://www.neka.cc/composer/{arg}"
+
+def ask_selected_y(kit):
+    """
+    Interactive --y prompt. Returns a set of Y indices, or None for all layers.
+    """
+    print("\n--- SELECTIVE DOWNLOAD MODE ---")
+    parts = kit.get('data', {}).get('parts', [])
+    print("Available Layers (Y Indices):")
+    for idx, part in enumerate(parts):
+        p_name = part.get('name', 'unnamed')
+        print(f" [{idx + 1}] {p_name}")
     
-    print(f"Processing: {url}")
+    print("\nEnter Y indices to download (e.g. 1,3,5-10) or 'all':")
+    user_input = input("> ").strip().lower()
     
-    # Step 1: Download metadata
-    temp_json = "temp_kit_data.json"
-    metadata_file = get_clean_data_via_browser(url, temp_json)
+    if user_input == 'all' or user_input == '':
+        return None
+    selected_y = set()
+    try:
+        # Simple parser for "1,3,5-10"
+        for chunk in user_input.split(','):
+            if '-' in chunk:
+                start, end = map(int, chunk.split('-'))
+                for i in range(start, end + 1):
+                    selected_y.add(i)
+            else:
+                selected_y.add(int(chunk))
+        print(f"Targeting layers: {sorted(list(selected_y))}")
+        return selected_y
+    except Exception as e:
+        print(f"Invalid input format: {e}. Downloading ALL.")
+        return None
+
+def metadata_temp_path(url):
+    # Per-kit temp file so parallel runs never clobber each other
+    kit_key = re.sub(r"[^0-9A-Za-z_-]", "_", url.rstrip('/').split('/')[-1])
+    return f"temp_kit_data_{kit_key}.json"
+
+def kit_base_dir(kit):
+    # Use ID-only naming to avoid Chinese characters in folder names
+    return os.path.join("downloads", f"neka_{kit.get('id', 'unknown_id')}")
+
+def download_kit_metadata(url, use_browser=False, sync=False):
+    """
+    Fetches and decompresses the kit, then moves it to downloads/neka_<id>/metadata.json.
+    With sync=True and an existing download, the fresh metadata is left in a temp file
+    next to it (metadata.new.json) for sync_kit to diff.
+    Returns (kit dict, metadata path) or (None, None).
+    """
+    temp_json = metadata_temp_path(url)
+    phase_start = time.time()
+    metadata_file = get_clean_data(url, temp_json, use_browser=use_browser)
+    STATS.add_phase('metadata', time.time() - phase_start)
     
     if not metadata_file:
-        print("Failed to download metadata.")
-        sys.exit(1)
+        print(f"Failed to download metadata for {url}.")
+        return None, None
     
-    # Step 2: Read metadata to get kit name and ID
     with open(metadata_file, 'r', encoding='utf-8') as f:
         kit = json.load(f)
     
     kit_name = kit.get('name', 'unknown_kit').replace(' ', '_').replace('/', '-')
     kit_id = str(kit.get('id', 'unknown_id'))
     
-    # Step 3: Create final directory structure
-    # Use ID-only naming to avoid Chinese characters in folder names
-    base_dir = os.path.join("downloads", f"neka_{kit_id}")
-    if not os.path.exists(base_dir):
-        os.makedirs(base_dir)
+    base_dir = kit_base_dir(kit)
+    os.makedirs(base_dir, exist_ok=True)
     
     final_metadata_path = os.path.join(base_dir, "metadata.json")
+    if sync and os.path.exists(final_metadata_path):
+        new_metadata_path = os.path.join(base_dir, "metadata.new.json")
+        shutil.move(temp_json, new_metadata_path)
+        print(f"\nKit: {kit_name} (ID: {kit_id}) - fresh metadata saved for sync")
+        return kit, new_metadata_path
     shutil.move(temp_json, final_metadata_path)
     
     print(f"\nKit: {kit_name} (ID: {kit_id})")
     print(f"Metadata saved to: {final_metadata_path}")
+    return kit, final_metadata_path
+
+def read_kit_list(path):
+    """
+    Kit IDs or URLs, one per line (blank lines and # comments ignored).
+    """
+    kits = []
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.split('#', 1)[0].strip()
+            if line:
+                kits.extend(x for x in re.split(r"[\s,]+", line) if x)
+    return kits
+
+def download_batch(kit_args, workers=DEFAULT_WORKERS, parallel_kits=2, processes=None, png_profile=None,
+                   cache_quota=None, use_browser=False, sync=False, lazy=None, crop=None):
+    """
+    Downloads many kits with one HTTP pool, one fetch thread pool (the global worker
+    budget), one colorizing process pool and one blob cache shared by all of them.
+    """
+    urls = []
+    for arg in kit_args:
+        url = resolve_kit_url(arg)
+        if url not in urls:
+            urls.append(url)
+    print(f"Batch: {len(urls)} kits, {parallel_kits} at a time, "
+          f"{workers} download workers in total (adaptive up to {FETCH_CONTROL.max_limit})")
+
+    fetch_threads = FETCH_CONTROL.pool_size(workers)
+    configure_http_session(fetch_threads)
+    results = {}
+    start_time = time.time()
+
+    def run_one(url):
+        kit, metadata_path = download_kit_metadata(url, use_browser=use_browser, sync=sync)
+        if not metadata_path:
+            return None
+        args = dict(workers=workers, cache_quota=cache_quota, png_profile=png_profile,
+                    fetch_executor=fetch_executor, colorize_executor=colorize_executor, lazy=lazy, crop=crop)
+        if os.path.basename(metadata_path) == "metadata.new.json":
+            return sync_kit(os.path.dirname(metadata_path), metadata_path, **args)
+        return reorganize_kit(metadata_path, **args)
+
+    with ThreadPoolExecutor(max_workers=fetch_threads) as fetch_executor, \
+         ProcessPoolExecutor(max_workers=processes or os.cpu_count() or 1) as colorize_executor, \
+         ThreadPoolExecutor(max_workers=max(1, parallel_kits)) as kit_executor:
+        futures = {kit_executor.submit(run_one, url): url for url in urls}
+        for future in as_completed(futures):
+            url = futures[future]
+            try:
+                results[url] = future.result()
+            except Exception as e:
+                print(f"Kit {url} failed: {e}")
+                results[url] = None
+
+    prune_blob_cache(get_blob_cache(os.path.join("downloads", "cache_blobs")))
+
+    failed = [u for u, r in results.items() if r is None]
+    print(f"\nBatch done in {time.time() - start_time:.1f}s: {len(urls) - len(failed)} ok, {len(failed)} failed")
+    for url in failed:
+        print(f"  FAILED: {url}")
+    return results
+
+def get_flag_value(name, default=None):
+    if name in sys.argv:
+        idx = sys.argv.index(name) + 1
+        if idx < len(sys.argv):
+            return sys.argv[idx]
+    return default
+
+# Flags followed by a value (everything else starting with -- is a switch)
+VALUE_FLAGS = {"--workers", "--processes", "--png", "--cache-quota", "--batch", "--parallel-kits", "--stats",
+               "--max-workers", "--rate", "--source", "--shard", "--shards", "--assemble"}
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("Usage: python download_neka_kit.py <URL or ID> [more IDs...]")
+        print("Example: python download_neka_kit.py https://www.neka.cc/composer/12705")
+        print("Example: python download_neka_kit.py 12705")
+        print("Example: python download_neka_kit.py 12705 12706 --batch more_ids.txt")
+        print("Options: --y (select layers), --workers N (parallel downloads, default 8)")
+        print(f"         --max-workers N (adaptive ceiling, default {ADAPTIVE_MAX_WORKERS}), --fixed-workers (no adapting)")
+        print("         --rate N (at most N blob requests per second)")
+        print("         --browser (skip the HTTP fetch and read metadata through Chrome)")
+        print("         --processes N (colorizing processes, default one per CPU core)")
+        print("         --png fast|default|archival (PNG encoding profile for generated files)")
+        print("         --cache-quota SIZE (e.g. 20G, LRU-evicts cache_blobs after the run)")
+        print("         --batch FILE (kit IDs/URLs, one per line), --parallel-kits N (default 2)")
+        print("         --sync (update an existing download in place, only fetching what changed)")
+        print("         --lazy (store only source blobs + tonings, app_server colors files on request)")
+        print("         --crop (trim items to their visible pixels, positions saved in X-Y/offsets.json)")
+        print("         --source SPEC[,SPEC] (blob sources in order: http, https://host, mirror:DIR, cache:DIR, zip:FILE)")
+        print("         --rebuild (regenerate items_structured from metadata.json + cached blobs, no download)")
+        print("         --shards N (split the kit's blobs over N local processes, then assemble)")
+        print("         --shard i/N (one shard, e.g. on another host sharing downloads/), --assemble N (wait + finish)")
+        print("         --plan (dry run: count layers/blobs/files, estimate download size and time)")
+        print("         --progress (live progress line), --stats FILE (also save the JSON run stats)")
+        sys.exit(1)
+    
+    kit_args = []
+    skip_next = False
+    for a in sys.argv[1:]:
+        if skip_next:
+            skip_next = False
+        elif a in VALUE_FLAGS:
+            skip_next = True
+        elif not a.startswith("--"):
+            kit_args.append(a)
+    
+    workers = DEFAULT_WORKERS
+    if "--workers" in sys.argv:
+        try:
+            workers = max(1, int(get_flag_value("--workers")))
+        except (TypeError, ValueError):
+            print(f"Invalid --workers value, using {DEFAULT_WORKERS}.")
+    
+    max_workers = None
+    if "--max-workers" in sys.argv:
+        try:
+            max_workers = max(1, int(get_flag_value("--max-workers")))
+        except (TypeError, ValueError):
+            print(f"Invalid --max-workers value, using {ADAPTIVE_MAX_WORKERS}.")
+    
+    rate = None
+    if "--rate" in sys.argv:
+        try:
+            rate = float(get_flag_value("--rate"))
+            if rate <= 0: rate = None
+        except (TypeError, ValueError):
+            print("Invalid --rate value, requests are not rate limited.")
+    FETCH_CONTROL.configure(workers, max_workers, rate, adaptive="--fixed-workers" not in sys.argv)
+    
+    processes = None
+    if "--processes" in sys.argv:
+        try:
+            processes = max(1, int(get_flag_value("--processes")))
+        except (TypeError, ValueError):
+            print("Invalid --processes value, using one per CPU core.")
+    
+    png_profile = None
+    if "--png" in sys.argv:
+        if get_flag_value("--png") in PNG_PROFILES:
+            png_profile = get_flag_value("--png")
+        else:
+            print(f"Invalid --png value (choose from {', '.join(PNG_PROFILES)}), using default.")
+    
+    cache_quota = None
+    if "--cache-quota" in sys.argv:
+        try:
+            cache_quota = parse_size(get_flag_value("--cache-quota"))
+        except (TypeError, ValueError):
+            print("Invalid --cache-quota value (e.g. 20G), keeping the stored quota.")
     
+    use_browser = "--browser" in sys.argv
+    lazy = True if "--lazy" in sys.argv else None
+    crop = True if "--crop" in sys.argv else None
+    STATS.live = "--progress" in sys.argv
+    stats_path = get_flag_value("--stats")
+    
+    if "--batch" in sys.argv:
+        batch_file = get_flag_value("--batch")
+        if not batch_file or not os.path.exists(batch_file):
+            print(f"Batch file not found: {batch_file}")
+            sys.exit(1)
+        kit_args.extend(read_kit_list(batch_file))
+    
+    if not kit_args:
+        print("No kit ID or URL given.")
+        sys.exit(1)
+    
+    sources = None
+    if "--source" in sys.argv:
+        try:
+            sources = [parse_blob_source(spec) for spec in (get_flag_value("--source") or "").split(",") if spec]
+        except ValueError as e:
+            print(e)
+            sys.exit(1)
+    
+    if "--rebuild" in sys.argv:
+        # Offline unless --source says otherwise: the local cache is always used first
+        results = [rebuild_kit(find_kit_dir(arg), sources or [], workers=workers, processes=processes,
+                               png_profile=png_profile, lazy=lazy, crop=crop) for arg in kit_args]
+        STATS.print_summary(stats_path)
+        sys.exit(0 if all(r is not None for r in results) else 1)
+    if sources is not None:
+        set_blob_sources(sources)
+    
+    if "--shard" in sys.argv or "--assemble" in sys.argv:
+        # Hosts sharing downloads/: each runs --shard i/N, one of them (or another) --assemble N
+        arg = kit_args[0]
+        base_dir = find_kit_dir(arg)
+        metadata_path = os.path.join(base_dir, "metadata.json")
+        if not os.path.exists(metadata_path):
+            kit, metadata_path = download_kit_metadata(resolve_kit_url(arg), use_browser=use_browser)
+            if not metadata_path:
+                sys.exit(1)
+            base_dir = os.path.dirname(metadata_path)
+        try:
+            if "--shard" in sys.argv:
+                shard = parse_shard(get_flag_value("--shard"))
+                reorganize_kit(metadata_path, workers=workers, processes=processes, png_profile=png_profile,
+                               lazy=lazy, crop=crop, shard=shard)
+                result = True
+            else:
+                result = assemble_shards(base_dir, int(get_flag_value("--assemble")), workers=workers, cache_quota=cache_quota,
+                                         processes=processes, png_profile=png_profile, lazy=lazy, crop=crop)
+        except ValueError as e:
+            print(e)
+            sys.exit(1)
+        STATS.print_summary(stats_path)
+        sys.exit(0 if result is not None else 1)
+    
+    if "--plan" in sys.argv:
+        for arg in kit_args:
+            url = resolve_kit_url(arg)
+            # The fresh metadata stays in the temp file: a plan creates nothing under downloads/
+            temp_json = metadata_temp_path(url)
+            try:
+                if not get_clean_data(url, temp_json, use_browser=use_browser):
+                    print(f"Failed to download metadata for {url}.")
+                    continue
+                with open(temp_json, 'r', encoding='utf-8') as f:
+                    kit = json.load(f)
+                selected_y = ask_selected_y(kit) if "--y" in sys.argv and len(kit_args) == 1 else None
+                plan_kit(temp_json, selected_y=selected_y, workers=workers, processes=processes,
+                         png_profile=png_profile, lazy=lazy, base_dir=kit_base_dir(kit))
+            finally:
+                if os.path.exists(temp_json):
+                    os.remove(temp_json)
+        sys.exit(0)
+    
+    if len(kit_args) > 1:
+        if "--y" in sys.argv:
+            print("--y is interactive and is ignored in batch mode (downloading all layers).")
+        parallel_kits = 2
+        try:
+            parallel_kits = max(1, int(get_flag_value("--parallel-kits", 2)))
+        except ValueError:
+            print("Invalid --parallel-kits value, using 2.")
+        results = download_batch(kit_args, workers=workers, parallel_kits=parallel_kits, processes=processes,
+                                 png_profile=png_profile, cache_quota=cache_quota, use_browser=use_browser,
+                                 sync="--sync" in sys.argv, lazy=lazy, crop=crop)
+        STATS.print_summary(stats_path)
+        sys.exit(0 if all(r is not None for r in results.values()) else 1)
+    
+    url = resolve_kit_url(kit_args[0])
+    print(f"Processing: {url}")
+    
+    # Step 1-3: Download metadata into downloads/neka_<id>/
+    kit, final_metadata_path = download_kit_metadata(url, use_browser=use_browser, sync="--sync" in sys.argv)
+    if not final_metadata_path:
+        sys.exit(1)
+    base_dir = os.path.dirname(final_metadata_path)
+    
+    if os.path.basename(final_metadata_path) == "metadata.new.json":
+        print("\nSyncing existing download with upstream...")
+        sync_kit(base_dir, final_metadata_path, workers=workers, cache_quota=cache_quota, processes=processes, png_profile=png_profile,
+                 lazy=lazy, crop=crop)
+        STATS.print_summary(stats_path)
+        print(f"\n✓ Synced! Check: {base_dir}/items_structured/")
+        sys.exit(0)
+    
+    if "--shards" in sys.argv:
+        try:
+            count = max(1, int(get_flag_value("--shards")))
+        except (TypeError, ValueError):
+            print("Invalid --shards value.")
+            sys.exit(1)
+        if "--y" in sys.argv:
+            print("--y is ignored with --shards (downloading all layers).")
+        print(f"\nDownloading with {count} shard processes...")
+        flags = passthrough_flags(["--workers", "--max-workers", "--rate", "--png", "--source"],
+                                  ["--fixed-workers", "--lazy", "--crop"])
+        if not run_local_shards(base_dir, count, flags, processes):
+            print(f"Some shards failed: re-run them with --shard i/{count}, then --assemble {count}.")
+            sys.exit(1)
+        assemble_shards(base_dir, count, workers=workers, cache_quota=cache_quota, processes=processes,
+                        png_profile=png_profile, lazy=lazy, crop=crop)
+        STATS.print_summary(stats_path)
+        print(f"\n✓ Complete! Check: {base_dir}/items_structured/")
+        sys.exit(0)
+
     # Step 4: Reorganize and download images
     print("\nStarting image download and organization...")
     
     # Handle selective download flag
-    is_selective = "--y" in sys.argv
     selected_y = None
-    
-    if is_selective:
-        print("\n--- SELECTIVE DOWNLOAD MODE ---")
-        parts = kit.get('data', {}).get('parts', [])
-        print("Available Layers (Y Indices):")
-        for idx, part in enumerate(parts):
-            p_name = part.get('name', 'unnamed')
-            print(f" [{idx + 1}] {p_name}")
-        
-        print("\nEnter Y indices to download (e.g. 1,3,5-10) or 'all':")
-        user_input = input("> ").strip().lower()
-        
-        if user_input != 'all' and user_input != '':
-            selected_y = set()
-            try:
-                # Simple parser for "1,3,5-10"
-                for chunk in user_input.split(','):
-                    if '-' in chunk:
-                        start, end = map(int, chunk.split('-'))
-                        for i in range(start, end + 1):
-                            selected_y.add(i)
-                    else:
-                        selected_y.add(int(chunk))
-                print(f"Targeting layers: {sorted(list(selected_y))}")
-            except Exception as e:
-                print(f"Invalid input format: {e}. Downloading ALL.")
-                selected_y = None
+    if "--y" in sys.argv:
+        selected_y = ask_selected_y(kit)
 
-    reorganize_kit(final_metadata_path, selected_y=selected_y)
+    reorganize_kit(final_metadata_path, selected_y=selected_y, workers=workers, cache_quota=cache_quota, processes=processes, png_profile=png_profile,
+                   lazy=lazy, crop=crop)
+    STATS.print_summary(stats_path)
     
     print(f"\n✓ Complete! Check: {base_dir}/items_structured/")
@@ -0,0 +1,167 @@
+import time
+import threading
+
+from run_stats import STATS
+
+# Answers that mean "slow down" rather than "try again": halve concurrency at once
+THROTTLE_STATUS_CODES = {429, 503}
+
+ADAPTIVE_MAX_WORKERS = 32   # default ceiling of in-flight fetches
+THROTTLE_FACTOR = 0.5       # multiplicative decrease on 429/503
+CONGESTION_FACTOR = 0.85    # gentler decrease when latency or error rate degrade
+LATENCY_TOLERANCE = 2.0     # latency EWMA above this x the best seen counts as congestion
+ERROR_RATE_MAX = 0.1        # error rate EWMA above this stops growth
+EWMA_WEIGHT = 0.2
+MIN_WINDOW = 0.2            # at most one decrease per max(latency, MIN_WINDOW) seconds
+
+class TokenBucket:
+    """
+    Global requests-per-second cap shared by every fetch thread (rate None: unlimited).
+    """
+
+    def __init__(self, rate=None, burst=None):
+        self.rate = rate
+        self.capacity = float(burst or max(1.0, rate or 1.0))
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def take(self):
+        """
+        Blocks until a token is available. Returns the seconds waited.
+        """
+        if not self.rate:
+            return 0.0
+        waited = 0.0
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return waited
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+            waited += wait
+
+class FetchSlot:
+    def __init__(self, control):
+        self.control = control
+        self.reported = False
+
+    def __enter__(self):
+        self.control.acquire()
+        return self
+
+    def report(self, status, latency, retry_after=None):
+        self.reported = True
+        self.control.release(status, latency, retry_after)
+
+    def __exit__(self, exc_type, exc, tb):
+        if not self.reported:
+            # Timeout or connection error
+            self.control.release(None, None)
+        return False
+
+class FetchController:
+    """
+    AIMD limit on in-flight blob requests plus a token-bucket rate cap.
+    Healthy responses raise the limit by one per window of `limit` requests; 429/503
+    halve it (once per latency window, so a burst of throttled replies counts once)
+    and a Retry-After pauses every thread. Rising latency or errors shrink it gently.
+    """
+
+    def __init__(self, initial, maximum, rate=None, adaptive=True):
+        self.cond = threading.Condition()
+        self.in_flight = 0
+        self.configure(initial, maximum, rate, adaptive)
+
+    def configure(self, initial, maximum=None, rate=None, adaptive=True):
+        with self.cond:
+            self.adaptive = adaptive
+            self.max_limit = max(1, initial if not adaptive else max(initial, maximum or ADAPTIVE_MAX_WORKERS))
+            self.limit = float(max(1, min(initial, self.max_limit)))
+            self.bucket = TokenBucket(rate)
+            self.latency = None
+            self.best_latency = None
+            self.error_rate = 0.0
+            self.paused_until = 0.0
+            self.last_decrease = 0.0
+            self.cond.notify_all()
+
+    def pool_size(self, workers):
+        """
+        Threads needed so the limit can grow to its ceiling.
+        """
+        return max(workers, self.max_limit)
+
+    def slot(self):
+        return FetchSlot(self)
+
+    def pause(self, seconds):
+        with self.cond:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+    def acquire(self):
+        with self.cond:
+            while True:
+                wait = self.paused_until - time.monotonic()
+                if wait > 0:
+                    self.cond.wait(wait)
+                elif self.in_flight >= int(self.limit):
+                    self.cond.wait()
+                else:
+                    break
+            self.in_flight += 1
+            depth = self.in_flight
+        STATS.queue_depth('in_flight', depth)
+        self.bucket.take()
+
+    def release(self, status, latency, retry_after=None):
+        throttled = status in THROTTLE_STATUS_CODES
+        if throttled:
+            STATS.incr('throttled')
+            if retry_after:
+                self.pause(retry_after)
+        with self.cond:
+            self.in_flight -= 1
+            if self.adaptive:
+                self.adjust(status, latency, throttled)
+            self.cond.notify_all()
+
+    def adjust(self, status, latency, throttled):
+        """
+        Called with the condition held after every request.
+        """
+        failed = status is None or status >= 500 or throttled
+        self.error_rate += EWMA_WEIGHT * ((1.0 if failed else 0.0) - self.error_rate)
+        if latency is not None and not failed:
+            self.latency = latency if self.latency is None else self.latency + EWMA_WEIGHT * (latency - self.latency)
+            self.best_latency = self.latency if self.best_latency is None else min(self.best_latency, self.latency)
+
+        congested = (self.error_rate > ERROR_RATE_MAX
+                     or (self.latency is not None and self.latency > LATENCY_TOLERANCE * self.best_latency))
+        now = time.monotonic()
+        if throttled or congested:
+            if now - self.last_decrease < max(self.latency or 0.0, MIN_WINDOW):
+                return
+            self.last_decrease = now
+            factor = THROTTLE_FACTOR if throttled else CONGESTION_FACTOR
+            self.set_limit(self.limit * factor)
+        elif not failed:
+            self.set_limit(self.limit + 1.0 / self.limit)
+
+    def set_limit(self, value):
+        old = int(self.limit)
+        self.limit = min(float(self.max_limit), max(1.0, value))
+        if int(self.limit) != old:
+            STATS.queue_depth('concurrency_limit', int(self.limit))
+
+    def current_limit(self):
+        with self.cond:
+            return int(self.limit)
+
+# One controller per process, shared by every fetch thread (and every kit of a batch).
+# Starts at download_neka_kit's DEFAULT_WORKERS; the CLI reconfigures it from its flags.
+FETCH_CONTROL = FetchController(8, ADAPTIVE_MAX_WORKERS)
@@ -0,0 +1,189 @@
+import os
+import re
+import json
+import hashlib
+import threading
+
+from download_neka_kit import (LAZY_MANIFEST_NAME, JOURNAL_NAME, SHARD_DIR, load_crop_offsets,
+                               write_bytes_atomic)
+
+# Per-kit copy of the index, so a restarted server does not rescan every folder
+INDEX_NAME = "structure_index.json"
+INDEX_VERSION = 2
+
+# State of the downloader and the server kept in a kit folder: left out of exports and
+# of the content key. Suffixes cover temp files (write_bytes_atomic), locks and rebuild backups.
+INTERNAL_NAMES = {INDEX_NAME, LAZY_MANIFEST_NAME, JOURNAL_NAME, "metadata.new.json", SHARD_DIR}
+INTERNAL_SUFFIXES = (".part", ".tmp", ".lock", ".old")
+
+def is_internal(name):
+    return name in INTERNAL_NAMES or name.endswith(INTERNAL_SUFFIXES)
+
+THUMB_PATTERN = re.compile(r"^thumb_(\d+)\.png$")
+FOLDER_PATTERN = re.compile(r"^(\d+)-(\d+)$")
+
+def scan_folder(folder_path, entry):
+    """
+    The get_kit_structure data of one X-Y folder (one listdir).
+    """
+    match = FOLDER_PATTERN.match(entry)
+    x, y = (int(match.group(1)), int(match.group(2))) if match else (9999, 9999)
+    item_indices = []
+    colors = []
+    with os.scandir(folder_path) as it:
+        for e in it:
+            if e.is_dir():
+                colors.append(e.name)
+            else:
+                m = THUMB_PATTERN.match(e.name)
+                if m: item_indices.append(int(m.group(1)))
+    return {
+        "x": x, "y": y, "folder": entry,
+        "items_count": max(item_indices) if item_indices else 0,
+        "colors": colors,
+        # Canvas positions of trimmed items (kits downloaded with --crop), else null
+        "offsets": load_crop_offsets(folder_path) or None
+    }
+
+class KitIndex:
+    """
+    Folder listing of one kit's items_structured. Each X-Y folder is rescanned only when
+    its mtime changes (files or color folders added, removed or renamed in it) or when a
+    mutating endpoint invalidates it; the folder set only when items_structured changes.
+    """
+
+    def __init__(self, kit_path):
+        self.kit_path = kit_path
+        self.structured_dir = os.path.join(kit_path, "items_structured")
+        self.lock = threading.Lock()
+        self.root_mtime = None
+        self.folders = {}   # entry -> {'mtime': st_mtime_ns at scan, 'data': scan_folder()}
+        self.version = 0    # bumped by every invalidate(), i.e. every change made through the server
+        self.dirty = False
+        self.load()
+
+    def load(self):
+        try:
+            with open(os.path.join(self.kit_path, INDEX_NAME), 'r', encoding='utf-8') as f:
+                saved = json.load(f)
+        except (OSError, ValueError):
+            return
+        if saved.get('version') == INDEX_VERSION:
+            self.root_mtime = saved.get('root_mtime')
+            self.folders = saved.get('folders', {})
+            self.version = saved.get('version_counter', 0)
+
+    def save(self):
+        data = {'version': INDEX_VERSION, 'version_counter': self.version, 'root_mtime': self.root_mtime, 'folders': self.folders}
+        try:
+            write_bytes_atomic(json.dumps(data, ensure_ascii=False).encode('utf-8'), os.path.join(self.kit_path, INDEX_NAME))
+        except OSError as e:
+            print(f"Could not save {INDEX_NAME}: {e}")
+        self.dirty = False
+
+    def refresh(self):
+        """
+        Stat-based check (one stat per folder) that also catches changes made outside the server.
+        Called with the lock held.
+        """
+        root_mtime = os.stat(self.structured_dir).st_mtime_ns
+        if root_mtime != self.root_mtime:
+            entries = {e.name for e in os.scandir(self.structured_dir) if e.is_dir()}
+            for entry in list(self.folders):
+                if entry not in entries:
+                    del self.folders[entry]
+            for entry in entries:
+                self.folders.setdefault(entry, {'mtime': None, 'data': None})
+            self.root_mtime = root_mtime
+            self.dirty = True
+        for entry, record in list(self.folders.items()):
+            folder_path = os.path.join(self.structured_dir, entry)
+            try:
+                mtime = os.stat(folder_path).st_mtime_ns
+            except OSError:
+                # Removed behind our back: the next call re-lists the folders
+                del self.folders[entry]
+                self.root_mtime = None
+                continue
+            if mtime != record['mtime'] or record['data'] is None:
+                record['mtime'] = mtime
+                record['data'] = scan_folder(folder_path, entry)
+                self.dirty = True
+
+    def parts(self):
+        with self.lock:
+            self.refresh()
+            if self.dirty:
+                self.save()
+            return [dict(record['data']) for record in self.folders.values()]
+
+    def invalidate(self, folders=None):
+        """
+        Forces a rescan of the given X-Y folders (all of them and the folder list when None)
+        and bumps the content version.
+        """
+        with self.lock:
+            if folders is None:
+                self.root_mtime = None
+                targets = list(self.folders)
+            else:
+                targets = folders
+            for entry in targets:
+                if entry in self.folders:
+                    self.folders[entry]['mtime'] = None
+                else:
+                    self.root_mtime = None
+            self.version += 1
+            self.save()
+
+    def content_key(self):
+        """
+        Short hash naming the current content of the kit, for caches of derived files (zip exports).
+        Changes with the version and, for edits made outside the server, with the mtimes of
+        items_structured, the X-Y folders, their color folders and the other entries of the
+        kit folder (metadata.json, separated_layers.json...). Internal state files are ignored.
+        """
+        with self.lock:
+            self.refresh()
+            if self.dirty:
+                self.save()
+            stamp = [self.version, self.root_mtime]
+            for entry in sorted(self.folders):
+                record = self.folders[entry]
+                stamp.append((entry, record['mtime']))
+                for color in sorted(record['data']['colors']):
+                    try:
+                        stamp.append((color, os.stat(os.path.join(self.structured_dir, entry, color)).st_mtime_ns))
+                    except OSError:
+                        stamp.append((color, None))
+        with os.scandir(self.kit_path) as it:
+            # lazy_colors.json is not exported itself, but the colors rendered from it are
+            entries = sorted((e for e in it if e.name == LAZY_MANIFEST_NAME
+                              or (e.name != "items_structured" and not is_internal(e.name))), key=lambda e: e.name)
+        for e in entries:
+            try:
+                st = e.stat()
+                stamp.append((e.name, st.st_mtime_ns, st.st_size))
+            except OSError:
+                stamp.append((e.name, None))
+        return hashlib.sha1(repr(stamp).encode('utf-8')).hexdigest()[:16]
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+def get_index(kit_path):
+    key = os.path.abspath(kit_path)
+    with _indexes_lock:
+        index = _indexes.get(key)
+        if index is None:
+            index = _indexes[key] = KitIndex(kit_path)
+        return index
+
+def invalidate(kit_path, *folders):
+    """
+    Called by the endpoints that change items_structured; no folders means the whole kit.
+    """
+    get_index(kit_path).invalidate(list(folders) or None)
+
+def content_key(kit_path):
+    return get_index(kit_path).content_key()
@@ -0,0 +1,96 @@
+import os
+import re
+import json
+import threading
+from collections import OrderedDict
+
+METADATA_NAME = "metadata.json"
+
+# Parsed kits kept by app_server (least recently used dropped first)
+MAX_CACHED_KITS = 16
+
+class KitMetadata:
+    """
+    Parsed metadata.json of one kit plus the per-part data the server needs on most
+    requests. Shared by every request thread: treat it as read-only.
+    """
+
+    def __init__(self, kit):
+        self.kit = kit
+        data = kit.get('data', {}) if isinstance(kit, dict) else {}
+        self.parts = data.get('parts', []) or []
+        self.layer_counts = []   # per part: {item number: main + addon layers}
+        self.crop_offsets = []   # per part: {"N.png": {"x", "y"}} from the item's first layer
+        for part in self.parts:
+            counts = {}
+            offsets = {}
+            items = part.get('items', []) if isinstance(part, dict) else []
+            for idx, item_layers in enumerate(items):
+                if not isinstance(item_layers, list): item_layers = [item_layers]
+                layer_count = 0
+                for layer in item_layers:
+                    if isinstance(layer, dict):
+                        if layer.get('blob'): layer_count += 1
+                        layer_count += len(layer.get('addonTextures', []))
+                counts[idx + 1] = layer_count
+                if item_layers and isinstance(item_layers[0], dict):
+                    crop = item_layers[0].get('crop') or {}
+                    offsets[f"{idx + 1}.png"] = {"x": crop.get('x', 0), "y": crop.get('y', 0)}
+            self.layer_counts.append(counts)
+            self.crop_offsets.append(offsets)
+
+    def part(self, part_idx):
+        if 0 <= part_idx < len(self.parts):
+            return self.parts[part_idx]
+        return None
+
+    def part_layer_counts(self, part_idx):
+        return self.layer_counts[part_idx] if 0 <= part_idx < len(self.parts) else {}
+
+    def part_crop_offsets(self, part_idx):
+        """
+        Copy of {"N.png": {"x", "y"}}: callers may add sidecar offsets to it.
+        """
+        return dict(self.crop_offsets[part_idx]) if 0 <= part_idx < len(self.parts) else {}
+
+def part_index(folder_name):
+    """
+    "X-Y" -> 0-based part index Y - 1, or None.
+    """
+    match = re.search(r"-(\d+)$", folder_name or "")
+    return int(match.group(1)) - 1 if match else None
+
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+_parse_locks = {}
+
+def load(kit_path):
+    """
+    Returns the KitMetadata of a kit, or None without metadata.json.
+    The file is parsed again only when its mtime or size changes, and only by one thread.
+    """
+    path = os.path.join(kit_path, METADATA_NAME)
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    version = (st.st_mtime_ns, st.st_size)
+    with _cache_lock:
+        cached = _cache.get(path)
+        if cached and cached[0] == version:
+            _cache.move_to_end(path)
+            return cached[1]
+        parse_lock = _parse_locks.setdefault(path, threading.Lock())
+    with parse_lock:
+        with _cache_lock:
+            cached = _cache.get(path)
+        if cached and cached[0] == version:
+            return cached[1]
+        with open(path, 'r', encoding='utf-8') as f:
+            meta = KitMetadata(json.load(f))
+        with _cache_lock:
+            _cache[path] = (version, meta)
+            _cache.move_to_end(path)
+            while len(_cache) > MAX_CACHED_KITS:
+                _cache.popitem(last=False)
+    return meta
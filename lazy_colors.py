@@ -0,0 +1,261 @@
+import os
+import io
+import sys
+import json
+import threading
+from collections import OrderedDict
+from PIL import Image
+
+from blob_cache import get_blob_cache, parse_size, format_size
+from download_neka_kit import (LAZY_MANIFEST_NAME, build_gradient_lut, colorize_planes, fetch_blob,
+                               load_gray_planes, write_bytes_atomic)
+from png_encoding import save_png
+
+# Rendered PNGs kept in memory by app_server (NEKA_LAZY_CACHE, e.g. "512M")
+DEFAULT_CACHE_BYTES = parse_size(os.environ.get("NEKA_LAZY_CACHE", "256M"))
+
+class RenderCache:
+    """
+    Bounded LRU of rendered PNG bytes, shared by the server's request threads.
+    """
+
+    def __init__(self, max_bytes=DEFAULT_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.total = 0
+        self.items = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            data = self.items.get(key)
+            if data is not None:
+                self.items.move_to_end(key)
+            return data
+
+    def put(self, key, data):
+        if len(data) > self.max_bytes:
+            return
+        with self.lock:
+            old = self.items.pop(key, None)
+            if old is not None:
+                self.total -= len(old)
+            self.items[key] = data
+            self.total += len(data)
+            while self.total > self.max_bytes:
+                _, evicted = self.items.popitem(last=False)
+                self.total -= len(evicted)
+
+render_cache = RenderCache()
+
+# Parsed manifests per kit, reloaded when lazy_colors.json changes on disk
+_manifests = {}
+_manifests_lock = threading.Lock()
+_luts = {}
+
+def manifest_path(kit_path):
+    return os.path.join(kit_path, LAZY_MANIFEST_NAME)
+
+def load_manifest(kit_path):
+    """
+    Returns (manifest, version) or (None, None) for kits with every color on disk.
+    """
+    path = manifest_path(kit_path)
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None, None
+    version = (st.st_mtime_ns, st.st_size)
+    with _manifests_lock:
+        cached = _manifests.get(kit_path)
+        if cached and cached[1] == version:
+            return cached
+    with open(path, 'r', encoding='utf-8') as f:
+        manifest = json.load(f)
+    with _manifests_lock:
+        _manifests[kit_path] = (manifest, version)
+    return manifest, version
+
+def save_manifest(kit_path, manifest):
+    path = manifest_path(kit_path)
+    if not manifest.get('folders'):
+        if os.path.exists(path): os.remove(path)
+    else:
+        write_bytes_atomic(json.dumps(manifest, ensure_ascii=False).encode('utf-8'), path)
+    with _manifests_lock:
+        _manifests.pop(kit_path, None)
+
+def get_lut(stops):
+    key = tuple((off, tuple(rgb)) for off, rgb in stops)
+    with _manifests_lock:
+        lut = _luts.get(key)
+    if lut is None:
+        lut = build_gradient_lut(key)
+        with _manifests_lock:
+            _luts[key] = lut
+    return lut
+
+def split_rel_path(rel_path):
+    """
+    "items_structured/X-Y/COLOR/N.png" -> (folder, color, filename), or None.
+    """
+    parts = rel_path.replace("\\", "/").strip("/").split("/")
+    if len(parts) != 4 or parts[0] != "items_structured":
+        return None
+    return parts[1], parts[2], parts[3]
+
+def render_bytes(kit_path, manifest, folder, color, filename):
+    entry = manifest.get('folders', {}).get(folder)
+    if not entry:
+        return None
+    stops = entry['colors'].get(color)
+    blob = entry['items'].get(filename)
+    if stops is None or not blob:
+        return None
+    cache_dir = os.path.normpath(os.path.join(kit_path, manifest.get('cache_dir', "../cache_blobs")))
+    source = os.path.join(cache_dir, f"{blob}.png")
+    if not os.path.exists(source):
+        # Evicted from the blob cache since the download: fetch it again
+        get_blob_cache(cache_dir).forget(blob)
+        source = fetch_blob(blob, cache_dir, os.path.basename(kit_path))
+        if not source:
+            return None
+    gray_data, alpha = load_gray_planes(source)
+    if manifest.get('crop'):
+        # Trimmed like the stored files, placed by the part's offsets.json
+        bbox = alpha.getbbox()
+        if bbox:
+            gray_data = gray_data[bbox[1]:bbox[3], bbox[0]:bbox[2]]
+            alpha = alpha.crop(bbox)
+    buf = io.BytesIO()
+    save_png(colorize_planes(gray_data, alpha, get_lut(stops)), buf, manifest.get('png_profile'))
+    return buf.getvalue()
+
+def render(kit_path, rel_path):
+    """
+    PNG bytes for a toned file that exists only in lazy_colors.json, or None.
+    rel_path is relative to the kit folder, e.g. "items_structured/3-2/C1/4.png".
+    """
+    target = split_rel_path(rel_path)
+    if not target:
+        return None
+    manifest, version = load_manifest(kit_path)
+    if manifest is None:
+        return None
+    key = (kit_path, version, target)
+    data = render_cache.get(key)
+    if data is None:
+        data = render_bytes(kit_path, manifest, *target)
+        if data is not None:
+            render_cache.put(key, data)
+    return data
+
+def list_virtual(kit_path, folder, color):
+    """
+    File names of a color folder that are still only in the manifest.
+    """
+    manifest, _ = load_manifest(kit_path)
+    entry = manifest.get('folders', {}).get(folder) if manifest else None
+    if not entry or color not in entry['colors']:
+        return []
+    color_dir = os.path.join(kit_path, "items_structured", folder, color)
+    return [name for name in entry['items'] if not os.path.exists(os.path.join(color_dir, name))]
+
+def virtual_size(kit_path, folder, filename):
+    """
+    (width, height) a virtual file renders at, read from its blob's PNG header, or None
+    when unknown (blob not cached, or a trimmed kit where it depends on the alpha box).
+    """
+    manifest, _ = load_manifest(kit_path)
+    entry = manifest.get('folders', {}).get(folder) if manifest else None
+    blob = entry['items'].get(filename) if entry else None
+    if not blob or manifest.get('crop'):
+        return None
+    cache_dir = os.path.normpath(os.path.join(kit_path, manifest.get('cache_dir', "../cache_blobs")))
+    try:
+        with Image.open(os.path.join(cache_dir, f"{blob}.png")) as img:
+            return img.size
+    except OSError:
+        return None
+
+def virtual_files(kit_path):
+    """
+    Relative paths of every toned file not on disk (for exports).
+    """
+    manifest, _ = load_manifest(kit_path)
+    if not manifest:
+        return []
+    rel_paths = []
+    for folder, entry in manifest.get('folders', {}).items():
+        for color in entry['colors']:
+            for name in list_virtual(kit_path, folder, color):
+                rel_paths.append(f"items_structured/{folder}/{color}/{name}")
+    return rel_paths
+
+def materialize(kit_path, folder, color=None):
+    """
+    Writes the virtual files of a folder (or one of its colors) to disk and removes
+    them from the manifest. Called before endpoints that edit files in place.
+    Returns the number of files written.
+    """
+    manifest, _ = load_manifest(kit_path)
+    entry = manifest.get('folders', {}).get(folder) if manifest else None
+    if not entry:
+        return 0
+    colors = [color] if color else list(entry['colors'])
+    written = 0
+    for code in colors:
+        if code not in entry['colors']: continue
+        color_dir = os.path.join(kit_path, "items_structured", folder, code)
+        if os.path.isdir(color_dir):
+            for name in list_virtual(kit_path, folder, code):
+                data = render_bytes(kit_path, manifest, folder, code, name)
+                if data is not None:
+                    write_bytes_atomic(data, os.path.join(color_dir, name))
+                    written += 1
+        del entry['colors'][code]
+    if not entry['colors']:
+        del manifest['folders'][folder]
+    save_manifest(kit_path, manifest)
+    return written
+
+def rename_folders(kit_path, mapping):
+    """
+    Re-keys manifest folders after X-Y renames; mapping is {old: new or None (deleted)}.
+    """
+    manifest, _ = load_manifest(kit_path)
+    if not manifest:
+        return
+    folders = manifest.get('folders', {})
+    renamed = {}
+    for old, new in mapping.items():
+        entry = folders.pop(old, None)
+        if entry is not None and new:
+            renamed[new] = entry
+    folders.update(renamed)
+    save_manifest(kit_path, manifest)
+
+if __name__ == "__main__":
+    if len(sys.argv) < 3 or sys.argv[1] not in ("stats", "materialize"):
+        print("Usage: python lazy_colors.py stats <kit_folder_name>")
+        print("       python lazy_colors.py materialize <kit_folder_name> [X-Y]")
+        sys.exit(1)
+
+    kit_path = os.path.join("downloads", sys.argv[2])
+    manifest, _ = load_manifest(kit_path)
+    if not manifest:
+        print(f"{kit_path} has no {LAZY_MANIFEST_NAME}: every color is on disk.")
+        sys.exit(0)
+
+    if sys.argv[1] == "stats":
+        folders = manifest.get('folders', {})
+        virtual = virtual_files(kit_path)
+        print(f"Lazy folders: {len(folders)}, toned files not on disk: {len(virtual)}")
+        print(f"Render cache budget: {format_size(render_cache.max_bytes)}")
+    else:
+        targets = sys.argv[3:] or list(manifest.get('folders', {}))
+        total = 0
+        for folder in targets:
+            count = materialize(kit_path, folder)
+            print(f"  {folder}: wrote {count} files")
+            total += count
+        print(f"Materialized {total} files.")
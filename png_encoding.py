@@ -0,0 +1,151 @@
+import os
+import sys
+import time
+import io
+from PIL import Image
+import numpy as np
+
+# fast:     working copy, lowest zlib effort (PNG encoding is the biggest CPU cost of a kit download)
+# default:  Pillow's own settings (what every file was saved with before profiles existed)
+# archival: export, optimize=True plus lossless palette reduction when the image has <= 256 colors
+PNG_PROFILES = {
+    "fast": {"compress_level": 1},
+    "default": {},
+    "archival": {"optimize": True, "palette": True},
+}
+
+DEFAULT_PROFILE = os.environ.get("NEKA_PNG_PROFILE", "default")
+if DEFAULT_PROFILE not in PNG_PROFILES:
+    DEFAULT_PROFILE = "default"
+
+def resolve_profile(profile=None):
+    if profile in PNG_PROFILES:
+        return profile
+    return DEFAULT_PROFILE
+
+def set_default_profile(profile):
+    global DEFAULT_PROFILE
+    if profile not in PNG_PROFILES:
+        raise ValueError(f"Unknown PNG profile '{profile}' (choose from {', '.join(PNG_PROFILES)})")
+    DEFAULT_PROFILE = profile
+
+def to_palette(img):
+    """
+    Lossless RGBA -> P conversion, or None when the image has more than 256 colors.
+    """
+    rgba = img.convert("RGBA")
+    arr = np.asarray(rgba)
+    flat = arr.reshape(-1, 4).view(np.uint32).ravel()
+    colors, inverse = np.unique(flat, return_inverse=True)
+    if len(colors) > 256:
+        return None
+    palette = colors.view(np.uint8).reshape(-1, 4)
+    p_img = Image.fromarray(inverse.astype(np.uint8).reshape(arr.shape[:2]), mode="P")
+    p_img.putpalette(palette[:, :3].tobytes())
+    alpha = palette[:, 3]
+    if (alpha != 255).any():
+        p_img.info["transparency"] = alpha.tobytes()
+    return p_img
+
+def save_png(img, path, profile=None):
+    """
+    Saves img as PNG using the given (or project default) encoding profile.
+    path may also be a file object.
+    """
+    options = dict(PNG_PROFILES[resolve_profile(profile)])
+    if options.pop("palette", False) and img.mode in ("RGB", "RGBA", "LA", "L"):
+        p_img = to_palette(img)
+        if p_img is not None:
+            transparency = p_img.info.get("transparency")
+            if transparency is not None:
+                options["transparency"] = transparency
+            img = p_img
+    img.save(path, format="PNG", **options)
+
+def recompress_kit(kit_folder, profile="archival"):
+    """
+    Re-encodes every PNG of a kit in place (e.g. archival before export).
+    """
+    kit_path = os.path.join("downloads", kit_folder)
+    if not os.path.exists(kit_path):
+        print(f"Error: {kit_path} not found.")
+        return
+    before, after, count = 0, 0, 0
+    start_time = time.time()
+    for root, dirs, files in os.walk(kit_path):
+        for file in files:
+            if not file.lower().endswith(".png"): continue
+            file_path = os.path.join(root, file)
+            size = os.path.getsize(file_path)
+            tmp_path = file_path + ".tmp"
+            try:
+                with Image.open(file_path) as img:
+                    img.load()
+                    save_png(img, tmp_path, profile)
+                if os.path.getsize(tmp_path) < size:
+                    os.replace(tmp_path, file_path)
+                else:
+                    os.remove(tmp_path)
+            except Exception as e:
+                print(f"  Error re-encoding {file_path}: {e}")
+                if os.path.exists(tmp_path): os.remove(tmp_path)
+            before += size
+            after += os.path.getsize(file_path)
+            count += 1
+    print(f"Re-encoded {count} PNGs with '{profile}' in {time.time() - start_time:.2f}s: "
+          f"{before / (1024 * 1024):.2f} MB -> {after / (1024 * 1024):.2f} MB")
+
+def benchmark(paths, rounds=3):
+    """
+    Encodes each sample image with every profile and prints time and size per mode.
+    """
+    images = []
+    for p in paths:
+        with Image.open(p) as img:
+            img.load()
+            images.append(img.convert("RGBA"))
+    if not images:
+        print("No sample images.")
+        return
+    print(f"Benchmarking {len(images)} images x {rounds} rounds")
+    print(f"{'profile':<10} {'time/img (ms)':>14} {'avg size (KB)':>14}")
+    for name in PNG_PROFILES:
+        total_time, total_size = 0.0, 0
+        for _ in range(rounds):
+            for img in images:
+                buf = io.BytesIO()
+                t = time.perf_counter()
+                save_png(img, buf, name)
+                total_time += time.perf_counter() - t
+                total_size += buf.tell()
+        n = rounds * len(images)
+        print(f"{name:<10} {total_time / n * 1000:>14.1f} {total_size / n / 1024:>14.1f}")
+
+def collect_samples(target, limit=50):
+    if os.path.isfile(target):
+        return [target]
+    found = []
+    for root, dirs, files in os.walk(target):
+        for file in sorted(files):
+            if file.lower().endswith(".png") and not file.startswith("thumb_"):
+                found.append(os.path.join(root, file))
+                if len(found) >= limit: return found
+    return found
+
+if __name__ == "__main__":
+    if len(sys.argv) < 3 or sys.argv[1] not in ("bench", "recompress"):
+        print("Usage: python png_encoding.py bench <png file or folder> [more...]")
+        print("       python png_encoding.py recompress <kit_folder_name> [--profile archival]")
+        print(f"Profiles: {', '.join(PNG_PROFILES)}")
+        sys.exit(1)
+
+    if sys.argv[1] == "bench":
+        samples = []
+        for target in sys.argv[2:]:
+            samples.extend(collect_samples(target))
+        benchmark(samples)
+    else:
+        profile = "archival"
+        if "--profile" in sys.argv:
+            profile = sys.argv[sys.argv.index("--profile") + 1]
+        recompress_kit(sys.argv[2], resolve_profile(profile))
@@ -0,0 +1,168 @@
+import sys
+import json
+import time
+import threading
+
+# Pipeline stages in execution order; colorize stages are measured inside the worker processes
+STAGES = ["metadata_fetch", "decompress", "network_fetch", "png_decode", "lut_apply", "png_encode", "write", "thumbnail"]
+
+PROGRESS_INTERVAL = 0.5
+
+def merge_timings(total, timings):
+    """
+    Adds a {stage: [seconds, count]} dict (e.g. returned by a worker process) into total.
+    """
+    for stage, (seconds, count) in timings.items():
+        entry = total.setdefault(stage, [0.0, 0])
+        entry[0] += seconds
+        entry[1] += count
+    return total
+
+class StageTimer:
+    def __init__(self, stats, stage):
+        self.stats = stats
+        self.stage = stage
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.stats.add_time(self.stage, time.perf_counter() - self.start)
+        return False
+
+class RunStats:
+    """
+    Stage timings, counters and queue depths of one downloader run, shared by all threads.
+    summary() answers "network-bound or CPU-bound?" by comparing the fetch and colorize phases.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.stages = {}
+        self.phases = {}
+        self.counters = {}
+        self.queues = {}
+        self.live = False
+        self.last_progress = 0.0
+        self.progress_width = 0
+
+    def timed(self, stage):
+        return StageTimer(self, stage)
+
+    def add_time(self, stage, seconds, count=1):
+        with self.lock:
+            merge_timings(self.stages, {stage: [seconds, count]})
+
+    def merge(self, timings):
+        with self.lock:
+            merge_timings(self.stages, timings)
+
+    def add_phase(self, phase, seconds):
+        with self.lock:
+            self.phases[phase] = self.phases.get(phase, 0.0) + seconds
+
+    def incr(self, name, n=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def count(self, name):
+        with self.lock:
+            return self.counters.get(name, 0)
+
+    def queue_depth(self, name, depth):
+        with self.lock:
+            q = self.queues.setdefault(name, {'max': 0, 'samples': 0, 'sum': 0})
+            q['max'] = max(q['max'], depth)
+            q['samples'] += 1
+            q['sum'] += depth
+
+    # ----- live progress -----
+
+    def progress(self, phase, done, total, force=False):
+        """
+        Rewrites one status line (only with live=True, at most every PROGRESS_INTERVAL seconds).
+        """
+        if not self.live:
+            return
+        now = time.time()
+        if not force and now - self.last_progress < PROGRESS_INTERVAL:
+            return
+        self.last_progress = now
+        with self.lock:
+            received = self.counters.get('bytes_received', 0)
+            retries = self.counters.get('retries', 0)
+            q = self.queues.get(phase, {})
+        elapsed = max(now - self.started, 1e-6)
+        line = (f"[{phase}] {done}/{total}  {received / elapsed / (1024 * 1024):.2f} MB/s  "
+                f"queue {total - done} (max {q.get('max', 0)})  retries {retries}")
+        sys.stdout.write("\r" + line.ljust(self.progress_width))
+        sys.stdout.flush()
+        self.progress_width = len(line)
+
+    def end_progress(self):
+        if self.live and self.progress_width:
+            sys.stdout.write("\n")
+            sys.stdout.flush()
+            self.progress_width = 0
+
+    # ----- summary -----
+
+    def summary(self):
+        with self.lock:
+            stages = {k: list(v) for k, v in self.stages.items()}
+            phases = dict(self.phases)
+            counters = dict(self.counters)
+            queues = {k: dict(v) for k, v in self.queues.items()}
+
+        hits = counters.get('cache_hits', 0)
+        misses = counters.get('cache_misses', 0)
+        received = counters.get('bytes_received', 0)
+        fetch_wall = phases.get('fetch', 0.0)
+        colorize_wall = phases.get('colorize', 0.0)
+        if fetch_wall == colorize_wall == 0:
+            bound = "idle"
+        else:
+            bound = "network" if fetch_wall >= colorize_wall else "cpu"
+
+        ordered = [s for s in STAGES if s in stages] + [s for s in stages if s not in STAGES]
+        return {
+            'wall_seconds': round(time.time() - self.started, 3),
+            'bound': bound,
+            'phases': {k: round(v, 3) for k, v in phases.items()},
+            'stages': {s: {'seconds': round(stages[s][0], 3), 'count': stages[s][1],
+                           'avg_ms': round(stages[s][0] / stages[s][1] * 1000, 2) if stages[s][1] else 0.0}
+                       for s in ordered},
+            'network': {
+                'requests': counters.get('requests', 0),
+                'bytes': received,
+                'bytes_per_sec': round(received / fetch_wall) if fetch_wall else 0,
+                'retries': counters.get('retries', 0),
+                'failed': counters.get('failed_fetches', 0)
+            },
+            'cache': {
+                'hits': hits,
+                'misses': misses,
+                'hit_ratio': round(hits / (hits + misses), 4) if hits + misses else None
+            },
+            'queues': {k: {'max': v['max'], 'avg': round(v['sum'] / v['samples'], 1) if v['samples'] else 0}
+                       for k, v in queues.items()},
+            'counters': {k: v for k, v in counters.items()
+                         if k not in ('requests', 'bytes_received', 'retries', 'failed_fetches', 'cache_hits', 'cache_misses')}
+        }
+
+    def print_summary(self, path=None):
+        self.end_progress()
+        summary = self.summary()
+        text = json.dumps(summary, indent=2)
+        print("\nRun stats:")
+        print(text)
+        if path:
+            with open(path, 'w', encoding='utf-8') as f:
+                f.write(text)
+            print(f"Run stats saved to {path}")
+        return summary
+
+# One instance per downloader process
+STATS = RunStats()
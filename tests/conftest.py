@@ -0,0 +1,19 @@
+import os
+import sys
+
+# The modules live flat at the repo root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+
+from bench_fetch import start_stub
+
+@pytest.fixture
+def stub():
+    """
+    The benchmark's blob host, without latency or throttling unless a test sets them.
+    """
+    server = start_stub(latency=0, capacity=1000, payload_size=64)
+    yield server
+    server.shutdown()
+    server.server_close()
@@ -0,0 +1,69 @@
+"""
+Small offline kits for tests: blobs go to a mirror folder (--source mirror:DIR),
+metadata.json to downloads/neka_<id>/ under the given root.
+"""
+import os
+import json
+import random
+
+import numpy as np
+from PIL import Image
+
+def write_blob(blob_dir, name, seed):
+    path = os.path.join(blob_dir, f"{name}.png")
+    if not os.path.exists(path):
+        rng = random.Random(seed)
+        a = np.zeros((40, 30, 4), np.uint8)
+        a[..., 0] = np.arange(30, dtype=np.uint8)[None, :] * 8
+        a[..., 1] = rng.randint(0, 255)
+        a[..., 2] = np.arange(40, dtype=np.uint8)[:, None] * 6
+        a[5 + seed % 5:30, 5:20 + seed % 7, 3] = 255
+        Image.fromarray(a, "RGBA").save(path)
+    return name
+
+def sample_kit(blob_dir, nparts=4, nitems=5, kit_id=999):
+    """
+    Metadata of a kit with toned and plain parts, addon layers and shared blobs.
+    """
+    os.makedirs(blob_dir, exist_ok=True)
+    def blob(name, seed):
+        return write_blob(blob_dir, name, seed)
+    tonings = [
+        {"id": "t1", "filters": [
+            {"gradients": [{"offset": 0, "color": "#000000"}, {"offset": 0.5, "color": "#FF0000"}, {"offset": 1, "color": "#ffffff"}]},
+            {"gradients": [{"offset": 0, "color": "#00ff00"}, {"offset": 1, "color": "#0000ff"}]}]},
+        {"id": "t2", "filters": [{"gradients": [{"offset": 0, "color": "#123456"}, {"offset": 1, "color": "#abcdef"}]}]},
+    ]
+    parts = []
+    for p in range(nparts):
+        items = []
+        for i in range(nitems):
+            n = p * nitems + i
+            layer = {"blob": blob(f"b{n % 9}", n % 9), "crop": {"x": 3, "y": 4, "w": 30, "h": 40}}
+            if i % 2 == 0:
+                layer["addonTextures"] = [{"layer": f"a{p}", "blob": blob(f"ad{i % 3}", 20 + i % 3)}]
+            items.append([layer])
+        parts.append({"id": f"P{p}", "name": f"p{p}", "zIndex": p, "cover": blob(f"cover{p % 2}", 30 + p % 2),
+                      "toning": "t1" if p % 2 == 0 else "t2", "addonLayers": [{"id": f"a{p}", "toning": "t2"}],
+                      "items": items})
+    return {"id": kit_id, "name": "Sample Kit", "data": {"parts": parts, "tonings": tonings}}
+
+def write_kit(root, kit):
+    base_dir = os.path.join(root, "downloads", f"neka_{kit['id']}")
+    os.makedirs(base_dir, exist_ok=True)
+    with open(os.path.join(base_dir, "metadata.json"), 'w', encoding='utf-8') as f:
+        json.dump(kit, f)
+    return base_dir
+
+def snapshot(base_dir):
+    """
+    {path under items_structured: bytes} of every file of a kit.
+    """
+    structured = os.path.join(base_dir, "items_structured")
+    files = {}
+    for root, dirs, names in os.walk(structured):
+        for name in names:
+            path = os.path.join(root, name)
+            with open(path, 'rb') as f:
+                files[os.path.relpath(path, structured).replace(os.sep, "/")] = f.read()
+    return files
@@ -0,0 +1,73 @@
+import json
+
+import pytest
+from PIL import Image
+
+import app_server
+from download_neka_kit import OFFSETS_NAME, load_crop_offsets, save_crop_offsets
+
+KIT = "neka_1"
+FOLDER = "1-1"
+
+@pytest.fixture
+def part_dir(tmp_path, monkeypatch):
+    """
+    A trimmed part with items 1 and 2 in the root (default color) and in red/.
+    """
+    monkeypatch.setattr(app_server, "__file__", str(tmp_path / "app_server.py"))
+    folder = tmp_path / "downloads" / KIT / "items_structured" / FOLDER
+    (folder / "red").mkdir(parents=True)
+    for name in ("1.png", "2.png", "red/1.png", "red/2.png"):
+        Image.new("RGBA", (20, 30), (255, 0, 0, 255)).save(folder / name)
+    save_crop_offsets(str(folder), {"1.png": [10, 11], "2.png": [20, 21], "red/1.png": [30, 31], "red/2.png": [40, 41]})
+    return folder
+
+def call(handler_name, **data):
+    handler = app_server.KitHandler.__new__(app_server.KitHandler)
+    responses = []
+    handler.send_api_response = lambda success, message: responses.append((success, message))
+    getattr(handler, handler_name)({"kit": KIT, "folder": FOLDER, **data})
+    assert responses and responses[0][0], responses
+    return responses[0][1]
+
+def test_rename_in_root_keeps_color_entry(part_dir):
+    call("handle_rename_file", old_name="1.png", new_name="5.png", color="default")
+    assert load_crop_offsets(str(part_dir)) == {"5.png": [10, 11], "2.png": [20, 21], "red/1.png": [30, 31], "red/2.png": [40, 41]}
+
+def test_rename_in_color_folder_keeps_root_entry(part_dir):
+    call("handle_rename_file", old_name="2.png", new_name="7.png", color="red")
+    assert (part_dir / "red" / "7.png").exists() and (part_dir / "2.png").exists()
+    assert load_crop_offsets(str(part_dir)) == {"1.png": [10, 11], "2.png": [20, 21], "red/1.png": [30, 31], "red/7.png": [40, 41]}
+
+def test_delete_in_root_keeps_color_entry(part_dir):
+    call("handle_delete_file", filename="1.png", color="default")
+    assert load_crop_offsets(str(part_dir)) == {"2.png": [20, 21], "red/1.png": [30, 31], "red/2.png": [40, 41]}
+
+def test_delete_in_color_folder_keeps_root_entry(part_dir):
+    call("handle_delete_file", filename="2.png", color="red")
+    assert load_crop_offsets(str(part_dir)) == {"1.png": [10, 11], "2.png": [20, 21], "red/1.png": [30, 31]}
+
+def test_swap_by_renames(part_dir):
+    call("handle_rename_file", old_name="1.png", new_name="9.png", color="red")
+    call("handle_rename_file", old_name="2.png", new_name="1.png", color="red")
+    call("handle_rename_file", old_name="9.png", new_name="2.png", color="red")
+    assert load_crop_offsets(str(part_dir)) == {"1.png": [10, 11], "2.png": [20, 21], "red/1.png": [40, 41], "red/2.png": [30, 31]}
+
+def test_rename_color_folder(part_dir):
+    call("handle_rename_color_folder", part_folder=FOLDER, old_color="red", new_color="blue")
+    assert load_crop_offsets(str(part_dir)) == {"1.png": [10, 11], "2.png": [20, 21], "blue/1.png": [30, 31], "blue/2.png": [40, 41]}
+
+def test_merge_in_color_folder_drops_only_its_entries(part_dir):
+    call("handle_merge_layers", selected_files=["1.png", "2.png"], destination_name="1", color="red")
+    with Image.open(part_dir / "red" / "1.png") as img:
+        # Each source pasted at its own red/ offset
+        assert img.getpixel((30, 31))[3] == 255 and img.getpixel((45, 60))[3] == 255
+        assert img.getpixel((10, 11))[3] == 0
+    assert load_crop_offsets(str(part_dir)) == {"1.png": [10, 11], "2.png": [20, 21]}
+
+def test_version_1_entries_apply_to_every_color(part_dir):
+    (part_dir / OFFSETS_NAME).write_text(json.dumps({"canvas": [1436, 1902], "items": {"1.png": [5, 6]}}))
+    assert load_crop_offsets(str(part_dir)) == {"1.png": [5, 6], "red/1.png": [5, 6]}
+    call("handle_delete_file", filename="1.png", color="default")
+    saved = json.loads((part_dir / OFFSETS_NAME).read_text())
+    assert saved["version"] == 2 and saved["items"] == {"red/1.png": [5, 6]}
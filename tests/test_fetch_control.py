@@ -0,0 +1,57 @@
+import time
+import threading
+
+import pytest
+
+import download_neka_kit
+from download_neka_kit import download_with_retry, configure_http_session
+from fetch_control import FETCH_CONTROL, ADAPTIVE_MAX_WORKERS
+
+@pytest.fixture(autouse=True)
+def adaptive_pool():
+    configure_http_session(8)
+    yield
+    FETCH_CONTROL.configure(download_neka_kit.DEFAULT_WORKERS, ADAPTIVE_MAX_WORKERS)
+    configure_http_session(download_neka_kit.DEFAULT_WORKERS)
+
+def fetch(stub, tmp_path, name):
+    # One attempt, so every scripted status reaches the controller as-is
+    return download_with_retry(f"{stub.url}/{name}", str(tmp_path / f"{name}.png"), retries=1)
+
+def test_limit_halves_on_429(stub, tmp_path):
+    FETCH_CONTROL.configure(8, 16)
+    stub.scripts["t1"] = [(429, {})]
+    assert not fetch(stub, tmp_path, "t1")
+    assert FETCH_CONTROL.current_limit() == 4
+
+def test_retry_after_pauses_new_acquires(stub, tmp_path):
+    FETCH_CONTROL.configure(8, 16)
+    stub.scripts["r1"] = [(429, {"Retry-After": "1"})]
+    assert not fetch(stub, tmp_path, "r1")
+    started = time.monotonic()
+    assert fetch(stub, tmp_path, "r2")
+    assert time.monotonic() - started >= 0.9
+    (_, throttled), (_, resumed) = stub.requests
+    assert resumed - throttled >= 0.9
+
+def test_limit_grows_back_to_the_ceiling(stub, tmp_path):
+    stub.latency = 0.02
+    FETCH_CONTROL.configure(4, 4)
+    stub.scripts["g0"] = [(429, {})]
+    assert not fetch(stub, tmp_path, "g0")
+    assert FETCH_CONTROL.current_limit() == 2
+    limits = []
+    for i in range(1, 20):
+        assert fetch(stub, tmp_path, f"g{i}")
+        limits.append(FETCH_CONTROL.current_limit())
+    assert limits == sorted(limits)
+    assert limits[-1] == 4
+
+def test_parallel_fetches_respect_the_limit(stub, tmp_path):
+    stub.latency = 0.05
+    FETCH_CONTROL.configure(3, 3, adaptive=False)
+    threads = [threading.Thread(target=fetch, args=(stub, tmp_path, f"p{i}")) for i in range(12)]
+    for t in threads: t.start()
+    for t in threads: t.join()
+    assert len(stub.requests) == 12
+    assert stub.peak <= 3
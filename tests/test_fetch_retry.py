@@ -0,0 +1,67 @@
+import threading
+
+import pytest
+
+import download_neka_kit
+from download_neka_kit import download_with_retry, configure_http_session, parse_retry_after, fetch_blob, HttpSource
+from fetch_control import FETCH_CONTROL, ADAPTIVE_MAX_WORKERS
+
+@pytest.fixture(autouse=True)
+def fixed_pool():
+    FETCH_CONTROL.configure(4, 4, adaptive=False)
+    configure_http_session(4)
+    yield
+    FETCH_CONTROL.configure(download_neka_kit.DEFAULT_WORKERS, ADAPTIVE_MAX_WORKERS)
+    configure_http_session(download_neka_kit.DEFAULT_WORKERS)
+
+def test_retry_after_is_waited_before_retrying(stub, tmp_path):
+    stub.scripts["b1"] = [(429, {"Retry-After": "1"})]
+    dest = tmp_path / "b1.png"
+    assert download_with_retry(f"{stub.url}/b1", str(dest))
+    assert dest.read_bytes() == stub.payload
+    (_, first), (_, second) = stub.requests
+    assert second - first >= 0.9
+
+def test_retryable_status_then_success(stub, tmp_path, monkeypatch):
+    monkeypatch.setattr(download_neka_kit, "BACKOFF_BASE", 0.01)
+    stub.scripts["b2"] = [(503, {}), (500, {})]
+    assert download_with_retry(f"{stub.url}/b2", str(tmp_path / "b2.png"), retries=3)
+    assert len(stub.requests) == 3
+
+def test_not_found_is_not_retried(stub, tmp_path):
+    stub.scripts["b3"] = [(404, {})]
+    assert not download_with_retry(f"{stub.url}/b3", str(tmp_path / "b3.png"))
+    assert len(stub.requests) == 1
+    assert not (tmp_path / "b3.png").exists()
+
+def test_sequential_fetches_reuse_one_connection(stub, tmp_path):
+    for i in range(20):
+        assert download_with_retry(f"{stub.url}/s{i}", str(tmp_path / f"s{i}.png"))
+    assert len(stub.requests) == 20
+    assert stub.connections == 1
+
+def test_parallel_fetches_stay_within_the_pool(stub, tmp_path):
+    threads = [threading.Thread(target=download_with_retry, args=(f"{stub.url}/p{i}", str(tmp_path / f"p{i}.png")))
+               for i in range(40)]
+    for t in threads: t.start()
+    for t in threads: t.join()
+    assert len(stub.requests) == 40
+    assert stub.connections <= 4
+
+def test_fetch_blob_refetches_a_file_deleted_from_the_cache(stub, tmp_path, monkeypatch):
+    monkeypatch.setattr(download_neka_kit, "BLOB_SOURCES", [HttpSource(stub.url)])
+    cache_dir = str(tmp_path / "cache_blobs")
+    path = fetch_blob("c1", cache_dir)
+    assert fetch_blob("c1", cache_dir) == path
+    assert len(stub.requests) == 1
+    # Still in the index, gone from disk
+    (tmp_path / "cache_blobs" / "c1.png").unlink()
+    assert fetch_blob("c1", cache_dir) == path
+    assert len(stub.requests) == 2
+    assert (tmp_path / "cache_blobs" / "c1.png").read_bytes() == stub.payload
+
+def test_parse_retry_after():
+    assert parse_retry_after("3") == 3.0
+    assert parse_retry_after(None) is None
+    assert parse_retry_after("soon") is None
+    assert parse_retry_after("Wed, 21 Oct 2015 07:28:00 GMT") == 0.0
@@ -0,0 +1,37 @@
+import os
+
+import kit_index
+from zip_neka_kit import kit_entries
+
+def make_kit(tmp_path):
+    kit = tmp_path / "neka_3"
+    folder = kit / "items_structured" / "1-1"
+    (folder / "red").mkdir(parents=True)
+    (kit / "shards").mkdir()
+    files = {
+        "metadata.json": True, "separated_layers.json": True,
+        "items_structured/1-1/1.png": True, "items_structured/1-1/red/1.png": True,
+        "items_structured/1-1/offsets.json": True,
+        "download_journal.jsonl": False, "metadata.new.json": False, "structure_index.json": False,
+        "lazy_colors.json": False, "shards/journal-1-of-2.jsonl": False, "shards/done-1-of-2.json": False,
+        "items_structured/1-1/2.png.123.456.part": False, "items_structured/1-1/red/3.png.lock": False,
+    }
+    for rel in files:
+        (kit / rel).write_bytes(b"{}" if rel.endswith(".json") else b"x")
+    return kit, files
+
+def test_internal_files_are_not_exported(tmp_path):
+    kit, files = make_kit(tmp_path)
+    names = {os.path.relpath(arcname, "neka_3").replace(os.sep, "/") for _, arcname, _ in kit_entries(str(kit))}
+    assert names == {rel for rel, exported in files.items() if exported}
+
+def test_content_key_ignores_internal_files(tmp_path):
+    kit, _ = make_kit(tmp_path)
+    key = kit_index.KitIndex(str(kit)).content_key()
+    with open(kit / "download_journal.jsonl", "a") as f:
+        f.write("more\n")
+    (kit / "metadata.new.json").write_bytes(b"fresh")
+    (kit / "shards" / "done-2-of-2.json").write_bytes(b"{}")
+    assert kit_index.KitIndex(str(kit)).content_key() == key
+    (kit / "separated_layers.json").write_bytes(b"changed")
+    assert kit_index.KitIndex(str(kit)).content_key() != key
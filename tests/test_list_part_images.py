@@ -0,0 +1,54 @@
+import io
+import json
+
+import pytest
+from PIL import Image
+
+import app_server
+from download_neka_kit import LAZY_MANIFEST_NAME, save_crop_offsets
+
+KIT = "neka_2"
+FOLDER = "1-1"
+
+@pytest.fixture
+def lazy_kit(tmp_path, monkeypatch):
+    """
+    A lazy kit whose "red" color exists only in lazy_colors.json: 1.png renders from a
+    full-canvas blob, 2.png from a 20x30 piece placed at its offset.
+    """
+    monkeypatch.setattr(app_server, "__file__", str(tmp_path / "app_server.py"))
+    kit = tmp_path / "downloads" / KIT
+    folder = kit / "items_structured" / FOLDER
+    (folder / "red").mkdir(parents=True)
+    cache = tmp_path / "downloads" / "cache_blobs"
+    cache.mkdir()
+    Image.new("RGBA", (1436, 1902)).save(cache / "blobA.png")
+    Image.new("RGBA", (20, 30), (0, 0, 0, 255)).save(cache / "blobB.png")
+    manifest = {"cache_dir": "../cache_blobs", "png_profile": None, "crop": False,
+                "folders": {FOLDER: {"colors": {"red": [[0, [255, 0, 0]], [1, [0, 0, 255]]]},
+                                     "items": {"1.png": "blobA", "2.png": "blobB"}}}}
+    (kit / LAZY_MANIFEST_NAME).write_text(json.dumps(manifest))
+    save_crop_offsets(str(folder), {"red/2.png": [7, 8]})
+    return kit
+
+def list_part_images(**data):
+    handler = app_server.KitHandler.__new__(app_server.KitHandler)
+    handler.wfile = io.BytesIO()
+    handler.send_response = lambda code: None
+    handler.send_header = lambda key, value: None
+    handler.end_headers = lambda: None
+    handler.send_api_response = lambda success, message: pytest.fail(message)
+    handler.handle_list_part_images({"kit": KIT, "folder": FOLDER, **data})
+    return json.loads(handler.wfile.getvalue())
+
+def test_lazy_color_is_listed_without_rendering(lazy_kit):
+    manifest_before = (lazy_kit / LAZY_MANIFEST_NAME).read_text()
+    result = list_part_images(color="red")
+    assert [(f["filename"], f["x"], f["y"]) for f in result["files"]] == [("1.png", 0, 0), ("2.png", 7, 8)]
+    assert list((lazy_kit / "items_structured" / FOLDER / "red").iterdir()) == []
+    assert (lazy_kit / LAZY_MANIFEST_NAME).read_text() == manifest_before
+
+def test_files_on_disk_are_listed_with_virtual_ones(lazy_kit):
+    Image.new("RGBA", (1436, 1902)).save(lazy_kit / "items_structured" / FOLDER / "red" / "3.png")
+    result = list_part_images(color="red")
+    assert [f["filename"] for f in result["files"]] == ["1.png", "2.png", "3.png"]
@@ -0,0 +1,48 @@
+import os
+import json
+
+import pytest
+
+from download_neka_kit import extract_next_data, save_kit_from_next_data
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+
+# What kitOnSale in the fixture pages decompresses to
+FIXTURE_KIT = {
+    "id": 999, "name": "Fixture Kit", "width": 1436, "height": 1902,
+    "parts": [{
+        "name": "Hair",
+        "renderLayers": [{"blob": "fxhair01", "x": 2, "y": 1}],
+        "items": [{"id": -12, "cover": "fxcover1", "colors": [{"name": "default", "gradient": [0.5, "#aabbcc"]}]}]
+    }]
+}
+
+def read_fixture(name):
+    with open(os.path.join(FIXTURES, name), 'r', encoding='utf-8') as f:
+        return f.read()
+
+@pytest.mark.parametrize("name", ["composer_page.html", "composer_page_attrs.html"])
+def test_extract_next_data(name):
+    next_data = extract_next_data(read_fixture(name))
+    assert next_data["page"] == "/composer/[id]"
+    vocab, root = next_data["props"]["pageProps"]["kitOnSale"]
+    assert isinstance(vocab, list) and isinstance(root, str)
+
+@pytest.mark.parametrize("name", ["composer_page.html", "composer_page_attrs.html"])
+def test_fixture_page_decompresses_to_the_kit(name, tmp_path):
+    output_file = str(tmp_path / "metadata.json")
+    assert save_kit_from_next_data(extract_next_data(read_fixture(name)), output_file) == output_file
+    with open(output_file, 'r', encoding='utf-8') as f:
+        assert json.load(f) == FIXTURE_KIT
+
+def test_page_without_next_data():
+    assert extract_next_data(read_fixture("challenge_page.html")) is None
+
+def test_invalid_next_data_json():
+    html = read_fixture("composer_page.html").replace('"buildId":', '"buildId"', 1)
+    assert extract_next_data(html) is None
+
+def test_next_data_without_kit(tmp_path):
+    output_file = tmp_path / "metadata.json"
+    assert save_kit_from_next_data({"props": {"pageProps": {}}}, str(output_file)) is None
+    assert not output_file.exists()
@@ -0,0 +1,43 @@
+import os
+
+import pytest
+
+import download_neka_kit
+from download_neka_kit import plan_kit, MirrorSource, HttpSource
+from sample_kit import sample_kit, write_kit
+
+@pytest.fixture
+def kit(tmp_path):
+    mirror = str(tmp_path / "mirror")
+    base_dir = write_kit(str(tmp_path), sample_kit(mirror, nparts=2, nitems=3))
+    return os.path.join(base_dir, "metadata.json"), mirror
+
+def test_plan_sizes_blobs_from_the_configured_mirror(kit, monkeypatch):
+    metadata_path, mirror = kit
+    monkeypatch.setattr(download_neka_kit, "BLOB_SOURCES", [MirrorSource(mirror)])
+    report = plan_kit(metadata_path, workers=2, processes=1)
+    sizes = [os.path.getsize(os.path.join(mirror, name)) for name in os.listdir(mirror)]
+    assert report['blobs_to_fetch'] == len(sizes)
+    assert report['fetch_bytes'] == sum(sizes)
+    assert report['unsized_blobs'] == 0
+    assert report['timed_gets'] == download_neka_kit.PLAN_GET_SAMPLE
+    assert report['fetch_seconds'] is not None
+
+def test_plan_tries_sources_in_order(kit, monkeypatch, stub):
+    metadata_path, mirror = kit
+    # The stub answers no HEAD and 404 to these GETs, so sizes and timings come from the mirror behind it
+    stub.scripts = {name[:-4]: [(404, {})] * 2 for name in os.listdir(mirror)}
+    monkeypatch.setattr(download_neka_kit, "BLOB_SOURCES", [HttpSource(stub.url), MirrorSource(mirror)])
+    report = plan_kit(metadata_path, workers=2, processes=1)
+    assert report['unsized_blobs'] == 0
+    assert report['fetch_bytes'] == sum(os.path.getsize(os.path.join(mirror, name)) for name in os.listdir(mirror))
+
+def test_plan_reports_blobs_it_could_not_size(kit, monkeypatch, tmp_path, capsys):
+    metadata_path, _ = kit
+    monkeypatch.setattr(download_neka_kit, "BLOB_SOURCES", [MirrorSource(str(tmp_path))])
+    report = plan_kit(metadata_path, workers=2, processes=1)
+    assert report['blobs_to_fetch'] > 0
+    assert report['unsized_blobs'] == report['blobs_to_fetch']
+    assert report['fetch_bytes'] is None and report['fetch_seconds'] is None
+    out = capsys.readouterr().out
+    assert "Download:       unknown" in out and "Fetch time:     unknown" in out
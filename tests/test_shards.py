@@ -0,0 +1,22 @@
+import os
+
+import download_neka_kit
+from download_neka_kit import run_local_shards, assemble_shards, reorganize_kit, set_blob_sources, MirrorSource
+from sample_kit import sample_kit, write_kit, snapshot
+
+def test_concurrent_shards_match_a_single_run(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(download_neka_kit, "BLOB_SOURCES", [])
+    mirror = str(tmp_path / "blobsrc")
+    kit = sample_kit(mirror)
+    # Every shard starts at once on a kit with no items_structured and no cache_blobs yet
+    base_dir = write_kit(str(tmp_path / "sharded"), kit)
+    monkeypatch.chdir(tmp_path / "sharded")
+    assert run_local_shards(os.path.relpath(base_dir), 6, ["--source", f"mirror:{mirror}"], processes=1)
+    set_blob_sources([MirrorSource(mirror)])
+    assert assemble_shards(os.path.relpath(base_dir), 6, processes=1) is not None
+
+    monkeypatch.chdir(tmp_path)
+    single_dir = write_kit(str(tmp_path / "single"), kit)
+    reorganize_kit(os.path.join(single_dir, "metadata.json"), processes=1)
+    assert snapshot(base_dir) == snapshot(single_dir)
@@ -0,0 +1,79 @@
+import os
+import copy
+import json
+
+import pytest
+
+import download_neka_kit
+from download_neka_kit import reorganize_kit, sync_kit, set_blob_sources, MirrorSource
+from sample_kit import sample_kit, write_kit, snapshot
+
+def recolor_middle_stop(kit):
+    # Keeps the color's folder code (from its first stop) but changes its gradient
+    kit["data"]["tonings"][0]["filters"][0]["gradients"][1]["color"] = "#00FF80"
+
+def drop_first_items(kit):
+    for part in kit["data"]["parts"]:
+        del part["items"][0]
+
+def reorder_items(kit):
+    kit["data"]["parts"][1]["items"].reverse()
+    kit["data"]["parts"][2]["items"].insert(1, kit["data"]["parts"][2]["items"].pop())
+
+@pytest.fixture
+def offline(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(download_neka_kit, "BLOB_SOURCES", [])
+    mirror = tmp_path / "blobsrc"
+    mirror.mkdir()
+    set_blob_sources([MirrorSource(str(mirror))])
+    return str(mirror)
+
+@pytest.mark.parametrize("edits", [
+    [recolor_middle_stop, drop_first_items],
+    [recolor_middle_stop, reorder_items],
+    [drop_first_items],
+])
+def test_sync_matches_a_fresh_download(offline, tmp_path, edits):
+    old = sample_kit(offline)
+    base_dir = write_kit(str(tmp_path / "synced"), old)
+    reorganize_kit(os.path.join(base_dir, "metadata.json"), processes=1)
+
+    new = copy.deepcopy(old)
+    for edit in edits:
+        edit(new)
+    new_path = os.path.join(base_dir, "metadata.new.json")
+    with open(new_path, 'w', encoding='utf-8') as f:
+        json.dump(new, f)
+    sync_kit(base_dir, new_path, processes=1)
+
+    fresh_dir = write_kit(str(tmp_path / "fresh"), new)
+    reorganize_kit(os.path.join(fresh_dir, "metadata.json"), processes=1)
+    synced, fresh = snapshot(base_dir), snapshot(fresh_dir)
+    assert sorted(synced) == sorted(fresh)
+    # Colored items and thumb_N.png alike
+    assert [name for name in sorted(fresh) if synced[name] != fresh[name]] == []
+
+def test_sync_rerenders_thumbnails_of_a_changed_first_color(offline, tmp_path):
+    old = sample_kit(offline)
+    base_dir = write_kit(str(tmp_path / "synced"), old)
+    reorganize_kit(os.path.join(base_dir, "metadata.json"), processes=1)
+    before = snapshot(base_dir)
+
+    new = copy.deepcopy(old)
+    # t2 is the only (so first) color of parts 1, 3 and of every addon layer
+    new["data"]["tonings"][1]["filters"][0]["gradients"][1]["color"] = "#FEDCBA"
+    drop_first_items(new)
+    new_path = os.path.join(base_dir, "metadata.new.json")
+    with open(new_path, 'w', encoding='utf-8') as f:
+        json.dump(new, f)
+    sync_kit(base_dir, new_path, processes=1)
+
+    fresh_dir = write_kit(str(tmp_path / "fresh"), new)
+    reorganize_kit(os.path.join(fresh_dir, "metadata.json"), processes=1)
+    synced, fresh = snapshot(base_dir), snapshot(fresh_dir)
+    thumbs = [name for name in fresh if os.path.basename(name).startswith("thumb_")]
+    assert thumbs and sorted(name for name in synced if os.path.basename(name).startswith("thumb_")) == sorted(thumbs)
+    assert [name for name in thumbs if synced[name] != fresh[name]] == []
+    # The thumbnails really changed (not just left as they were)
+    assert any(before.get(name) != fresh[name] for name in thumbs)
@@ -1,11 +1,247 @@
 import os
+import re
 import zipfile
 import sys
 import time
+import zlib
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
 
-def zip_kit(kit_folder):
+import lazy_colors
+import kit_index
+from download_neka_kit import get_flag_value
+
+# Already-compressed formats: deflating them again costs CPU and saves almost nothing
+STORED_EXTENSIONS = {'.png', '.jpg', '.jpeg', '.webp', '.gif', '.zip'}
+
+# downloads/cache_archives/<kit>.<content key>.zip, one per kit (older versions are removed)
+ARCHIVE_CACHE_DIR = "cache_archives"
+
+def entry_compression(name):
+    return zipfile.ZIP_STORED if os.path.splitext(name)[1].lower() in STORED_EXTENSIONS else zipfile.ZIP_DEFLATED
+
+def kit_entries(kit_path):
+    """
+    (file path or None, name in the zip, lazy rel_path or None) of every entry of a kit's zip,
+    under the kit folder name. Files only in lazy_colors.json have no path: they are rendered.
+    """
+    kit_folder = os.path.basename(os.path.normpath(kit_path))
+    for root, dirs, files in os.walk(kit_path):
+        # Journal, shards, temp files and the like are kit_index.is_internal (same list as the cache key)
+        dirs[:] = [d for d in dirs if not kit_index.is_internal(d)]
+        for file in files:
+            if kit_index.is_internal(file): continue
+            file_path = os.path.join(root, file)
+            # Create relative path for zip (preserving folder structure inside kit_folder)
+            arcname = os.path.relpath(file_path, os.path.dirname(kit_path))
+            yield file_path, arcname, None
+    # Kits downloaded with --lazy: render the toned files that only exist in the manifest
+    for rel_path in lazy_colors.virtual_files(kit_path):
+        yield None, os.path.join(kit_folder, rel_path), rel_path
+
+def write_kit(zipf, kit_path):
+    """
+    Adds every file of a kit to an open ZipFile, under the kit folder name.
+    Files are copied in small blocks, so zipf may wrap a socket (see stream_kit).
+    """
+    for file_path, arcname, rel_path in kit_entries(kit_path):
+        if file_path:
+            zipf.write(file_path, arcname, compress_type=entry_compression(arcname))
+        else:
+            data = lazy_colors.render(kit_path, rel_path)
+            if data is not None:
+                zipf.writestr(arcname, data, compress_type=entry_compression(arcname))
+
+def stream_kit(kit_path, fileobj):
+    """
+    Writes the zip of a kit to a write-only stream (e.g. an HTTP response) as it is built:
+    nothing is kept on disk and memory stays flat whatever the kit size.
+    Entries use data descriptors since the stream cannot seek back to their headers.
+    """
+    with zipfile.ZipFile(fileobj, 'w', zipfile.ZIP_DEFLATED) as zipf:
+        write_kit(zipf, kit_path)
+
+# ============= ARCHIVE CACHE =============
+
+class ArchiveTee:
+    """
+    Write-only stream copying an archive being cached to a client. A client that goes
+    away only stops its copy: the cached file is still completed.
+    """
+
+    def __init__(self, f, client):
+        self.f = f
+        self.client = client
+
+    def write(self, data):
+        self.f.write(data)
+        if self.client is not None:
+            try:
+                self.client.write(data)
+            except OSError:
+                self.client = None
+        return len(data)
+
+    def flush(self):
+        self.f.flush()
+
+_build_locks = {}
+_build_locks_lock = threading.Lock()
+
+def cached_archive(kit_path):
+    """
+    Path of the cached zip for the kit's current content (it may not exist yet).
+    """
+    kit_path = os.path.normpath(kit_path)
+    key = kit_index.content_key(kit_path)
+    kit_folder = os.path.basename(kit_path)
+    return os.path.join(os.path.dirname(kit_path), ARCHIVE_CACHE_DIR, f"{kit_folder}.{key}.zip")
+
+def build_archive(kit_path, archive_path, client=None):
+    """
+    Writes the kit's zip to archive_path, streaming it to client (if given) at the same time.
+    Returns True when the archive was cached. When another thread is already building
+    this kit, or the kit changed during the build, it is only streamed.
+    """
+    kit_path = os.path.normpath(kit_path)
+    with _build_locks_lock:
+        lock = _build_locks.setdefault(kit_path, threading.Lock())
+    if not lock.acquire(blocking=False):
+        if client is not None:
+            stream_kit(kit_path, client)
+        return False
+    try:
+        os.makedirs(os.path.dirname(archive_path), exist_ok=True)
+        tmp_path = f"{archive_path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, 'wb') as f:
+                stream_kit(kit_path, ArchiveTee(f, client) if client is not None else f)
+            if cached_archive(kit_path) != archive_path:
+                print(f"{os.path.basename(kit_path)} changed while zipping: archive not cached")
+                return False
+            os.replace(tmp_path, archive_path)
+        finally:
+            if os.path.exists(tmp_path): os.remove(tmp_path)
+        prune_archives(kit_path, keep=archive_path)
+        return True
+    finally:
+        lock.release()
+
+def prune_archives(kit_path, keep=None):
+    """
+    Removes the cached archives of older versions of a kit.
+    """
+    cache_dir = os.path.join(os.path.dirname(kit_path), ARCHIVE_CACHE_DIR)
+    pattern = re.compile(re.escape(os.path.basename(kit_path)) + r"\.[0-9a-f]{16}\.zip$")
+    if not os.path.isdir(cache_dir):
+        return
+    for name in os.listdir(cache_dir):
+        path = os.path.join(cache_dir, name)
+        if pattern.match(name) and path != keep:
+            try: os.remove(path)
+            except OSError: pass
+
+# ============= PARALLEL EXPORT =============
+
+# Entries per worker task (one pickled round trip each: kits have many small files)
+ENTRIES_PER_TASK = 64
+# Tasks queued per kit ahead of the writer (bounds memory to a few compressed batches per process)
+PENDING_PER_PROCESS = 2
+READ_BLOCK = 1024 * 1024
+
+def prepare_entry(kit_path, file_path, arcname, rel_path):
+    """
+    Runs in a worker process: reads one entry and returns (arcname, compress_type, crc,
+    file_size, compress_size, payload). Deflated entries carry their raw deflate stream;
+    stored files carry None (the writer copies them from disk, nothing large crosses the pipe).
+    """
+    compress_type = entry_compression(arcname)
+    compressor = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, -15) if compress_type == zipfile.ZIP_DEFLATED else None
+    if file_path is None:
+        data = lazy_colors.render(kit_path, rel_path)
+        if data is None:
+            return None
+        crc, size = zlib.crc32(data), len(data)
+        payload = compressor.compress(data) + compressor.flush() if compressor else data
+    else:
+        crc = size = 0
+        out = []
+        with open(file_path, 'rb') as f:
+            for block in iter(lambda: f.read(READ_BLOCK), b""):
+                crc = zlib.crc32(block, crc)
+                size += len(block)
+                if compressor: out.append(compressor.compress(block))
+        payload = b"".join(out) + compressor.flush() if compressor else None
+    return arcname, compress_type, crc, size, len(payload) if payload is not None else size, payload
+
+def prepare_entries(kit_path, entries):
+    return [prepare_entry(kit_path, *entry) for entry in entries]
+
+def add_prepared_entry(zipf, file_path, prepared):
+    """
+    Writes one entry prepared by a worker: local header, then the payload (or the file's bytes).
+    ZipFile.close() writes the central directory from zipf.filelist, as for its own entries.
+    """
+    arcname, compress_type, crc, size, compress_size, payload = prepared
+    if file_path:
+        zinfo = zipfile.ZipInfo.from_file(file_path, arcname)
+    else:
+        zinfo = zipfile.ZipInfo(arcname, time.localtime(time.time())[:6])
+        zinfo.external_attr = 0o600 << 16
+    zinfo.compress_type = compress_type
+    zinfo.CRC = crc
+    zinfo.file_size = size
+    zinfo.compress_size = compress_size
+    zip64 = size > zipfile.ZIP64_LIMIT or compress_size > zipfile.ZIP64_LIMIT
+    zinfo.header_offset = zipf.fp.tell()
+    zipf.fp.write(zinfo.FileHeader(zip64))
+    if payload is not None:
+        zipf.fp.write(payload)
+    else:
+        with open(file_path, 'rb') as f:
+            remaining = size
+            while remaining:
+                block = f.read(min(READ_BLOCK, remaining))
+                if not block:
+                    raise IOError(f"{file_path} shrank while zipping")
+                zipf.fp.write(block)
+                remaining -= len(block)
+    zipf.filelist.append(zinfo)
+    zipf.NameToInfo[arcname] = zinfo
+    zipf.start_dir = zipf.fp.tell()
+    zipf._didModify = True
+
+def write_kit_parallel(zipf, kit_path, pool, processes):
+    """
+    Same archive as write_kit, with entries read, checksummed and deflated by the processes
+    of pool (ENTRIES_PER_TASK at a time) while this thread writes them in order.
+    """
+    pending = deque()
+    def write_oldest():
+        entries, future = pending.popleft()
+        for (file_path, _, _), prepared in zip(entries, future.result()):
+            if prepared is not None:
+                add_prepared_entry(zipf, file_path, prepared)
+    def submit(entries):
+        pending.append((entries, pool.submit(prepare_entries, kit_path, entries)))
+        if len(pending) >= processes * PENDING_PER_PROCESS:
+            write_oldest()
+    batch = []
+    for entry in kit_entries(kit_path):
+        batch.append(entry)
+        if len(batch) >= ENTRIES_PER_TASK:
+            submit(batch)
+            batch = []
+    if batch:
+        submit(batch)
+    while pending:
+        write_oldest()
+
+def zip_kit(kit_folder, out_dir=None, pool=None, processes=1):
     """
     Zips the structured items and metadata of a kit.
+    With a process pool, entries are prepared in parallel (see write_kit_parallel).
     """
     kit_path = os.path.join("downloads", kit_folder)
     if not os.path.exists(kit_path):
@@ -13,17 +249,18 @@ def zip_kit(kit_folder):
         return
 
     output_zip = f"{kit_folder}.zip"
+    if out_dir:
+        os.makedirs(out_dir, exist_ok=True)
+        output_zip = os.path.join(out_dir, output_zip)
     print(f"Zipping {kit_folder} to {output_zip}...")
     
     start_time = time.time()
     
     with zipfile.ZipFile(output_zip, 'w', zipfile.ZIP_DEFLATED) as zipf:
-        for root, dirs, files in os.walk(kit_path):
-            for file in files:
-                file_path = os.path.join(root, file)
-                # Create relative path for zip (preserving folder structure inside kit_folder)
-                arcname = os.path.relpath(file_path, os.path.dirname(kit_path))
-                zipf.write(file_path, arcname)
+        if pool is not None:
+            write_kit_parallel(zipf, kit_path, pool, processes)
+        else:
+            write_kit(zipf, kit_path)
 
     end_time = time.time()
     size_mb = os.path.getsize(output_zip) / (1024 * 1024)
@@ -34,10 +271,79 @@ def zip_kit(kit_folder):
     
     return os.path.abspath(output_zip)
 
+def export_kits(kit_folders, processes, parallel_kits=2, out_dir=None):
+    """
+    Zips many kits with one pool of `processes` worker processes (the core budget), shared
+    by up to `parallel_kits` kits written at the same time.
+    """
+    start_time = time.time()
+    failed = []
+    with ProcessPoolExecutor(max_workers=processes) as pool, \
+         ThreadPoolExecutor(max_workers=max(1, min(parallel_kits, len(kit_folders)))) as writers:
+        futures = {writers.submit(zip_kit, kit, out_dir, pool, processes): kit for kit in kit_folders}
+        for future in as_completed(futures):
+            try:
+                if not future.result(): failed.append(futures[future])
+            except Exception as e:
+                print(f"Error zipping {futures[future]}: {e}")
+                failed.append(futures[future])
+    print(f"\nExported {len(kit_folders) - len(failed)}/{len(kit_folders)} kits in {time.time() - start_time:.2f} seconds")
+    for kit in failed:
+        print(f"  FAILED: {kit}")
+    return failed
+
+def list_kits():
+    """
+    Every downloaded kit folder (the ones with items_structured).
+    """
+    if not os.path.isdir("downloads"):
+        return []
+    return sorted(entry for entry in os.listdir("downloads")
+                  if os.path.isdir(os.path.join("downloads", entry, "items_structured")))
+
+# Flags followed by a value
+VALUE_FLAGS = {"--processes", "--parallel-kits", "--out"}
+
 if __name__ == "__main__":
     if len(sys.argv) < 2:
-        print("Usage: python zip_neka_kit.py <kit_folder_name>")
+        print("Usage: python zip_neka_kit.py <kit_folder_name> [more kits...]")
         print("Example: python zip_neka_kit.py MLP捏个小马_11628")
+        print("Example: python zip_neka_kit.py --all --processes 8 --out exports")
+        print("Options: --all (every kit in downloads/)")
+        print("         --processes N (worker processes reading/compressing entries; the core budget of the run)")
+        print("         --parallel-kits N (kits written at the same time, sharing the processes, default 2)")
+        print("         --out DIR (where the zips go, default current folder)")
+        sys.exit(1)
+
+    kit_folders = []
+    skip_next = False
+    for a in sys.argv[1:]:
+        if skip_next:
+            skip_next = False
+        elif a in VALUE_FLAGS:
+            skip_next = True
+        elif not a.startswith("--"):
+            kit_folders.append(a)
+    if "--all" in sys.argv:
+        kit_folders += [kit for kit in list_kits() if kit not in kit_folders]
+
+    processes = 1
+    if "--processes" in sys.argv:
+        try:
+            processes = max(1, int(get_flag_value("--processes")))
+        except (TypeError, ValueError):
+            print("Invalid --processes value, zipping on one thread.")
+    parallel_kits = 2
+    if "--parallel-kits" in sys.argv:
+        try:
+            parallel_kits = max(1, int(get_flag_value("--parallel-kits")))
+        except (TypeError, ValueError):
+            print("Invalid --parallel-kits value, using 2.")
+    out_dir = get_flag_value("--out")
+
+    if processes == 1 and len(kit_folders) == 1:
+        zip_kit(kit_folders[0], out_dir)
+    elif kit_folders:
+        export_kits(kit_folders, processes, parallel_kits, out_dir)
     else:
-        kit_folder = sys.argv[1]
-        zip_kit(kit_folder)
+        print("No kits to zip.")